@@ -0,0 +1,183 @@
+"""
+Running per-session aggregates
+
+Predictions are folded into constant-size running sums as they arrive so that
+ending a session is O(1) and exact regardless of its length.
+"""
+from collections import OrderedDict
+from datetime import datetime
+from typing import Any, Dict, List, Optional
+
+
+class SessionAggregate:
+    """Running sums, extremes and a time-bucketed histogram for one session"""
+
+    __slots__ = (
+        "started_at", "bucket_s", "count", "emotion_sums",
+        "stress_sum", "stress_min", "stress_max", "buckets"
+    )
+
+    def __init__(self, started_at: datetime, bucket_s: int = 60):
+        self.started_at = started_at
+        self.bucket_s = max(1, bucket_s)
+        self.count = 0
+        self.emotion_sums: Dict[str, float] = {}
+        self.stress_sum = 0.0
+        self.stress_min: Optional[float] = None
+        self.stress_max: Optional[float] = None
+        # bucket index -> {"count", "stress_sum", "emotion_sums"}
+        self.buckets: Dict[int, Dict[str, Any]] = {}
+
+    def add(self, emotion_prob: Dict[str, float], stress_score: float, timestamp: datetime):
+        """Fold one prediction into the running aggregates"""
+        self.count += 1
+        for emotion, prob in emotion_prob.items():
+            self.emotion_sums[emotion] = self.emotion_sums.get(emotion, 0.0) + prob
+
+        self.stress_sum += stress_score
+        self.stress_min = stress_score if self.stress_min is None else min(self.stress_min, stress_score)
+        self.stress_max = stress_score if self.stress_max is None else max(self.stress_max, stress_score)
+
+        index = max(0, int((timestamp - self.started_at).total_seconds() // self.bucket_s))
+        bucket = self.buckets.get(index)
+        if bucket is None:
+            bucket = self.buckets[index] = {"count": 0, "stress_sum": 0.0, "emotion_sums": {}}
+        bucket["count"] += 1
+        bucket["stress_sum"] += stress_score
+        sums = bucket["emotion_sums"]
+        for emotion, prob in emotion_prob.items():
+            sums[emotion] = sums.get(emotion, 0.0) + prob
+
+    def to_dict(self) -> Dict[str, Any]:
+        """Aggregates in the shape stored on the session document"""
+        if self.count == 0:
+            return {}
+
+        emotion_avg = {emotion: total / self.count for emotion, total in self.emotion_sums.items()}
+        dominant_mood = max(emotion_avg, key=emotion_avg.get) if emotion_avg else "neutral"
+
+        timeline = []
+        for index in sorted(self.buckets):
+            bucket = self.buckets[index]
+            sums = bucket["emotion_sums"]
+            timeline.append({
+                "offset_s": index * self.bucket_s,
+                "count": bucket["count"],
+                "stress_score": round(bucket["stress_sum"] / bucket["count"], 2),
+                "dominant_mood": max(sums, key=sums.get) if sums else "neutral",
+            })
+
+        return {
+            "dominant_mood": dominant_mood,
+            "stress_score": round(self.stress_sum / self.count, 2),
+            "prediction_count": self.count,
+            "emotion_avg": {emotion: round(prob, 4) for emotion, prob in emotion_avg.items()},
+            "stress_min": round(self.stress_min, 2),
+            "stress_max": round(self.stress_max, 2),
+            "bucket_s": self.bucket_s,
+            "timeline": timeline,
+        }
+
+
+class SessionAggregator:
+    """Registry of running aggregates for active sessions"""
+
+    def __init__(self, bucket_s: int = 60, max_sessions: int = 10000):
+        self.bucket_s = bucket_s
+        self.max_sessions = max_sessions
+        self._sessions: "OrderedDict[str, SessionAggregate]" = OrderedDict()
+        # Evicted sessions are no longer exact here and fall back to the database pipeline
+        self._evicted: "OrderedDict[str, None]" = OrderedDict()
+        self.evicted = 0
+
+    def add(self, session_id: str, started_at: datetime, prediction: Dict, timestamp: datetime):
+        """Record a prediction for an active session"""
+        aggregate = self._sessions.get(session_id)
+        if aggregate is None:
+            if session_id in self._evicted:
+                return
+            aggregate = self._sessions[session_id] = SessionAggregate(started_at, self.bucket_s)
+            while len(self._sessions) > self.max_sessions:
+                evicted_id, _ = self._sessions.popitem(last=False)
+                self._evicted[evicted_id] = None
+                self.evicted += 1
+            while len(self._evicted) > self.max_sessions:
+                self._evicted.popitem(last=False)
+        else:
+            self._sessions.move_to_end(session_id)
+
+        aggregate.add(prediction["emotion_prob"], prediction["stress_score"], timestamp)
+
+    def get(self, session_id: str) -> Optional[SessionAggregate]:
+        """Live aggregates for a running session, if tracked"""
+        return self._sessions.get(session_id)
+
+    def pop(self, session_id: str) -> Optional[SessionAggregate]:
+        """Remove and return a session's aggregates when it ends"""
+        self._evicted.pop(session_id, None)
+        return self._sessions.pop(session_id, None)
+
+    def __len__(self) -> int:
+        return len(self._sessions)
+
+
+def aggregate_pipeline(session_oid, started_at: datetime, bucket_s: int, emotions: List[str]) -> List[Dict]:
+    """
+    Server-side equivalent of SessionAggregate, used when a session's running
+    aggregates are not held by this process (e.g. after a restart)
+    """
+    emotion_sums = {f"emotion_{e}": {"$sum": f"$emotion_prob.{e}"} for e in emotions}
+    return [
+        {"$match": {"session_id": session_oid}},
+        {"$facet": {
+            "totals": [
+                {"$group": {
+                    "_id": None,
+                    "count": {"$sum": 1},
+                    "stress_sum": {"$sum": "$stress_score"},
+                    "stress_min": {"$min": "$stress_score"},
+                    "stress_max": {"$max": "$stress_score"},
+                    **emotion_sums,
+                }},
+            ],
+            "buckets": [
+                {"$group": {
+                    "_id": {"$floor": {"$divide": [
+                        {"$subtract": ["$timestamp", started_at]}, bucket_s * 1000
+                    ]}},
+                    "count": {"$sum": 1},
+                    "stress_sum": {"$sum": "$stress_score"},
+                    **emotion_sums,
+                }},
+            ],
+        }},
+    ]
+
+
+def aggregate_from_pipeline(result: Dict, started_at: datetime, bucket_s: int) -> SessionAggregate:
+    """Build a SessionAggregate from the output of aggregate_pipeline"""
+    aggregate = SessionAggregate(started_at, bucket_s)
+    if not result.get("totals"):
+        return aggregate
+
+    def emotion_sums(doc: Dict) -> Dict[str, float]:
+        return {
+            key[len("emotion_"):]: value or 0.0
+            for key, value in doc.items() if key.startswith("emotion_")
+        }
+
+    totals = result["totals"][0]
+    aggregate.count = totals["count"]
+    aggregate.stress_sum = totals["stress_sum"] or 0.0
+    aggregate.stress_min = totals["stress_min"]
+    aggregate.stress_max = totals["stress_max"]
+    aggregate.emotion_sums = emotion_sums(totals)
+
+    for bucket in result.get("buckets", []):
+        aggregate.buckets[max(0, int(bucket["_id"] or 0))] = {
+            "count": bucket["count"],
+            "stress_sum": bucket["stress_sum"] or 0.0,
+            "emotion_sums": emotion_sums(bucket),
+        }
+    return aggregate
+
@@ -0,0 +1,227 @@
+"""
+Cross-session analytics computed with MongoDB aggregation pipelines
+"""
+import time
+from collections import OrderedDict
+from datetime import datetime, timedelta
+from typing import Any, Dict, List, Optional, Tuple
+
+from motor.motor_asyncio import AsyncIOMotorDatabase
+
+from .config import settings
+
+
+GRANULARITIES = {
+    "day": timedelta(days=1),
+    "hour": timedelta(hours=1),
+}
+
+STRESS_BOUNDARIES = [0.0, 0.2, 0.4, 0.6, 0.8, 1.000001]
+
+
+def bucket_boundaries(granularity: str, days: int, now: datetime) -> List[datetime]:
+    """Period boundaries aligned to UTC days or hours, ending after `now`"""
+    step = GRANULARITIES[granularity]
+    if granularity == "day":
+        end = now.replace(hour=0, minute=0, second=0, microsecond=0) + step
+    else:
+        end = now.replace(minute=0, second=0, microsecond=0) + step
+    start = end - timedelta(days=days)
+
+    boundaries = []
+    current = start
+    while current <= end:
+        boundaries.append(current)
+        current += step
+    return boundaries
+
+
+def prediction_trends_pipeline(session_ids: List[Any], boundaries: List[datetime], emotions: List[str]) -> List[Dict]:
+    """Stress and emotion distributions per period, served by the (session_id, timestamp) index"""
+    return [
+        {"$match": {
+            "session_id": {"$in": session_ids},
+            "timestamp": {"$gte": boundaries[0], "$lt": boundaries[-1]},
+        }},
+        {"$facet": {
+            "periods": [
+                {"$bucket": {
+                    "groupBy": "$timestamp",
+                    "boundaries": boundaries,
+                    "output": {
+                        "count": {"$sum": 1},
+                        "stress_avg": {"$avg": "$stress_score"},
+                        "stress_max": {"$max": "$stress_score"},
+                        **{e: {"$avg": f"$emotion_prob.{e}"} for e in emotions},
+                    },
+                }},
+            ],
+            "stress_distribution": [
+                {"$bucket": {
+                    "groupBy": "$stress_score",
+                    "boundaries": STRESS_BOUNDARIES,
+                    "default": "other",
+                    "output": {"count": {"$sum": 1}},
+                }},
+            ],
+        }},
+    ]
+
+
+def session_trends_pipeline(user_id: str, boundaries: List[datetime]) -> List[Dict]:
+    """Session counts, durations and dominant moods per period, served by the (user_id, started_at) index"""
+    return [
+        {"$match": {
+            "user_id": user_id,
+            "started_at": {"$gte": boundaries[0], "$lt": boundaries[-1]},
+        }},
+        {"$facet": {
+            "periods": [
+                {"$bucket": {
+                    "groupBy": "$started_at",
+                    "boundaries": boundaries,
+                    "output": {
+                        "sessions": {"$sum": 1},
+                        "duration_s": {"$sum": "$duration_s"},
+                    },
+                }},
+            ],
+            "moods": [
+                {"$match": {"aggregates.dominant_mood": {"$exists": True}}},
+                {"$group": {"_id": "$aggregates.dominant_mood", "count": {"$sum": 1}}},
+            ],
+        }},
+    ]
+
+
+class TrendsCache:
+    """
+    Per-user trends cache of one worker
+
+    Entries carry the user's trends version from the session state store
+    and only match that version, so a session ended on any worker
+    invalidates them everywhere. While the store is unreachable (version
+    None) or with the per-worker memory store, another worker's change
+    shows up here only once the entry is ttl_s old.
+    """
+
+    def __init__(self, ttl_s: float = 300.0, max_entries: int = 10000):
+        self.ttl_s = ttl_s
+        self.max_entries = max(1, max_entries)
+        # (user_id, granularity, days) -> (stored_at, version, trends), least recently used first
+        self._entries: "OrderedDict[Tuple[str, str, int], Tuple[float, Optional[str], Dict]]" = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def _expired(self, entry: Tuple[float, Optional[str], Dict], now: float) -> bool:
+        return now - entry[0] > self.ttl_s
+
+    def get(self, key: Tuple[str, str, int], version: Optional[str] = None):
+        entry = self._entries.get(key)
+        if entry is not None and (entry[1] != version or self._expired(entry, time.monotonic())):
+            # Superseded or expired: it can never be served again
+            del self._entries[key]
+            entry = None
+        if entry is None:
+            self.misses += 1
+            return None
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return entry[2]
+
+    def set(self, key: Tuple[str, str, int], value: Dict, version: Optional[str] = None):
+        now = time.monotonic()
+        self._entries[key] = (now, version, value)
+        self._entries.move_to_end(key)
+        # Drop least recently used entries over capacity, and expired ones at the front
+        while self._entries:
+            oldest = next(iter(self._entries.values()))
+            if len(self._entries) <= self.max_entries and not self._expired(oldest, now):
+                break
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+    def invalidate(self, user_id: str):
+        """Drop every cached result for a user in this worker"""
+        for key in [k for k in self._entries if k[0] == user_id]:
+            del self._entries[key]
+
+
+async def compute_user_trends(
+    database: AsyncIOMotorDatabase,
+    user_id: str,
+    granularity: str,
+    days: int,
+    emotions: List[str]
+) -> Dict:
+    """Run the session and prediction pipelines and shape the response"""
+    now = datetime.utcnow()
+    boundaries = bucket_boundaries(granularity, days, now)
+    since, until = boundaries[0], boundaries[-1]
+
+    # Sessions that may have predictions inside the window
+    session_ids = await database.sessions.distinct("_id", {
+        "user_id": user_id,
+        "started_at": {"$lt": until},
+        "$or": [{"ended_at": None}, {"ended_at": {"$gte": since}}],
+    })
+
+    prediction_result = {"periods": [], "stress_distribution": []}
+    if session_ids:
+        results = await database.predictions.aggregate(
+            prediction_trends_pipeline(session_ids, boundaries, emotions)
+        ).to_list(length=1)
+        if results:
+            prediction_result = results[0]
+
+    results = await database.sessions.aggregate(
+        session_trends_pipeline(user_id, boundaries)
+    ).to_list(length=1)
+    session_result = results[0] if results else {"periods": [], "moods": []}
+
+    periods = {}
+    for bucket in prediction_result["periods"]:
+        periods[bucket["_id"]] = {
+            "start": bucket["_id"],
+            "count": bucket["count"],
+            "stress_avg": round(bucket["stress_avg"] or 0.0, 3),
+            "stress_max": round(bucket["stress_max"] or 0.0, 3),
+            "emotion_avg": {e: round(bucket.get(e) or 0.0, 4) for e in emotions},
+            "sessions": 0,
+            "duration_s": 0,
+        }
+    for bucket in session_result["periods"]:
+        period = periods.setdefault(bucket["_id"], {
+            "start": bucket["_id"],
+            "count": 0,
+            "stress_avg": None,
+            "stress_max": None,
+            "emotion_avg": {},
+        })
+        period["sessions"] = bucket["sessions"]
+        period["duration_s"] = bucket["duration_s"] or 0
+
+    stress_distribution = [
+        {
+            "min": bucket["_id"],
+            "max": round(STRESS_BOUNDARIES[STRESS_BOUNDARIES.index(bucket["_id"]) + 1], 2) if bucket["_id"] != "other" else None,
+            "count": bucket["count"],
+        }
+        for bucket in prediction_result["stress_distribution"]
+    ]
+
+    return {
+        "user_id": user_id,
+        "granularity": granularity,
+        "since": since,
+        "until": until,
+        "periods": [periods[key] for key in sorted(periods)],
+        "stress_distribution": stress_distribution,
+        "mood_distribution": {m["_id"]: m["count"] for m in session_result["moods"] if m["_id"]},
+        "session_count": len(session_ids),
+    }
+
+
+# Global trends cache
+trends_cache = TrendsCache(ttl_s=settings.trends_cache_ttl_s, max_entries=settings.trends_cache_max_entries)
@@ -1,8 +1,9 @@
 """
 Configuration management using pydantic-settings
 """
+from pydantic import Field
 from pydantic_settings import BaseSettings, SettingsConfigDict
-from typing import List
+from typing import List, Optional
 
 
 class Settings(BaseSettings):
@@ -11,6 +12,7 @@ class Settings(BaseSettings):
     # MongoDB
     mongo_uri: str = "mongodb://localhost:27017"
     mongo_db_name: str = "har_db"
+    prediction_ttl_days: Optional[int] = None  # expire raw predictions after N days
     
     # API
     api_host: str = "0.0.0.0"
@@ -22,8 +24,53 @@ class Settings(BaseSettings):
     
     # Model
     model_path: str = "../models/emotion_model.pth"
-    model_type: str = "pytorch"
-    inference_batch_size: int = 1
+    model_type: str = "pytorch"  # pytorch | torchscript | onnx
+    model_registry_dir: Optional[str] = None  # versioned artifacts; overrides model_path when set
+    model_registry_poll_s: float = 5.0  # hot-swap newer registry versions (0 = admin endpoint only)
+    model_warmup_batches: int = 2  # dummy batches run before a model is swapped in
+    inference_executor: str = "thread"  # thread | process (model copy per worker process)
+    inference_workers: int = 1  # batches run concurrently, one per worker
+    inference_threads: int = 0  # intra-op threads per worker (0 = cores / workers)
+    inference_max_pending: int = 512  # frames queued or running before new ones are rejected (0 = unbounded)
+    inference_batch_size: int = 16
+    inference_max_wait_ms: float = 5.0
+    temporal_max_sessions: int = 10000  # per-session hidden states kept for temporal models
+    temporal_idle_ttl_s: float = 1800.0
+    prediction_cache_size: int = 4096  # LRU entries keyed on quantized features (0 = off)
+    prediction_cache_precision: float = 1e-3  # quantization step for cache keys
+    
+    # Frame governor (per WebSocket session)
+    governor_target_fps: float = 15.0  # max inferences per second per session (0 = uncapped)
+    governor_min_fps: float = 2.0  # floor while the inference queue is saturated
+    governor_queue_high: int = 64  # frames pending inference treated as saturated
+    governor_skip_delta: float = 0.005  # reuse the last prediction below this L2 feature delta (0 = off)
+    governor_max_skip_s: float = 1.0  # re-run inference at least this often for unchanged frames
+    
+    # Persistence (write-behind buffer for predictions and insights)
+    persist_batch_size: int = 500
+    persist_flush_interval_ms: float = 200.0
+    persist_max_pending: int = 20000
+    persist_enqueue_timeout_ms: float = 50.0
+    
+    # Session aggregates
+    aggregate_bucket_s: int = 60
+    aggregate_max_sessions: int = 10000
+    
+    # Recommendations (per-session history)
+    recommendation_history_size: int = Field(10, ge=1)
+    recommendation_window: int = Field(5, ge=1)
+    recommendation_max_sessions: int = 10000
+    recommendation_idle_ttl_s: float = 1800.0
+    
+    # Session state store (recommendation history and aggregates)
+    session_store: str = "memory"  # memory | socket (shared by workers: python -m app.session_state)
+    session_store_address: str = "/tmp/har-session-state.sock"  # Unix socket path or host:port
+    session_store_timeout_s: float = 1.0
+    session_store_token: Optional[str] = None  # shared secret; required when the server listens on TCP
+    
+    # Analytics
+    trends_cache_ttl_s: float = 300.0
+    trends_cache_max_entries: int = 10000  # (user, granularity, days) results kept per worker
     
     # Features
     enable_tfjs_fallback: bool = True
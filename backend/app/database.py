@@ -4,6 +4,8 @@ MongoDB database connection and utilities
 from motor.motor_asyncio import AsyncIOMotorClient, AsyncIOMotorDatabase
 from typing import Optional
 from .config import settings
+from .indexes import apply_indexes
+from .metrics import pool_listener, mongo_pool_max
 
 
 class Database:
@@ -14,7 +16,8 @@ class Database:
     
     async def connect(self):
         """Connect to MongoDB"""
-        self.client = AsyncIOMotorClient(settings.mongo_uri)
+        self.client = AsyncIOMotorClient(settings.mongo_uri, event_listeners=[pool_listener])
+        mongo_pool_max.set(self.client.options.pool_options.max_pool_size)
         self.db = self.client[settings.mongo_db_name]
         
         # Create indexes
@@ -28,18 +31,13 @@ class Database:
             print("✓ Disconnected from MongoDB")
     
     async def _create_indexes(self):
-        """Create database indexes for performance"""
-        # Sessions indexes
-        await self.db.sessions.create_index("user_id")
-        await self.db.sessions.create_index("started_at")
-        
-        # Predictions indexes
-        await self.db.predictions.create_index("session_id")
-        await self.db.predictions.create_index("timestamp")
-        
-        # Insights indexes
-        await self.db.insights.create_index("session_id")
-        await self.db.insights.create_index("generated_at")
+        """Create database indexes for performance (see indexes.py)"""
+        report = await apply_indexes(self.db)
+        for action, names in report.items():
+            if names and action == "pending":
+                print(f"⚠ Indexes pending migration (python -m app.indexes --migrate): {', '.join(names)}")
+            elif names:
+                print(f"✓ Indexes {action}: {', '.join(names)}")
 
 
 # Global database instance
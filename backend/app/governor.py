@@ -0,0 +1,214 @@
+"""
+Per-session frame-rate governor for the real-time WebSocket
+
+Clients send frames as fast as MediaPipe produces them. The governor sits
+between the socket reader and inference:
+
+- caps inference to a target rate per session; frames arriving faster are
+  coalesced, only the latest one is kept
+- skips inference when the feature vector moved less than an L2 threshold
+  since the last inferred frame, so the previous prediction is reused
+- lowers the rate while the global inference queue is saturated and
+  recovers gradually once it drains
+"""
+import asyncio
+import time
+from typing import Any, Callable, Dict, Optional, Tuple
+
+import numpy as np
+from fastapi import WebSocketDisconnect
+
+from .config import settings
+
+
+def flatten_features(features: Dict[str, Any]) -> np.ndarray:
+    """face_kp followed by pose_kp as one float32 vector"""
+    return np.concatenate([
+        np.asarray(features.get("face_kp", []), dtype=np.float32).ravel(),
+        np.asarray(features.get("pose_kp", []), dtype=np.float32).ravel()
+    ])
+
+
+class GovernorStats:
+    """Counters shared by all session governors"""
+
+    def __init__(self):
+        self.active_sessions = 0
+        self.received = 0
+        self.coalesced = 0
+        self.skipped = 0
+        self.inferred = 0
+        self.rate_drops = 0
+        self.saturated = False
+
+    def stats(self) -> Dict[str, Any]:
+        processed = self.skipped + self.inferred
+        return {
+            "active_sessions": self.active_sessions,
+            "received": self.received,
+            "coalesced": self.coalesced,
+            "skipped": self.skipped,
+            "inferred": self.inferred,
+            "rate_drops": self.rate_drops,
+            "saturated": self.saturated,
+            "skip_ratio": round(self.skipped / processed, 3) if processed else 0.0,
+            "coalesce_ratio": round(self.coalesced / self.received, 3) if self.received else 0.0,
+        }
+
+
+class FrameGovernor:
+    """Rate cap, burst coalescing and duplicate-frame skipping for one session"""
+
+    def __init__(
+        self,
+        queue_depth: Callable[[], int],
+        target_fps: float = 15.0,
+        min_fps: float = 2.0,
+        queue_high: int = 64,
+        skip_delta: float = 0.005,
+        max_skip_s: float = 1.0,
+        stats: Optional[GovernorStats] = None
+    ):
+        self.queue_depth = queue_depth
+        self.target_fps = max(0.0, target_fps)
+        self.min_fps = min(max(0.1, min_fps), self.target_fps) if self.target_fps else 0.0
+        self.queue_high = max(1, queue_high)
+        self.skip_delta = max(0.0, skip_delta)
+        self.max_skip_s = max(0.0, max_skip_s)
+        self.stats = stats if stats is not None else GovernorStats()
+
+        self.fps = self.target_fps
+        self._latest: Optional[Tuple[int, Dict[str, Any]]] = None
+        self._latest_at = 0.0
+        # perf_counter() when the frame returned by next_frame() was received
+        self.received_at = 0.0
+        self._ready = asyncio.Event()
+        self._closed: Optional[BaseException] = None
+        self._next_at = 0.0
+
+        # Last inferred frame and its result, reused for near-identical frames
+        self._last_vector: Optional[np.ndarray] = None
+        self._last_result: Any = None
+        self._last_result_at = 0.0
+
+        # Per-session counters
+        self.received = 0
+        self.coalesced = 0
+        self.skipped = 0
+        self.inferred = 0
+
+    def __enter__(self):
+        self.stats.active_sessions += 1
+        return self
+
+    def __exit__(self, *exc):
+        self.stats.active_sessions -= 1
+        self.close()
+
+    def offer(self, timestamp: int, features: Dict[str, Any]):
+        """Called by the socket reader; replaces any frame still waiting"""
+        self.received += 1
+        self.stats.received += 1
+        if self._latest is not None:
+            self.coalesced += 1
+            self.stats.coalesced += 1
+        self._latest = (timestamp, features)
+        self._latest_at = time.perf_counter()
+        self._ready.set()
+
+    def close(self, exc: Optional[BaseException] = None):
+        """Wake the consumer so next_frame() raises (disconnect or reader error)"""
+        if self._closed is None:
+            self._closed = exc or WebSocketDisconnect(1000)
+        self._ready.set()
+
+    def _adapt(self):
+        """Halve the rate while the inference queue is saturated, recover by 10% of target per frame"""
+        if not self.target_fps:
+            return
+        saturated = self.queue_depth() >= self.queue_high
+        self.stats.saturated = saturated
+        if saturated:
+            if self.fps > self.min_fps:
+                self.fps = max(self.min_fps, self.fps * 0.5)
+                self.stats.rate_drops += 1
+        elif self.fps < self.target_fps:
+            self.fps = min(self.target_fps, self.fps + self.target_fps * 0.1)
+
+    async def next_frame(self) -> Tuple[int, Dict[str, Any]]:
+        """Wait for the next frame allowed by the rate cap; always the most recent one"""
+        while self._latest is None:
+            if self._closed is not None:
+                raise self._closed
+            self._ready.clear()
+            await self._ready.wait()
+
+        self._adapt()
+        if self.fps:
+            delay = self._next_at - time.monotonic()
+            if delay > 0:
+                # Frames arriving meanwhile replace self._latest (coalesced)
+                await asyncio.sleep(delay)
+            self._next_at = time.monotonic() + 1.0 / self.fps
+
+        if self._closed is not None:
+            raise self._closed
+        frame, self._latest = self._latest, None
+        self.received_at = self._latest_at
+        return frame
+
+    def reuse(self, features: Dict[str, Any]) -> Tuple[Any, Optional[np.ndarray]]:
+        """
+        The previous result if this frame barely differs from the last inferred one
+
+        Returns (result or None, flattened vector to pass to remember()).
+        """
+        if not self.skip_delta:
+            return None, None
+        vector = flatten_features(features)
+        last = self._last_vector
+        if (
+            last is not None
+            and last.shape == vector.shape
+            and time.monotonic() - self._last_result_at < self.max_skip_s
+            and float(np.linalg.norm(vector - last)) < self.skip_delta
+        ):
+            self.skipped += 1
+            self.stats.skipped += 1
+            return self._last_result, vector
+        return None, vector
+
+    def remember(self, vector: Optional[np.ndarray], result: Any):
+        """Record a freshly inferred frame as the reference for skipping"""
+        self.inferred += 1
+        self.stats.inferred += 1
+        if vector is not None:
+            self._last_vector = vector
+            self._last_result = result
+            self._last_result_at = time.monotonic()
+
+    def session_stats(self) -> Dict[str, Any]:
+        return {
+            "fps": round(self.fps, 2),
+            "received": self.received,
+            "coalesced": self.coalesced,
+            "skipped": self.skipped,
+            "inferred": self.inferred,
+        }
+
+
+# Global governor counters
+governor_stats = GovernorStats()
+
+
+def create_governor(queue_depth: Callable[[], int]) -> FrameGovernor:
+    """Governor for a new WebSocket session, configured from settings"""
+    return FrameGovernor(
+        queue_depth,
+        target_fps=settings.governor_target_fps,
+        min_fps=settings.governor_min_fps,
+        queue_high=settings.governor_queue_high,
+        skip_delta=settings.governor_skip_delta,
+        max_skip_s=settings.governor_max_skip_s,
+        stats=governor_stats
+    )
@@ -0,0 +1,199 @@
+"""
+Declarative MongoDB index specification and idempotent migrations
+
+Indexes are declared once here and reconciled against the live collections
+at startup: missing indexes are created and TTL changes are applied in place.
+Destructive steps (rebuilding an index to add or remove a TTL, dropping
+indexes superseded by a compound index) would race between workers starting
+together, so they only run from the migration command:
+
+    python -m app.indexes --migrate
+"""
+from typing import Any, Dict, List, Optional, Tuple
+
+from motor.motor_asyncio import AsyncIOMotorDatabase
+from pymongo import ASCENDING, DESCENDING
+from pymongo.errors import OperationFailure
+
+from .config import settings
+
+
+class IndexSpec:
+    """A single index on a collection"""
+
+    def __init__(
+        self,
+        collection: str,
+        keys: List[Tuple[str, int]],
+        expire_after_seconds: Optional[int] = None
+    ):
+        self.collection = collection
+        self.keys = keys
+        self.expire_after_seconds = expire_after_seconds
+
+    @property
+    def name(self) -> str:
+        """Same naming scheme MongoDB uses by default"""
+        return "_".join(f"{field}_{direction}" for field, direction in self.keys)
+
+
+def index_specs() -> List[IndexSpec]:
+    """Indexes required by the API's queries"""
+    prediction_ttl = settings.prediction_ttl_days * 86400 if settings.prediction_ttl_days else None
+    return [
+        # list_sessions / trends: find({"user_id"}).sort([("started_at", -1), ("_id", -1)]),
+        # _id as the keyset pagination tiebreak
+        IndexSpec("sessions", [("user_id", ASCENDING), ("started_at", DESCENDING), ("_id", DESCENDING)]),
+        IndexSpec("sessions", [("started_at", DESCENDING), ("_id", DESCENDING)]),
+
+        # Session predictions in time order, trends windows
+        IndexSpec("predictions", [("session_id", ASCENDING), ("timestamp", ASCENDING)]),
+        # Optional retention for raw predictions (session aggregates are kept)
+        IndexSpec("predictions", [("timestamp", ASCENDING)], expire_after_seconds=prediction_ttl),
+
+        # Session insights in time order (paginated on generated_at, _id)
+        IndexSpec("insights", [("session_id", ASCENDING), ("generated_at", ASCENDING), ("_id", ASCENDING)]),
+        IndexSpec("insights", [("generated_at", ASCENDING)]),
+    ]
+
+
+# Indexes that are prefixes of a compound index above
+SUPERSEDED_INDEXES: Dict[str, List[str]] = {
+    "sessions": ["user_id_1", "user_id_1_started_at_-1", "started_at_1"],
+    "predictions": ["session_id_1"],
+    "insights": ["session_id_1", "session_id_1_generated_at_1"],
+}
+
+
+# Server error codes raised when another worker reconciled the same index first
+INDEX_NOT_FOUND = 27
+INDEX_ALREADY_EXISTS = 68
+INDEX_OPTIONS_CONFLICT = 85
+INDEX_KEY_SPECS_CONFLICT = 86
+_RACE_CODES = {INDEX_NOT_FOUND, INDEX_ALREADY_EXISTS, INDEX_OPTIONS_CONFLICT, INDEX_KEY_SPECS_CONFLICT}
+
+
+async def _tolerate_races(operation) -> bool:
+    """Await a create/drop/collMod; False if another worker already applied it"""
+    try:
+        await operation
+    except OperationFailure as e:
+        if e.code not in _RACE_CODES:
+            raise
+        return False
+    return True
+
+
+async def apply_indexes(database: AsyncIOMotorDatabase, migrate: bool = False) -> Dict[str, List[str]]:
+    """
+    Reconcile the declared indexes with the database
+
+    On startup (migrate=False) only non-destructive steps run: missing
+    indexes are created and TTLs changed in place with collMod, so any
+    number of workers can start at once. Rebuilding an index to add or
+    remove its TTL and dropping superseded indexes are reported as
+    "pending" and applied by `python -m app.indexes --migrate`.
+
+    Returns:
+        {"created": [...], "updated": [...], "dropped": [...], "pending": [...]}
+        as "collection.index" names
+    """
+    report = {"created": [], "updated": [], "dropped": [], "pending": []}
+    specs = index_specs()
+
+    for collection in sorted({spec.collection for spec in specs} | set(SUPERSEDED_INDEXES)):
+        coll = database[collection]
+        existing = await coll.index_information()
+
+        for spec in (s for s in specs if s.collection == collection):
+            info = existing.get(spec.name)
+            options = {}
+            if spec.expire_after_seconds is not None:
+                options["expireAfterSeconds"] = spec.expire_after_seconds
+
+            if info is None:
+                if await _tolerate_races(coll.create_index(spec.keys, name=spec.name, **options)):
+                    report["created"].append(f"{collection}.{spec.name}")
+                continue
+
+            current_ttl = info.get("expireAfterSeconds")
+            if current_ttl == spec.expire_after_seconds:
+                continue
+
+            if current_ttl is not None and spec.expire_after_seconds is not None:
+                # TTL can be changed in place
+                await _tolerate_races(database.command({
+                    "collMod": collection,
+                    "index": {"name": spec.name, "expireAfterSeconds": spec.expire_after_seconds},
+                }))
+                report["updated"].append(f"{collection}.{spec.name}")
+            elif migrate:
+                # Adding or removing a TTL requires rebuilding the index
+                await _tolerate_races(coll.drop_index(spec.name))
+                await _tolerate_races(coll.create_index(spec.keys, name=spec.name, **options))
+                report["updated"].append(f"{collection}.{spec.name}")
+            else:
+                report["pending"].append(f"{collection}.{spec.name}")
+
+        for name in SUPERSEDED_INDEXES.get(collection, []):
+            if name not in existing:
+                continue
+            if not migrate:
+                report["pending"].append(f"{collection}.{name}")
+            elif await _tolerate_races(coll.drop_index(name)):
+                report["dropped"].append(f"{collection}.{name}")
+
+    return report
+
+
+async def index_report(database: AsyncIOMotorDatabase) -> Dict[str, Any]:
+    """Per-collection index usage ($indexStats) and storage sizes (collStats)"""
+    collections = sorted({spec.collection for spec in index_specs()})
+    report = {}
+
+    for collection in collections:
+        usage = await database[collection].aggregate([{"$indexStats": {}}]).to_list(length=None)
+        stats = await database.command("collStats", collection)
+
+        report[collection] = {
+            "count": stats.get("count", 0),
+            "size_bytes": stats.get("size", 0),
+            "storage_size_bytes": stats.get("storageSize", 0),
+            "total_index_size_bytes": stats.get("totalIndexSize", 0),
+            "indexes": [
+                {
+                    "name": index["name"],
+                    "key": dict(index["key"]),
+                    "ops": index["accesses"]["ops"],
+                    "since": index["accesses"]["since"],
+                    "size_bytes": stats.get("indexSizes", {}).get(index["name"], 0),
+                }
+                for index in sorted(usage, key=lambda i: i["name"])
+            ],
+        }
+
+    return report
+
+
+async def _migrate():
+    from motor.motor_asyncio import AsyncIOMotorClient
+
+    client = AsyncIOMotorClient(settings.mongo_uri)
+    try:
+        report = await apply_indexes(client[settings.mongo_db_name], migrate=True)
+    finally:
+        client.close()
+    for action, names in report.items():
+        if names:
+            print(f"✓ Indexes {action}: {', '.join(names)}")
+
+
+if __name__ == "__main__":
+    import argparse
+    import asyncio
+
+    parser = argparse.ArgumentParser(description="Apply index changes that drop or rebuild indexes")
+    parser.add_argument("--migrate", action="store_true", required=True,
+                        help="Rebuild indexes whose TTL changed and drop superseded indexes")
+    parser.parse_args()
+    asyncio.run(_migrate())
@@ -1,15 +1,43 @@
 """
 Main FastAPI application
 """
-from fastapi import FastAPI, WebSocket, WebSocketDisconnect, HTTPException
+from fastapi import FastAPI, WebSocket, WebSocketDisconnect, HTTPException, Query
+from fastapi.responses import PlainTextResponse, StreamingResponse
 from fastapi.middleware.cors import CORSMiddleware
 from contextlib import asynccontextmanager
 from datetime import datetime
 from bson import ObjectId
+import asyncio
+import json
+import time
 from typing import List, Optional
 
+from anyio import to_thread
+
 from .config import settings
 from .database import db
+from .persistence import writer
+from .aggregates import aggregate_pipeline, aggregate_from_pipeline
+from .analytics import GRANULARITIES, compute_user_trends, trends_cache
+from .indexes import index_report
+from .pagination import InvalidPageRequest, fetch_page, ndjson_line, parse_fields, projection
+from .governor import create_governor, governor_stats
+from .session_state import session_store, SessionStoreUnavailable
+from .metrics import (
+    metrics,
+    StageTimer,
+    ws_frames_total,
+    ws_disconnects_total,
+    ws_errors_total,
+    ws_active_sessions,
+    inference_queue_depth,
+    persist_pending,
+    executor_pending,
+    executor_busy,
+    executor_workers,
+    threadpool_busy,
+    threadpool_size
+)
 from .models import (
     CreateSessionRequest,
     SessionResponse,
@@ -17,9 +45,11 @@ from .models import (
     FeedbackRequest,
     HealthResponse,
     PredictionResponse,
-    InsightType
+    InsightType,
+    EmotionType
 )
-from .ml import model, get_recommendation
+from .ml import model, get_recommendation, InferenceOverloaded
+from .protocol import ProtocolError, decode_feature_frame, negotiate, features_to_lists
 
 
 @asynccontextmanager
@@ -28,11 +58,26 @@ async def lifespan(app: FastAPI):
     # Startup
     await db.connect()
     model.load_model()
+    await model.start()
+    writer.start()
+    await session_store.start()
     yield
     # Shutdown
+    await model.stop()
+    await writer.stop()
+    await session_store.stop()
     await db.disconnect()
 
 
+# Fields clients may select with ?fields= (ids are always returned)
+SESSION_FIELDS = ("user_id", "started_at", "ended_at", "duration_s", "meta", "aggregates")
+INSIGHT_FIELDS = ("session_id", "generated_at", "type", "content", "confidence")
+PREDICTION_FIELDS = ("timestamp", "features", "emotion_prob", "stress_score", "model_version")
+
+# Predictions per chunk of a streamed export
+EXPORT_BATCH_SIZE = 1000
+
+
 app = FastAPI(
     title="Human Activity & Mood Recognition API",
     description="Real-time emotion and stress detection API",
@@ -97,36 +142,20 @@ async def end_session(session_id: str):
     started_at = session["started_at"]
     duration_s = int((ended_at - started_at).total_seconds())
     
-    # Compute aggregates from predictions
-    predictions = await db.db.predictions.find({"session_id": oid}).to_list(length=1000)
-    
-    aggregates = {}
-    if predictions:
-        # Get dominant mood
-        emotions = [p["emotion_prob"] for p in predictions if "emotion_prob" in p]
-        if emotions:
-            # Average emotion probabilities
-            avg_emotions = {}
-            for emotion_dict in emotions:
-                for emotion, prob in emotion_dict.items():
-                    avg_emotions[emotion] = avg_emotions.get(emotion, 0) + prob
-            
-            for emotion in avg_emotions:
-                avg_emotions[emotion] /= len(emotions)
-            
-            dominant_mood = max(avg_emotions, key=avg_emotions.get)
-        else:
-            dominant_mood = "neutral"
-        
-        # Average stress score
-        stress_scores = [p.get("stress_score", 0) for p in predictions]
-        avg_stress = sum(stress_scores) / len(stress_scores) if stress_scores else 0
-        
-        aggregates = {
-            "dominant_mood": dominant_mood,
-            "stress_score": round(avg_stress, 2),
-            "prediction_count": len(predictions)
-        }
+    model.release_session(session_id)
+    
+    # Running aggregates are exact for any session length; fall back to a
+    # server-side pipeline when the store did not see the whole session
+    try:
+        aggregates = await session_store.end(session_id)
+    except SessionStoreUnavailable:
+        aggregates = None
+    if aggregates is None:
+        await writer.flush()
+        bucket_s = settings.aggregate_bucket_s
+        pipeline = aggregate_pipeline(oid, started_at, bucket_s, [e.value for e in EmotionType])
+        results = await db.db.predictions.aggregate(pipeline).to_list(length=1)
+        aggregates = aggregate_from_pipeline(results[0] if results else {}, started_at, bucket_s).to_dict()
     
     # Update session
     await db.db.sessions.update_one(
@@ -140,6 +169,16 @@ async def end_session(session_id: str):
         }
     )
     
+    # New session data changes this user's trends; persist it before they're recomputed
+    if session.get("user_id"):
+        await writer.flush()
+        trends_cache.invalidate(session["user_id"])
+        try:
+            # Other workers' caches; they fall back to TRENDS_CACHE_TTL_S without it
+            await session_store.invalidate_trends(session["user_id"])
+        except SessionStoreUnavailable:
+            pass
+    
     return {
         "session_id": session_id,
         "duration_s": duration_s,
@@ -147,52 +186,170 @@ async def end_session(session_id: str):
     }
 
 
+def _fields(fields: Optional[str], allowed) -> Optional[set]:
+    try:
+        return parse_fields(fields, allowed)
+    except InvalidPageRequest as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+
 @app.get("/api/v1/sessions/{session_id}")
-async def get_session(session_id: str):
-    """Get session details"""
+async def get_session(session_id: str, fields: Optional[str] = None):
+    """Get session details, optionally only `fields` (comma-separated)"""
     try:
         oid = ObjectId(session_id)
     except Exception:
         raise HTTPException(status_code=400, detail="Invalid session_id")
     
-    session = await db.db.sessions.find_one({"_id": oid})
+    selected = _fields(fields, SESSION_FIELDS)
+    live = selected is None or "aggregates" in selected
+    session = await db.db.sessions.find_one({"_id": oid}, projection(selected, ["ended_at"] if live else []))
     if not session:
         raise HTTPException(status_code=404, detail="Session not found")
     
+    # Live partial aggregates while the session is still running
+    if live and session.get("ended_at") is None:
+        try:
+            aggregates = await session_store.aggregates(session_id)
+        except SessionStoreUnavailable:
+            aggregates = None
+        if aggregates is not None:
+            session["aggregates"] = aggregates
+            session["aggregates_live"] = True
+    if selected is not None and "ended_at" not in selected:
+        session.pop("ended_at", None)
+    
     session["session_id"] = str(session.pop("_id"))
     return session
 
 
+@app.get("/api/v1/sessions/{session_id}/predictions")
+async def export_predictions(session_id: str, fields: Optional[str] = None):
+    """
+    Stream a session's full prediction history as NDJSON, oldest first
+    
+    Documents are read and sent in batches, so memory use does not grow
+    with the size of the history.
+    """
+    try:
+        oid = ObjectId(session_id)
+    except Exception:
+        raise HTTPException(status_code=400, detail="Invalid session_id")
+    
+    selected = _fields(fields, PREDICTION_FIELDS)
+    if not await db.db.sessions.find_one({"_id": oid}, {"_id": 1}):
+        raise HTTPException(status_code=404, detail="Session not found")
+    
+    # Include predictions still in the write-behind buffer
+    await writer.flush()
+    # Sorted on the (session_id, timestamp) index, so MongoDB streams it too
+    cursor = db.db.predictions.find({"session_id": oid}, projection(selected)).sort(
+        "timestamp", 1
+    ).batch_size(EXPORT_BATCH_SIZE)
+    
+    async def lines():
+        chunk = []
+        async for prediction in cursor:
+            prediction["prediction_id"] = prediction.pop("_id")
+            prediction["session_id"] = session_id
+            chunk.append(ndjson_line(prediction))
+            if len(chunk) >= EXPORT_BATCH_SIZE:
+                yield "".join(chunk)
+                chunk = []
+        if chunk:
+            yield "".join(chunk)
+    
+    return StreamingResponse(
+        lines(),
+        media_type="application/x-ndjson",
+        headers={"Content-Disposition": f'attachment; filename="session-{session_id}-predictions.ndjson"'}
+    )
+
+
 @app.get("/api/v1/sessions")
-async def list_sessions(user_id: Optional[str] = None, limit: int = 20):
-    """List sessions, optionally filtered by user_id"""
+async def list_sessions(
+    user_id: Optional[str] = None,
+    limit: int = Query(default=20, ge=1, le=200),
+    cursor: Optional[str] = None,
+    fields: Optional[str] = None
+):
+    """
+    List sessions, newest first, optionally filtered by user_id
+    
+    Pass `next_cursor` from a response as `cursor` to get the next page;
+    it is null on the last page.
+    """
     query = {}
     if user_id:
         query["user_id"] = user_id
     
-    sessions = await db.db.sessions.find(query).sort("started_at", -1).limit(limit).to_list(length=limit)
+    try:
+        sessions, next_cursor = await fetch_page(
+            db.db.sessions, query, "started_at", limit, cursor,
+            descending=True, fields=_fields(fields, SESSION_FIELDS)
+        )
+    except InvalidPageRequest as e:
+        raise HTTPException(status_code=400, detail=str(e))
     
     for session in sessions:
         session["session_id"] = str(session.pop("_id"))
     
-    return {"sessions": sessions, "count": len(sessions)}
+    return {"sessions": sessions, "count": len(sessions), "next_cursor": next_cursor}
 
 
 @app.get("/api/v1/insights")
-async def get_insights(session_id: str):
-    """Get insights for a session"""
+async def get_insights(
+    session_id: str,
+    limit: int = Query(default=100, ge=1, le=500),
+    cursor: Optional[str] = None,
+    fields: Optional[str] = None
+):
+    """Get insights for a session, oldest first; paginated like list_sessions"""
     try:
         oid = ObjectId(session_id)
     except Exception:
         raise HTTPException(status_code=400, detail="Invalid session_id")
     
-    insights = await db.db.insights.find({"session_id": oid}).to_list(length=100)
+    try:
+        insights, next_cursor = await fetch_page(
+            db.db.insights, {"session_id": oid}, "generated_at", limit, cursor,
+            fields=_fields(fields, INSIGHT_FIELDS)
+        )
+    except InvalidPageRequest as e:
+        raise HTTPException(status_code=400, detail=str(e))
     
     for insight in insights:
         insight["insight_id"] = str(insight.pop("_id"))
-        insight["session_id"] = str(insight["session_id"])
+        if "session_id" in insight:
+            insight["session_id"] = str(insight["session_id"])
+    
+    return {"insights": insights, "count": len(insights), "next_cursor": next_cursor}
+
+
+@app.get("/api/v1/users/{user_id}/trends")
+async def get_user_trends(
+    user_id: str,
+    granularity: str = "day",
+    days: int = Query(default=30, ge=1, le=365)
+):
+    """Daily or hourly stress and emotion distributions across a user's sessions"""
+    if granularity not in GRANULARITIES:
+        raise HTTPException(status_code=400, detail=f"granularity must be one of {list(GRANULARITIES)}")
+    if granularity == "hour" and days > 31:
+        raise HTTPException(status_code=400, detail="Hourly trends are limited to 31 days")
     
-    return {"insights": insights, "count": len(insights)}
+    try:
+        version = await session_store.trends_version(user_id)
+    except SessionStoreUnavailable:
+        version = None
+    
+    key = (user_id, granularity, days)
+    trends = trends_cache.get(key, version)
+    if trends is None:
+        trends = await compute_user_trends(db.db, user_id, granularity, days, [e.value for e in EmotionType])
+        trends_cache.set(key, trends, version)
+    
+    return trends
 
 
 @app.post("/api/v1/feedback")
@@ -210,16 +367,163 @@ async def submit_feedback(feedback: FeedbackRequest):
     return {"feedback_id": str(result.inserted_id), "status": "received"}
 
 
+# ============================================================================
+# Admin Endpoints
+# ============================================================================
+
+@app.get("/api/v1/admin/inference")
+async def inference_stats():
+    """Micro-batching, executor, input length mismatch, prediction cache and frame governor statistics"""
+    return {
+        "batching": model.batcher.stats(),
+        "executor": model.executor_stats(),
+        "inputs": model.input_stats(),
+        "cache": model.cache.stats(),
+        "governor": governor_stats.stats(),
+    }
+
+
+@app.get("/api/v1/admin/models")
+async def model_versions():
+    """Serving model version, reload counters and versions available in the registry"""
+    return model.model_info()
+
+
+@app.post("/api/v1/admin/models/reload")
+async def reload_model(version: Optional[str] = None):
+    """
+    Load a model version (latest when omitted), warm it up and swap it in
+    
+    Open WebSocket sessions keep running; frames already in a batch finish
+    on the previous version.
+    """
+    try:
+        return await model.reload(version)
+    except LookupError as e:
+        raise HTTPException(status_code=404, detail=str(e))
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Could not load model: {e}")
+
+
+@app.get("/api/v1/admin/persistence")
+async def persistence_stats():
+    """Write-behind buffer occupancy, throughput and drop counters"""
+    return {"write_behind": writer.stats()}
+
+
+@app.get("/api/v1/admin/state")
+async def session_state_stats():
+    """Size of per-session state: the session store (shared when SESSION_STORE=socket) and temporal hidden states"""
+    return {
+        "store": await session_store.stats(),
+        "temporal": model.temporal_stats(),
+    }
+
+
+@app.get("/api/v1/admin/indexes")
+async def index_stats():
+    """Index usage ($indexStats) and collection sizes, to verify indexes are hit under load"""
+    return {"collections": await index_report(db.db)}
+
+
+# ============================================================================
+# Metrics
+# ============================================================================
+
+frames_inferred = ws_frames_total.labels("inferred")
+frames_reused = ws_frames_total.labels("reused")
+frames_rejected = ws_frames_total.labels("rejected")
+store_unavailable = ws_errors_total.labels("session_store")
+
+ws_active_sessions.set_function(lambda: governor_stats.active_sessions)
+inference_queue_depth.set_function(model.pending_frames)
+persist_pending.set_function(lambda: writer.stats()["pending"])
+executor_pending.set_function(lambda: model.executor.pending)
+executor_busy.set_function(lambda: model.executor.busy)
+executor_workers.set_function(lambda: model.executor.workers)
+threadpool_busy.set_function(lambda: to_thread.current_default_thread_limiter().borrowed_tokens)
+threadpool_size.set_function(lambda: to_thread.current_default_thread_limiter().total_tokens)
+
+
+@app.get("/metrics", response_class=PlainTextResponse)
+async def prometheus_metrics():
+    """Prometheus text exposition of per-stage frame timings, gauges and counters"""
+    return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4")
+
+
 # ============================================================================
 # WebSocket for Real-time Inference
 # ============================================================================
 
+class _Sender:
+    """
+    Serializes outbound messages of one WebSocket
+    
+    The reader task (hello replies, protocol errors) and the inference loop
+    both send; Starlette WebSocket sends must not run concurrently.
+    """
+    
+    def __init__(self, websocket: WebSocket):
+        self.websocket = websocket
+        self._lock = asyncio.Lock()
+    
+    async def send_json(self, message):
+        async with self._lock:
+            await self.websocket.send_json(message)
+    
+    async def close(self, code: int, reason: str):
+        async with self._lock:
+            await self.websocket.close(code=code, reason=reason)
+
+
+async def _read_frames(websocket: WebSocket, sender: _Sender, governor):
+    """
+    Socket reader: decode frames and hand them to the session governor
+    
+    Runs alongside the inference loop so frames that arrive while a
+    prediction is in flight are coalesced rather than queued.
+    """
+    try:
+        while True:
+            # Receive features from client (binary frames or JSON fallback)
+            message = await websocket.receive()
+            if message["type"] == "websocket.disconnect":
+                raise WebSocketDisconnect(message.get("code", 1000))
+            
+            parse_started = time.perf_counter()
+            if message.get("bytes") is not None:
+                try:
+                    timestamp, features = decode_feature_frame(message["bytes"])
+                except ProtocolError as e:
+                    ws_errors_total.labels("protocol").inc()
+                    await sender.send_json({"type": "error", "detail": str(e)})
+                    continue
+            else:
+                data = json.loads(message["text"])
+                
+                if data.get("type") == "hello":
+                    await sender.send_json(negotiate(data))
+                    continue
+                
+                if data.get("type") != "features":
+                    continue
+                
+                features = data.get("features", {})
+                timestamp = data.get("timestamp", int(datetime.utcnow().timestamp() * 1000))
+            
+            StageTimer.STAGES["parse"].observe(time.perf_counter() - parse_started)
+            governor.offer(timestamp, features)
+    except Exception as e:
+        governor.close(e)
+
+
 @app.websocket("/ws/{session_id}")
 async def websocket_endpoint(websocket: WebSocket, session_id: str):
     """
     WebSocket endpoint for real-time predictions
     
     Client sends: {"type": "features", "timestamp": 1234567890, "features": {...}}
+    or, after {"type": "hello", "encoding": "binary"}, binary frames (see app.protocol)
     Server responds: {"type": "prediction", "timestamp": 1234567890, "emotion": "neutral", ...}
     """
     await websocket.accept()
@@ -236,66 +540,95 @@ async def websocket_endpoint(websocket: WebSocket, session_id: str):
         await websocket.close(code=1003, reason="Session not found")
         return
     
+    governor = create_governor(model.pending_frames)
+    sender = _Sender(websocket)
+    reader = asyncio.create_task(_read_frames(websocket, sender, governor))
+    
     try:
-        while True:
-            # Receive features from client
-            data = await websocket.receive_json()
-            
-            if data.get("type") != "features":
-                continue
-            
-            features = data.get("features", {})
-            timestamp = data.get("timestamp", int(datetime.utcnow().timestamp() * 1000))
-            
-            # Run inference
-            prediction = await model.predict_async(features)
-            
-            # Get recommendation
-            advice_id, advice_text, confidence = get_recommendation(
-                session_id,
-                prediction["emotion"],
-                prediction["stress_score"]
-            )
-            
-            # Store prediction in database (fire-and-forget)
-            prediction_doc = {
-                "session_id": oid,
-                "timestamp": datetime.utcnow(),
-                "features": features if not settings.store_raw_frames else features,
-                "emotion_prob": prediction["emotion_prob"],
-                "stress_score": prediction["stress_score"]
-            }
-            await db.db.predictions.insert_one(prediction_doc)
-            
-            # Store insight if confidence is high
-            if confidence > 0.7:
-                insight_doc = {
-                    "session_id": oid,
-                    "generated_at": datetime.utcnow(),
-                    "type": InsightType.RECOMMENDATION,
-                    "content": advice_text,
-                    "confidence": confidence
-                }
-                await db.db.insights.insert_one(insight_doc)
-            
-            # Send prediction to client
-            response = PredictionResponse(
-                type="prediction",
-                timestamp=timestamp,
-                emotion=prediction["emotion"],
-                emotion_prob=prediction["emotion_prob"],
-                stress_score=prediction["stress_score"],
-                advice_id=advice_id,
-                advice=advice_text
-            )
-            
-            await websocket.send_json(response.model_dump())
+        with governor:
+            while True:
+                # Latest frame allowed by the rate cap; bursts are coalesced
+                timestamp, features = await governor.next_frame()
+                timer = StageTimer(governor.received_at)
+                timer.mark("queue")
+                
+                # Near-identical to the last inferred frame: reuse its result
+                cached, vector = governor.reuse(features)
+                if cached is not None:
+                    prediction, advice_id, advice_text = cached
+                    frames_reused.inc()
+                else:
+                    # Run inference; when the executor is overloaded drop the frame
+                    try:
+                        prediction = await model.predict_async(features, session_id)
+                    except InferenceOverloaded as e:
+                        frames_rejected.inc()
+                        await sender.send_json({"type": "error", "detail": f"Frame dropped: {e}", "timestamp": timestamp})
+                        continue
+                    timer.mark("inference")
+                    
+                    # Update session history and running aggregates, then get recommendation
+                    now = datetime.utcnow()
+                    try:
+                        avg_stress, dominant_emotion = await session_store.record(
+                            session_id, session["started_at"], prediction, now
+                        )
+                    except SessionStoreUnavailable:
+                        # Without the shared history, recommend from this frame alone
+                        store_unavailable.inc()
+                        avg_stress, dominant_emotion = prediction["stress_score"], prediction["emotion"]
+                    advice_id, advice_text, confidence = get_recommendation(avg_stress, dominant_emotion)
+                    governor.remember(vector, (prediction, advice_id, advice_text))
+                    timer.mark("recommendation")
+                    frames_inferred.inc()
+                    
+                    # Store prediction in database (write-behind, fire-and-forget)
+                    prediction_doc = {
+                        "session_id": oid,
+                        "timestamp": now,
+                        "features": features_to_lists(features) if settings.store_raw_frames else None,
+                        "emotion_prob": prediction["emotion_prob"],
+                        "stress_score": prediction["stress_score"],
+                        "model_version": prediction["model_version"]
+                    }
+                    await writer.put("predictions", prediction_doc)
+                    
+                    # Store insight if confidence is high
+                    if confidence > 0.7:
+                        insight_doc = {
+                            "session_id": oid,
+                            "generated_at": datetime.utcnow(),
+                            "type": InsightType.RECOMMENDATION,
+                            "content": advice_text,
+                            "confidence": confidence
+                        }
+                        await writer.put("insights", insight_doc)
+                    timer.mark("persist")
+                
+                # Send prediction to client
+                response = PredictionResponse(
+                    type="prediction",
+                    timestamp=timestamp,
+                    emotion=prediction["emotion"],
+                    emotion_prob=prediction["emotion_prob"],
+                    stress_score=prediction["stress_score"],
+                    advice_id=advice_id,
+                    advice=advice_text
+                )
+                
+                await sender.send_json(response.model_dump())
+                timer.mark("send")
+                timer.finish()
     
     except WebSocketDisconnect:
+        ws_disconnects_total.inc()
         print(f"WebSocket disconnected: {session_id}")
     except Exception as e:
+        ws_errors_total.labels("internal").inc()
         print(f"WebSocket error: {e}")
-        await websocket.close(code=1011, reason=str(e))
+        await sender.close(code=1011, reason=str(e))
+    finally:
+        reader.cancel()
 
 
 if __name__ == "__main__":
@@ -0,0 +1,296 @@
+"""
+Prometheus-style metrics for the real-time path
+
+A small in-process registry rendered in the Prometheus text exposition
+format at /metrics. Observations are a bisect and two increments, cheap
+enough to stay enabled in production. Most updates happen on the event
+loop; the MongoDB pool listener runs on driver threads and the per-metric
+lock only guards child creation.
+"""
+import threading
+import time
+from bisect import bisect_left
+from typing import Callable, Dict, Iterable, List, Optional, Sequence, Tuple
+
+from pymongo import monitoring
+
+
+# Seconds; spans sub-millisecond parsing up to a slow forward pass
+DEFAULT_BUCKETS = (
+    0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5
+)
+
+
+def _format_labels(names: Sequence[str], values: Sequence[str], extra: str = "") -> str:
+    pairs = [f'{n}="{v}"' for n, v in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class _Value:
+    """Counter/gauge child"""
+
+    __slots__ = ("value",)
+
+    def __init__(self):
+        self.value = 0
+
+    def inc(self, amount: float = 1):
+        self.value += amount
+
+    def dec(self, amount: float = 1):
+        self.value -= amount
+
+    def set(self, value: float):
+        self.value = value
+
+
+class _HistogramValue:
+    """Histogram child: per-bucket counts (non-cumulative until rendered), sum and count"""
+
+    __slots__ = ("bounds", "counts", "sum", "count")
+
+    def __init__(self, bounds: Tuple[float, ...]):
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float):
+        self.counts[bisect_left(self.bounds, value)] += 1
+        self.sum += value
+        self.count += 1
+
+
+class Metric:
+    """Base class: a named family of children keyed by label values"""
+
+    type = "untyped"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = (), registry=None):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._children: Dict[Tuple[str, ...], object] = {}
+        self._function: Optional[Callable[[], float]] = None
+        self._lock = threading.Lock()
+        if not self.labelnames:
+            # Unlabelled metrics report zero before their first update
+            self.labels()
+        (registry if registry is not None else metrics).register(self)
+
+    def _new_child(self):
+        return _Value()
+
+    def labels(self, *values):
+        """Child for these label values; look it up once and keep it on hot paths"""
+        key = tuple(str(v) for v in values)
+        child = self._children.get(key)
+        if child is None:
+            if len(key) != len(self.labelnames):
+                raise ValueError(f"{self.name} expects labels {self.labelnames}")
+            with self._lock:
+                child = self._children.setdefault(key, self._new_child())
+        return child
+
+    def set_function(self, function: Callable[[], float]):
+        """Read the value from `function` at scrape time (unlabelled metrics)"""
+        self._function = function
+
+    def inc(self, amount: float = 1):
+        self.labels().inc(amount)
+
+    def samples(self) -> Iterable[Tuple[str, str, float]]:
+        if self._function is not None:
+            yield self.name, "", self._function()
+            return
+        for key, child in list(self._children.items()):
+            yield self.name, _format_labels(self.labelnames, key), child.value
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.type}"]
+        lines.extend(f"{name}{labels} {_format_value(value)}" for name, labels, value in self.samples())
+        return lines
+
+
+class Counter(Metric):
+    type = "counter"
+
+
+class Gauge(Metric):
+    type = "gauge"
+
+    def set(self, value: float):
+        self.labels().set(value)
+
+    def dec(self, amount: float = 1):
+        self.labels().dec(amount)
+
+
+class Histogram(Metric):
+    type = "histogram"
+
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        labelnames: Sequence[str] = (),
+        buckets: Sequence[float] = DEFAULT_BUCKETS,
+        registry=None
+    ):
+        self.bounds = tuple(sorted(buckets))
+        super().__init__(name, documentation, labelnames, registry)
+
+    def _new_child(self):
+        return _HistogramValue(self.bounds)
+
+    def observe(self, value: float):
+        self.labels().observe(value)
+
+    def samples(self) -> Iterable[Tuple[str, str, float]]:
+        for key, child in list(self._children.items()):
+            cumulative = 0
+            for bound, count in zip(self.bounds + (float("inf"),), list(child.counts)):
+                cumulative += count
+                le = f'le="{_format_value(bound)}"'
+                yield f"{self.name}_bucket", _format_labels(self.labelnames, key, le), cumulative
+            labels = _format_labels(self.labelnames, key)
+            yield f"{self.name}_sum", labels, child.sum
+            yield f"{self.name}_count", labels, child.count
+
+
+class MetricsRegistry:
+    """All metrics of this process, rendered together"""
+
+    def __init__(self):
+        self._metrics: List[Metric] = []
+
+    def register(self, metric: Metric):
+        self._metrics.append(metric)
+
+    def render(self) -> str:
+        lines = []
+        for metric in self._metrics:
+            try:
+                lines.extend(metric.render())
+            except Exception as e:
+                # A failing callback must not take down the whole scrape
+                lines.append(f"# {metric.name} unavailable: {e}")
+        return "\n".join(lines) + "\n"
+
+
+class PoolListener(monitoring.ConnectionPoolListener):
+    """Tracks MongoDB connections open and checked out (Motor's pymongo pool)"""
+
+    def __init__(self, open_gauge: Gauge, in_use_gauge: Gauge, failures: Counter):
+        self.open = open_gauge.labels()
+        self.in_use = in_use_gauge.labels()
+        self.failures = failures.labels()
+        self._lock = threading.Lock()
+
+    def _add(self, child, amount):
+        with self._lock:
+            child.inc(amount)
+
+    def connection_created(self, event):
+        self._add(self.open, 1)
+
+    def connection_closed(self, event):
+        self._add(self.open, -1)
+
+    def connection_checked_out(self, event):
+        self._add(self.in_use, 1)
+
+    def connection_checked_in(self, event):
+        self._add(self.in_use, -1)
+
+    def connection_check_out_failed(self, event):
+        self._add(self.failures, 1)
+
+    def pool_created(self, event):
+        pass
+
+    def pool_ready(self, event):
+        pass
+
+    def pool_cleared(self, event):
+        pass
+
+    def pool_closed(self, event):
+        pass
+
+    def connection_ready(self, event):
+        pass
+
+    def connection_check_out_started(self, event):
+        pass
+
+
+# Global metrics registry
+metrics = MetricsRegistry()
+
+# WebSocket path: time per stage of websocket_endpoint for each frame
+ws_stage_seconds = Histogram(
+    "har_ws_stage_seconds",
+    "Time per WebSocket frame stage (parse, queue, inference, recommendation, persist, send)",
+    ["stage"]
+)
+ws_frame_seconds = Histogram(
+    "har_ws_frame_seconds",
+    "Time from receiving a frame to sending its prediction"
+)
+ws_frames_total = Counter("har_ws_frames_total", "Frames handled, by outcome (inferred, reused or rejected)", ["outcome"])
+ws_disconnects_total = Counter("har_ws_disconnects_total", "WebSocket disconnects")
+ws_errors_total = Counter("har_ws_errors_total", "WebSocket errors, by kind (protocol, internal or session_store)", ["kind"])
+ws_active_sessions = Gauge("har_ws_active_sessions", "Open WebSocket sessions")
+
+# Inference and persistence
+inference_queue_depth = Gauge("har_inference_queue_depth", "Frames waiting for or running inference")
+db_insert_seconds = Histogram("har_db_insert_seconds", "insert_many duration per flush", ["collection"])
+persist_pending = Gauge("har_persist_pending", "Documents buffered or being written")
+
+# Inference executor (app.ml.executor): saturation of the inference workers
+executor_pending = Gauge("har_inference_executor_pending", "Inference calls submitted to the executor and not finished")
+executor_busy = Gauge("har_inference_executor_busy", "Inference workers running a call")
+executor_workers = Gauge("har_inference_executor_workers", "Inference workers (threads, each driving a model process in process mode)")
+
+# anyio's default to_thread pool: model loads and other blocking calls, not inference
+threadpool_busy = Gauge("har_threadpool_busy", "anyio to_thread worker threads in use (model loads, not inference)")
+threadpool_size = Gauge("har_threadpool_size", "anyio to_thread worker thread limit")
+
+# Motor / pymongo connection pool
+mongo_pool_open = Gauge("har_mongo_pool_connections", "MongoDB connections open")
+mongo_pool_in_use = Gauge("har_mongo_pool_checked_out", "MongoDB connections checked out")
+mongo_pool_max = Gauge("har_mongo_pool_max_size", "MongoDB connection pool size limit")
+mongo_checkout_failures_total = Counter("har_mongo_checkout_failures_total", "Failed connection checkouts")
+pool_listener = PoolListener(mongo_pool_open, mongo_pool_in_use, mongo_checkout_failures_total)
+
+
+class StageTimer:
+    """Per-frame stage timing: mark(stage) observes the time since the previous mark"""
+
+    __slots__ = ("started", "last")
+
+    STAGES = {stage: ws_stage_seconds.labels(stage) for stage in (
+        "parse", "queue", "inference", "recommendation", "persist", "send"
+    )}
+    FRAME = ws_frame_seconds.labels()
+
+    def __init__(self, started: Optional[float] = None):
+        self.started = self.last = started if started is not None else time.perf_counter()
+
+    def mark(self, stage: str):
+        now = time.perf_counter()
+        self.STAGES[stage].observe(now - self.last)
+        self.last = now
+
+    def finish(self):
+        """Observe the whole frame, from `started` to the last mark"""
+        self.FRAME.observe(self.last - self.started)
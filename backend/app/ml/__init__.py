@@ -1,6 +1,7 @@
 """ML inference module"""
 from .inference import model, EmotionStressModel
-from .recommendations import get_recommendation
+from .executor import InferenceOverloaded
+from .recommendations import get_recommendation, recommendation_engine
 
-__all__ = ["model", "EmotionStressModel", "get_recommendation"]
+__all__ = ["model", "EmotionStressModel", "InferenceOverloaded", "get_recommendation", "recommendation_engine"]
 
@@ -0,0 +1,103 @@
+"""
+Model architectures served from train_emotion.py checkpoints
+
+Kept in sync with models/training/train_emotion.py so that a saved
+model_state_dict can be loaded without pickling the module.
+"""
+from typing import Dict, Optional, Sequence
+
+import torch
+import torch.nn as nn
+
+
+class EmotionModel(nn.Module):
+    """Fully connected emotion classifier (Linear + BatchNorm1d + ReLU + Dropout blocks)"""
+
+    def __init__(self, input_size=1536, num_emotions=7, dropout=0.3, hidden_sizes: Sequence[int] = (512, 256, 128)):
+        super().__init__()
+
+        layers = []
+        in_features = input_size
+        for hidden in hidden_sizes:
+            layers += [
+                nn.Linear(in_features, hidden),
+                nn.BatchNorm1d(hidden),
+                nn.ReLU(),
+                nn.Dropout(dropout),
+            ]
+            in_features = hidden
+        layers.append(nn.Linear(in_features, num_emotions))
+
+        self.fc = nn.Sequential(*layers)
+
+    def forward(self, x):
+        return self.fc(x)
+
+
+def emotion_model_from_state_dict(state_dict: Dict[str, torch.Tensor]) -> EmotionModel:
+    """Rebuild an EmotionModel with layer sizes inferred from its weights"""
+    linear_weights = sorted(
+        (int(key.split(".")[1]), tensor)
+        for key, tensor in state_dict.items()
+        if key.startswith("fc.") and key.endswith(".weight") and tensor.dim() == 2
+    )
+    shapes = [tensor.shape for _, tensor in linear_weights]
+
+    model = EmotionModel(
+        input_size=shapes[0][1],
+        num_emotions=shapes[-1][0],
+        hidden_sizes=[shape[0] for shape in shapes[:-1]]
+    )
+    model.load_state_dict(state_dict)
+    return model
+
+
+class TemporalEmotionModel(nn.Module):
+    """Per-frame encoder followed by a GRU; step() advances one frame with a carried hidden state"""
+
+    def __init__(self, input_size=1536, num_emotions=7, hidden_size=128, frame_sizes: Sequence[int] = (256,), dropout=0.3):
+        super().__init__()
+
+        layers = []
+        in_features = input_size
+        for width in frame_sizes:
+            layers += [
+                nn.Linear(in_features, width),
+                nn.LayerNorm(width),
+                nn.ReLU(),
+                nn.Dropout(dropout),
+            ]
+            in_features = width
+
+        self.encoder = nn.Sequential(*layers)
+        self.gru = nn.GRU(in_features, hidden_size, batch_first=True)
+        self.head = nn.Linear(hidden_size, num_emotions)
+
+    def forward(self, x):
+        out, _ = self.gru(self.encoder(x))
+        return self.head(out).reshape(-1, self.head.out_features)
+
+    def step(self, x: torch.Tensor, h: torch.Tensor):
+        """x [B, F], h [B, H] -> (logits [B, C], h [B, H])"""
+        out, h = self.gru(self.encoder(x).unsqueeze(1), h.unsqueeze(0))
+        return self.head(out[:, 0]), h[0]
+
+
+def temporal_model_from_state_dict(state_dict: Dict[str, torch.Tensor], config: Optional[Dict] = None) -> TemporalEmotionModel:
+    """Rebuild a TemporalEmotionModel with layer sizes inferred from its weights"""
+    encoder_weights = sorted(
+        (int(key.split(".")[1]), tensor)
+        for key, tensor in state_dict.items()
+        if key.startswith("encoder.") and key.endswith(".weight") and tensor.dim() == 2
+    )
+    head = state_dict["head.weight"]
+
+    model = TemporalEmotionModel(
+        input_size=encoder_weights[0][1].shape[1] if encoder_weights else state_dict["gru.weight_ih_l0"].shape[1],
+        num_emotions=head.shape[0],
+        hidden_size=head.shape[1],
+        frame_sizes=[tensor.shape[0] for _, tensor in encoder_weights],
+        dropout=(config or {}).get("dropout", 0.3)
+    )
+    model.load_state_dict(state_dict)
+    return model
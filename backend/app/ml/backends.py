@@ -0,0 +1,175 @@
+"""
+Pluggable inference backends
+
+Each backend loads one artifact format and runs a float32 batch [N, F],
+returning (emotion_logits [N, C], stress [N] or None) as torch tensors.
+Stateful (temporal) models instead advance one frame per row with
+run_step(batch, state [N, H]), returning the next hidden state as well.
+Artifacts produced by models/training/export_model.py carry a JSON metadata
+blob (input size, emotion classes, normalization statistics).
+"""
+import json
+from typing import Dict, Optional, Tuple
+
+import numpy as np
+import torch
+
+from .architecture import emotion_model_from_state_dict, temporal_model_from_state_dict
+
+
+Outputs = Tuple[torch.Tensor, Optional[torch.Tensor]]
+
+# Used when model metadata does not list its classes
+DEFAULT_EMOTION_CLASSES = ["happy", "sad", "neutral", "angry", "surprised", "fearful", "disgusted"]
+
+METADATA_KEY = "metadata.json"
+
+
+def split_outputs(output) -> Outputs:
+    """Normalize model outputs to (emotion_logits, stress)"""
+    if isinstance(output, (tuple, list)):
+        logits = output[0]
+        stress = output[1].reshape(-1) if len(output) > 1 else None
+        return logits, stress
+    return output, None
+
+
+def checkpoint_metadata(checkpoint: Dict, module: torch.nn.Module) -> Dict:
+    """Metadata equivalent to what export_model.py embeds in exported artifacts"""
+    mean = np.asarray(checkpoint["mean"], dtype=np.float32)
+    # Output layer is the last Linear (fc[-1] for the MLP, head for the temporal model)
+    num_emotions = [m for m in module.modules() if isinstance(m, torch.nn.Linear)][-1].out_features
+    return {
+        "input_size": int(mean.shape[0]),
+        "num_emotions": int(num_emotions),
+        "emotion_classes": checkpoint.get("emotion_classes", DEFAULT_EMOTION_CLASSES[:num_emotions]),
+        "mean": mean,
+        "std": np.asarray(checkpoint["std"], dtype=np.float32),
+    }
+
+
+class InferenceBackend:
+    """Base class for inference backends"""
+
+    name = "base"
+    # Stateful backends are driven through run_step with a per-session hidden state
+    stateful = False
+    state_size = 0
+
+    def __init__(self, path: str, device: torch.device, num_threads: int = 0):
+        self.path = path
+        self.device = device
+        self.num_threads = num_threads
+        self.metadata: Dict = {}
+
+    def load(self):
+        raise NotImplementedError
+
+    def run(self, batch: torch.Tensor) -> Outputs:
+        raise NotImplementedError
+
+    def run_step(self, batch: torch.Tensor, state: torch.Tensor) -> Tuple[torch.Tensor, Optional[torch.Tensor], torch.Tensor]:
+        raise NotImplementedError(f"{self.name} backend is not stateful")
+
+    def _set_torch_threads(self):
+        if self.num_threads > 0:
+            torch.set_num_threads(self.num_threads)
+
+
+class EagerBackend(InferenceBackend):
+    """Eager PyTorch model from a train_emotion.py checkpoint or a pickled module"""
+
+    name = "pytorch"
+
+    def load(self):
+        self._set_torch_threads()
+        loaded = torch.load(self.path, map_location=self.device, weights_only=False)
+
+        if isinstance(loaded, dict) and "model_state_dict" in loaded:
+            config = loaded.get("config", {})
+            if config.get("architecture") == "temporal":
+                self.module = temporal_model_from_state_dict(loaded["model_state_dict"], config).to(self.device)
+                self.stateful = True
+                self.state_size = self.module.gru.hidden_size
+            else:
+                self.module = emotion_model_from_state_dict(loaded["model_state_dict"]).to(self.device)
+            self.metadata = checkpoint_metadata(loaded, self.module)
+            self.metadata["temporal"] = self.stateful
+        elif isinstance(loaded, torch.nn.Module):
+            self.module = loaded
+        else:
+            raise ValueError(f"{self.path} is neither a checkpoint nor a pickled torch.nn.Module")
+        self.module.eval()
+
+    def run(self, batch: torch.Tensor) -> Outputs:
+        with torch.inference_mode():
+            return split_outputs(self.module(batch))
+
+    def run_step(self, batch: torch.Tensor, state: torch.Tensor):
+        with torch.inference_mode():
+            logits, state = self.module.step(batch, state)
+            return logits, None, state
+
+
+class TorchScriptBackend(InferenceBackend):
+    """Traced and frozen TorchScript graph"""
+
+    name = "torchscript"
+
+    def load(self):
+        self._set_torch_threads()
+        extra_files = {METADATA_KEY: ""}
+        self.module = torch.jit.load(self.path, map_location=self.device, _extra_files=extra_files)
+        self.module.eval()
+        if extra_files[METADATA_KEY]:
+            self.metadata = json.loads(extra_files[METADATA_KEY])
+
+    def run(self, batch: torch.Tensor) -> Outputs:
+        with torch.inference_mode():
+            return split_outputs(self.module(batch))
+
+
+class OnnxRuntimeBackend(InferenceBackend):
+    """ONNX Runtime CPU execution provider"""
+
+    name = "onnx"
+
+    def load(self):
+        try:
+            import onnxruntime as ort
+        except ImportError as e:
+            raise ImportError("MODEL_TYPE=onnx requires the onnxruntime package") from e
+
+        options = ort.SessionOptions()
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        options.inter_op_num_threads = 1
+        if self.num_threads > 0:
+            options.intra_op_num_threads = self.num_threads
+
+        self.session = ort.InferenceSession(self.path, options, providers=["CPUExecutionProvider"])
+        self.input_name = self.session.get_inputs()[0].name
+
+        custom = self.session.get_modelmeta().custom_metadata_map
+        if METADATA_KEY in custom:
+            self.metadata = json.loads(custom[METADATA_KEY])
+
+    def run(self, batch: torch.Tensor) -> Outputs:
+        inputs = np.ascontiguousarray(batch.cpu().numpy(), dtype=np.float32)
+        outputs = [torch.from_numpy(o) for o in self.session.run(None, {self.input_name: inputs})]
+        return split_outputs(outputs if len(outputs) > 1 else outputs[0])
+
+
+BACKENDS = {
+    EagerBackend.name: EagerBackend,
+    TorchScriptBackend.name: TorchScriptBackend,
+    OnnxRuntimeBackend.name: OnnxRuntimeBackend,
+}
+
+
+def create_backend(model_type: str, path: str, device: torch.device, num_threads: int = 0) -> InferenceBackend:
+    """Instantiate the backend configured by MODEL_TYPE"""
+    try:
+        backend_cls = BACKENDS[model_type]
+    except KeyError:
+        raise ValueError(f"Unknown model_type '{model_type}', expected one of {list(BACKENDS)}")
+    return backend_cls(path, device, num_threads)
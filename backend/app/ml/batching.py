@@ -0,0 +1,212 @@
+"""
+Micro-batching scheduler for real-time inference
+
+Collects feature vectors submitted by all WebSocket sessions and runs them
+through the model as one stacked forward pass.
+"""
+import asyncio
+import time
+from typing import Any, Callable, Dict, List, Optional
+
+from anyio import to_thread
+
+
+class _PendingRequest:
+    """A single queued inference request"""
+
+    __slots__ = ("features", "future", "enqueued_at")
+
+    def __init__(self, features: Any, future: asyncio.Future):
+        self.features = features
+        self.future = future
+        self.enqueued_at = time.perf_counter()
+
+
+class InferenceBatcher:
+    """Async queue that groups concurrent requests into batches"""
+
+    def __init__(
+        self,
+        run_batch: Callable[[List[Any]], List[Dict]],
+        max_batch_size: int = 16,
+        max_wait_ms: float = 5.0,
+        executor: Optional[Any] = None
+    ):
+        self.run_batch = run_batch
+        self.max_batch_size = max(1, max_batch_size)
+        self.max_wait_s = max(0.0, max_wait_ms) / 1000.0
+        # Batches run on the executor (one in flight per worker), else anyio's pool
+        self.executor = executor
+        self.max_concurrent = executor.workers if executor is not None else 1
+
+        self._queue: Optional[asyncio.Queue] = None
+        self._worker: Optional[asyncio.Task] = None
+        self._inflight: set = set()
+        self.inflight_requests = 0
+
+        # Statistics
+        self.requests = 0
+        self.batches = 0
+        self.total_wait_s = 0.0
+        self.max_observed_wait_s = 0.0
+        self.last_batch_size = 0
+
+    @property
+    def running(self) -> bool:
+        return self._worker is not None and not self._worker.done()
+
+    @property
+    def queue_depth(self) -> int:
+        """Requests waiting for a batch"""
+        return self._queue.qsize() if self._queue is not None else 0
+
+    def start(self):
+        """Start the batching worker on the running event loop"""
+        if self.running:
+            return
+        self._queue = asyncio.Queue()
+        self._worker = asyncio.get_running_loop().create_task(self._run())
+
+    async def stop(self):
+        """Stop the worker and fail any requests still waiting"""
+        if self._worker is not None:
+            self._worker.cancel()
+            try:
+                await self._worker
+            except asyncio.CancelledError:
+                pass
+            self._worker = None
+
+        if self._inflight:
+            await asyncio.gather(*self._inflight, return_exceptions=True)
+
+        if self._queue is not None:
+            while not self._queue.empty():
+                request = self._queue.get_nowait()
+                if not request.future.done():
+                    request.future.set_exception(RuntimeError("Inference batcher stopped"))
+
+    async def submit(self, features: Any) -> Dict:
+        """Queue features for the next batch and wait for this request's result"""
+        if not self.running:
+            self.start()
+
+        future = asyncio.get_running_loop().create_future()
+        self._queue.put_nowait(_PendingRequest(features, future))
+        return await future
+
+    async def _collect(self, batch: List[_PendingRequest]):
+        """Wait for the first request, then gather more into `batch` until full or the deadline passes"""
+        first = await self._queue.get()
+        batch.append(first)
+        deadline = first.enqueued_at + self.max_wait_s
+
+        while len(batch) < self.max_batch_size:
+            if not self._queue.empty():
+                batch.append(self._queue.get_nowait())
+                continue
+
+            timeout = deadline - time.perf_counter()
+            if timeout <= 0:
+                break
+            try:
+                batch.append(await asyncio.wait_for(self._queue.get(), timeout))
+            except asyncio.TimeoutError:
+                break
+
+    async def _run(self):
+        """Worker loop: collect batches while fewer than max_concurrent are running"""
+        slots = asyncio.Semaphore(self.max_concurrent)
+        loop = asyncio.get_running_loop()
+        while True:
+            await slots.acquire()
+            batch: List[_PendingRequest] = []
+            try:
+                await self._collect(batch)
+            except asyncio.CancelledError:
+                # Requests already taken off the queue would otherwise never resolve
+                self._fail(batch, RuntimeError("Inference batcher stopped"))
+                raise
+
+            dispatched_at = time.perf_counter()
+            for request in batch:
+                wait_s = dispatched_at - request.enqueued_at
+                self.total_wait_s += wait_s
+                self.max_observed_wait_s = max(self.max_observed_wait_s, wait_s)
+            self.requests += len(batch)
+            self.batches += 1
+            self.last_batch_size = len(batch)
+
+            task = loop.create_task(self._dispatch(batch))
+            self._inflight.add(task)
+            task.add_done_callback(self._inflight.discard)
+            task.add_done_callback(lambda _: slots.release())
+
+    async def _call(self, fn: Callable, arg: Any) -> Any:
+        if self.executor is not None:
+            return await self.executor.run(fn, arg)
+        return await to_thread.run_sync(fn, arg)
+
+    async def _dispatch(self, batch: List[_PendingRequest]):
+        """One stacked forward pass; resolve each request's future"""
+        self.inflight_requests += len(batch)
+        try:
+            features = [request.features for request in batch]
+            try:
+                results = await self._call(self.run_batch, features)
+            except Exception as e:
+                # Isolate the failing frame so it doesn't fail its neighbours
+                if len(batch) == 1:
+                    results = [e]
+                else:
+                    try:
+                        results = await self._call(self._run_individually, features)
+                    except Exception as fallback_error:
+                        # The executor itself is failing, not one frame
+                        self._fail(batch, fallback_error)
+                        return
+        finally:
+            self.inflight_requests -= len(batch)
+
+        for request, result in zip(batch, results):
+            if request.future.done():
+                continue
+            if isinstance(result, Exception):
+                request.future.set_exception(result)
+            else:
+                request.future.set_result(result)
+
+    @staticmethod
+    def _fail(batch: List[_PendingRequest], error: Exception):
+        """Fail every request of a batch that is not resolved yet"""
+        for request in batch:
+            if not request.future.done():
+                request.future.set_exception(error)
+
+    def _run_individually(self, features: List[Any]) -> List[Any]:
+        """Fallback when a stacked pass fails: run each request on its own"""
+        results = []
+        for item in features:
+            try:
+                results.append(self.run_batch([item])[0])
+            except Exception as e:
+                results.append(e)
+        return results
+
+    def stats(self) -> Dict[str, float]:
+        """Queue depth, batch fill and wait time statistics"""
+        avg_batch = self.requests / self.batches if self.batches else 0.0
+        return {
+            "queue_depth": self.queue_depth,
+            "inflight_requests": self.inflight_requests,
+            "max_concurrent_batches": self.max_concurrent,
+            "max_batch_size": self.max_batch_size,
+            "max_wait_ms": self.max_wait_s * 1000.0,
+            "requests": self.requests,
+            "batches": self.batches,
+            "last_batch_size": self.last_batch_size,
+            "avg_batch_size": round(avg_batch, 3),
+            "avg_batch_fill": round(avg_batch / self.max_batch_size, 3),
+            "avg_wait_ms": round(self.total_wait_s / self.requests * 1000.0, 3) if self.requests else 0.0,
+            "max_wait_ms_observed": round(self.max_observed_wait_s * 1000.0, 3),
+        }
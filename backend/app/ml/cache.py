@@ -0,0 +1,91 @@
+"""
+LRU cache of predictions keyed on quantized feature vectors
+
+Frames from a still user are nearly identical. Rounding each value to a fixed
+precision maps them to the same key, so repeated frames skip tensor assembly,
+the forward pass and result formatting entirely.
+"""
+import hashlib
+import threading
+from collections import OrderedDict
+from typing import Any, Dict, Optional
+
+import numpy as np
+
+
+class PredictionCache:
+    """Bounded LRU of prediction dicts, cleared whenever the model changes"""
+
+    def __init__(self, max_entries: int = 4096, precision: float = 1e-3):
+        self.max_entries = max(0, max_entries)
+        self.precision = precision if precision > 0 else 1e-3
+        self._entries: "OrderedDict[bytes, Dict]" = OrderedDict()
+        # Bumped by clear(); results computed by an older model are not stored
+        self.generation = 0
+
+        # Statistics
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+        # Used from inference worker threads
+        self._lock = threading.Lock()
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_entries > 0
+
+    def key(self, features: Dict[str, Any]) -> bytes:
+        """Digest of face_kp/pose_kp rounded to `precision`"""
+        digest = hashlib.blake2b(digest_size=16)
+        for part in ("face_kp", "pose_kp"):
+            values = np.asarray(features.get(part, []), dtype=np.float32).ravel()
+            quantized = np.rint(values / self.precision).astype(np.int64)
+            # Length prefix keeps (face, pose) splits of the same values apart
+            digest.update(len(quantized).to_bytes(4, "little"))
+            digest.update(quantized.tobytes())
+        return digest.digest()
+
+    def get(self, key: bytes) -> Optional[Dict]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry
+
+    def set(self, key: bytes, value: Dict, generation: int):
+        with self._lock:
+            if generation != self.generation:
+                return
+            self._entries[key] = value
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def clear(self):
+        """Drop every entry (model reloaded)"""
+        with self._lock:
+            self._entries.clear()
+            self.generation += 1
+            self.invalidations += 1
+
+    def stats(self) -> Dict[str, Any]:
+        """Size, hit/miss/eviction counters and hit ratio"""
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "enabled": self.enabled,
+                "size": len(self._entries),
+                "max_entries": self.max_entries,
+                "precision": self.precision,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "invalidations": self.invalidations,
+                "hit_ratio": round(self.hits / lookups, 3) if lookups else 0.0,
+            }
@@ -0,0 +1,328 @@
+"""
+Dedicated executors for inference work
+
+Inference used to run on anyio's default thread pool (40 threads shared with
+every other to_thread call), with torch starting its own intra-op threads
+inside each, so cores were oversubscribed once sessions outnumbered them.
+An executor bounds both:
+
+    thread   a fixed pool of inference threads, each limited to
+             threads_per_worker torch threads (workers x threads ~ cores)
+    process  the same number of threads, each driving a model process that
+             holds its own copy of the model; batches and logits are passed
+             through shared memory and the forward pass runs outside this
+             process's GIL
+
+Only frame-level models run in model processes. Temporal models keep their
+per-session state in this process and run on the threads.
+"""
+import asyncio
+import multiprocessing as mp
+import os
+import queue
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from multiprocessing import shared_memory
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+import numpy as np
+import torch
+
+
+class InferenceOverloaded(RuntimeError):
+    """Raised instead of queueing a frame when too many are already pending"""
+
+
+def default_threads(workers: int) -> int:
+    """Split the host's cores evenly across inference workers"""
+    return max(1, (os.cpu_count() or 1) // workers)
+
+
+class InferenceExecutor:
+    """Fixed-size pool of inference threads with a bounded number of torch threads each"""
+
+    mode = "thread"
+
+    def __init__(self, workers: int = 1, threads_per_worker: int = 0):
+        self.workers = max(1, workers)
+        self.threads_per_worker = threads_per_worker if threads_per_worker > 0 else default_threads(self.workers)
+        self._pool: Optional[ThreadPoolExecutor] = None
+
+        # Statistics
+        self.pending = 0  # calls submitted and not yet finished
+        self.busy = 0  # calls running on an inference thread
+        self.calls = 0
+        self.busy_s = 0.0
+        # Guards the counters updated from inference threads
+        self._stats_lock = threading.Lock()
+
+    def _init_thread(self):
+        torch.set_num_threads(self.threads_per_worker)
+
+    def start(self):
+        if self._pool is None:
+            self._pool = ThreadPoolExecutor(
+                max_workers=self.workers,
+                thread_name_prefix="inference",
+                initializer=self._init_thread
+            )
+
+    def _timed(self, fn: Callable, args: Tuple) -> Any:
+        started = time.perf_counter()
+        with self._stats_lock:
+            self.busy += 1
+        try:
+            return fn(*args)
+        finally:
+            with self._stats_lock:
+                self.busy -= 1
+                self.busy_s += time.perf_counter() - started
+                self.calls += 1
+
+    async def run(self, fn: Callable, *args) -> Any:
+        """Run fn(*args) on an inference thread"""
+        self.start()
+        self.pending += 1
+        try:
+            return await asyncio.wrap_future(self._pool.submit(self._timed, fn, args))
+        finally:
+            self.pending -= 1
+
+    def prepare(self, loaded):
+        """Called with a freshly loaded model before it is swapped in"""
+
+    def forward(self, loaded, batch: torch.Tensor):
+        """Forward pass of a frame-level model: (emotion_logits, stress or None)"""
+        return loaded.backend.run(batch)
+
+    def shutdown(self):
+        if self._pool is not None:
+            self._pool.shutdown(wait=True)
+            self._pool = None
+
+    def stats(self) -> Dict[str, Any]:
+        with self._stats_lock:
+            busy, calls, busy_s = self.busy, self.calls, self.busy_s
+        return {
+            "mode": self.mode,
+            "workers": self.workers,
+            "threads_per_worker": self.threads_per_worker,
+            "pending": self.pending,
+            "busy": busy,
+            "calls": calls,
+            "avg_call_ms": round(busy_s / calls * 1000.0, 3) if calls else 0.0,
+        }
+
+
+def _model_process_main(conn, threads: int):
+    """Model process: load on request, run batches found in shared memory"""
+    from .backends import create_backend
+
+    torch.set_num_threads(threads)
+    backend = None
+    segments: List[shared_memory.SharedMemory] = []
+    inputs = outputs = None
+
+    while True:
+        try:
+            message = conn.recv()
+        except (EOFError, OSError):
+            break
+        if message[0] == "stop":
+            break
+
+        try:
+            if message[0] == "load":
+                _, path, model_type, input_name, output_name, max_rows, input_size, width = message
+                loaded = create_backend(model_type, path, torch.device("cpu"), threads)
+                loaded.load()
+                loaded.run(torch.zeros((max_rows, input_size), dtype=torch.float32))  # warm up
+
+                attached = [shared_memory.SharedMemory(name=input_name), shared_memory.SharedMemory(name=output_name)]
+                inputs = outputs = None
+                for segment in segments:
+                    segment.close()
+                segments = attached
+                inputs = np.ndarray((max_rows, input_size), dtype=np.float32, buffer=segments[0].buf)
+                outputs = np.ndarray((max_rows, width), dtype=np.float32, buffer=segments[1].buf)
+                backend = loaded
+            elif message[0] == "run":
+                rows = message[1]
+                emotion, stress = backend.run(torch.from_numpy(inputs[:rows]))
+                outputs[:rows, :emotion.shape[1]] = emotion.float().numpy()
+                if stress is not None:
+                    outputs[:rows, -1] = stress.float().numpy()
+            conn.send(("ok", None))
+        except Exception as e:
+            conn.send(("error", repr(e)))
+
+    inputs = outputs = None
+    for segment in segments:
+        segment.close()
+
+
+class _ModelProcess:
+    """Parent-side handle of one model process and its shared memory buffers"""
+
+    def __init__(self, ctx, threads: int):
+        self.conn, child = ctx.Pipe()
+        self.process = ctx.Process(target=_model_process_main, args=(child, threads), daemon=True)
+        self.process.start()
+        child.close()
+
+        self.version: Optional[str] = None
+        self.emotions = 0
+        self.has_stress = False
+        self.max_rows = 0
+        self._segments: List[shared_memory.SharedMemory] = []
+        self._inputs = self._outputs = None
+        # One request at a time per process; also orders loads against runs
+        self.lock = threading.Lock()
+
+    def _request(self, message) -> None:
+        self.conn.send(message)
+        status, detail = self.conn.recv()
+        if status != "ok":
+            raise RuntimeError(f"Model process failed: {detail}")
+
+    def load(self, path: str, model_type: str, version: str, input_size: int, emotions: int, has_stress: bool, max_rows: int):
+        width = emotions + (1 if has_stress else 0)
+        segments = [
+            shared_memory.SharedMemory(create=True, size=max_rows * input_size * 4),
+            shared_memory.SharedMemory(create=True, size=max_rows * width * 4),
+        ]
+        with self.lock:
+            try:
+                self._request(("load", path, model_type, segments[0].name, segments[1].name, max_rows, input_size, width))
+            except Exception:
+                self._release(segments)
+                raise
+            old, self._segments = self._segments, segments
+            self._inputs = np.ndarray((max_rows, input_size), dtype=np.float32, buffer=segments[0].buf)
+            self._outputs = np.ndarray((max_rows, width), dtype=np.float32, buffer=segments[1].buf)
+            self.version, self.emotions, self.has_stress, self.max_rows = version, emotions, has_stress, max_rows
+        self._release(old)
+
+    def run(self, version: str, batch: torch.Tensor):
+        """Forward pass in the model process, or None if it serves another version (or died)"""
+        with self.lock:
+            if self.version != version:
+                return None
+            batch = batch.cpu()
+            chunks = []
+            try:
+                for start in range(0, len(batch), self.max_rows):
+                    rows = batch[start:start + self.max_rows]
+                    self._inputs[:len(rows)] = rows.numpy()
+                    self._request(("run", len(rows)))
+                    chunks.append(self._outputs[:len(rows)].copy())
+            except (EOFError, OSError) as e:
+                print(f"⚠ Model process {self.process.pid} is gone ({e}); running inference in-process")
+                self.version = None
+                return None
+
+        output = torch.from_numpy(np.concatenate(chunks))
+        stress = output[:, self.emotions] if self.has_stress else None
+        return output[:, :self.emotions], stress
+
+    @staticmethod
+    def _release(segments: List[shared_memory.SharedMemory]):
+        for segment in segments:
+            segment.close()
+            segment.unlink()
+
+    def stop(self):
+        with self.lock:
+            try:
+                self.conn.send(("stop",))
+            except (EOFError, OSError):
+                pass
+            self.process.join(timeout=5)
+            if self.process.is_alive():
+                self.process.terminate()
+            self._inputs = self._outputs = None
+            self._release(self._segments)
+            self._segments = []
+            self.version = None
+
+
+class ProcessInferenceExecutor(InferenceExecutor):
+    """Inference threads that hand forward passes to per-thread model processes"""
+
+    mode = "process"
+
+    def __init__(self, workers: int = 1, threads_per_worker: int = 0, max_rows: int = 16):
+        super().__init__(workers, threads_per_worker)
+        self.max_rows = max(1, max_rows)
+        self._processes: List[_ModelProcess] = []
+        self._idle: "queue.SimpleQueue[_ModelProcess]" = queue.SimpleQueue()
+        self.fallbacks = 0
+
+    def _init_thread(self):
+        # Threads here only assemble batches and wait on their process
+        torch.set_num_threads(1)
+
+    def _start_processes(self):
+        if self._processes:
+            return
+        ctx = mp.get_context("spawn")
+        for _ in range(self.workers):
+            process = _ModelProcess(ctx, self.threads_per_worker)
+            self._processes.append(process)
+            self._idle.put(process)
+
+    def prepare(self, loaded):
+        """Load the model into every model process (frame-level models only)"""
+        backend = loaded.backend
+        if backend.stateful or loaded.input_size is None:
+            return
+        self._start_processes()
+        with torch.no_grad():
+            emotion, stress = backend.run(torch.zeros((1, loaded.input_size), dtype=torch.float32))
+        for process in self._processes:
+            process.load(
+                loaded.path, loaded.model_type, loaded.version,
+                loaded.input_size, emotion.shape[1], stress is not None, self.max_rows
+            )
+
+    def forward(self, loaded, batch: torch.Tensor):
+        if loaded.backend.stateful or not self._processes:
+            return loaded.backend.run(batch)
+        process = self._idle.get()
+        try:
+            outputs = process.run(loaded.version, batch)
+        finally:
+            self._idle.put(process)
+        if outputs is None:
+            # Batch started before a reload finished, or the process died
+            with self._stats_lock:
+                self.fallbacks += 1
+            return loaded.backend.run(batch)
+        return outputs
+
+    def shutdown(self):
+        super().shutdown()
+        for process in self._processes:
+            process.stop()
+        self._processes = []
+        self._idle = queue.SimpleQueue()
+
+    def stats(self) -> Dict[str, Any]:
+        return dict(
+            super().stats(),
+            processes=[p.process.pid for p in self._processes if p.process.is_alive()],
+            fallbacks=self.fallbacks,
+        )
+
+
+def create_executor(mode: str, workers: int, threads_per_worker: int, max_rows: int, device: torch.device) -> InferenceExecutor:
+    """Executor configured by INFERENCE_EXECUTOR"""
+    if mode == "process":
+        if device.type != "cpu":
+            print("⚠ INFERENCE_EXECUTOR=process is CPU-only; using inference threads")
+            return InferenceExecutor(workers, threads_per_worker)
+        return ProcessInferenceExecutor(workers, threads_per_worker, max_rows)
+    if mode != "thread":
+        raise ValueError(f"Unknown inference executor '{mode}', expected 'thread' or 'process'")
+    return InferenceExecutor(workers, threads_per_worker)
@@ -3,34 +3,314 @@ ML inference engine for emotion and stress detection
 """
 import torch
 import numpy as np
-from typing import Dict, List, Tuple
+from typing import Dict, List, Optional, Tuple
 import asyncio
+import threading
+import time
 from anyio import to_thread
 from pathlib import Path
 
+from ..config import settings
+from .batching import InferenceBatcher
+from .backends import DEFAULT_EMOTION_CLASSES, InferenceBackend, create_backend
+from .cache import PredictionCache
+from .executor import InferenceExecutor, InferenceOverloaded, create_executor
+from .registry import ModelRegistry, file_version
+from .temporal import SessionStates
+
+
+# Used when a model has no stress head: stress is the probability mass on
+# emotions associated with tension
+STRESS_EMOTIONS = ("sad", "angry", "fearful", "disgusted")
+
+# MediaPipe pose: 33 landmarks x (x, y, z, visibility), placed after the face values
+POSE_SIZE = 33 * 4
+
+
+class LoadedModel:
+    """A backend with its version, classes and input normalization, swapped in as one unit"""
+    
+    def __init__(self, backend: InferenceBackend, version: str, model_type: str, path: str, device: torch.device):
+        self.backend = backend
+        self.version = version
+        self.model_type = model_type
+        self.path = path
+        self.loaded_at = time.time()
+        self.emotion_classes = list(backend.metadata.get("emotion_classes", DEFAULT_EMOTION_CLASSES))
+        self.stress_idx = [i for i, e in enumerate(self.emotion_classes) if e in STRESS_EMOTIONS]
+        
+        # Input layout and normalization constants, set from model metadata
+        self.input_size: Optional[int] = backend.metadata.get("input_size")
+        self.face_size = 0
+        self.mean_np: Optional[np.ndarray] = None
+        self.scale: Optional[torch.Tensor] = None
+        self.shift: Optional[torch.Tensor] = None
+        if self.input_size is not None:
+            self._configure_inputs(backend.metadata, device)
+    
+    def _configure_inputs(self, metadata: Dict, device: torch.device):
+        """Preallocate normalization constants matching the training statistics"""
+        self.face_size = max(0, self.input_size - POSE_SIZE)
+        if "mean" in metadata and "std" in metadata:
+            mean = np.asarray(metadata["mean"], dtype=np.float32)
+            scale = 1.0 / (np.asarray(metadata["std"], dtype=np.float32) + 1e-8)
+            # (x - mean) / std == x * scale + shift
+            self.mean_np = mean
+            self.scale = torch.from_numpy(scale).to(device)
+            self.shift = torch.from_numpy(-mean * scale).to(device)
+        else:
+            self.mean_np = np.zeros(self.input_size, dtype=np.float32)
+    
+    def info(self) -> Dict:
+        return {
+            "version": self.version,
+            "model_type": self.model_type,
+            "path": self.path,
+            "loaded_at": self.loaded_at,
+            "temporal": self.backend.stateful,
+            "input_size": self.input_size,
+        }
+
 
 class EmotionStressModel:
     """Wrapper for emotion and stress detection models"""
     
-    def __init__(self, model_path: str = None):
+    def __init__(
+        self,
+        model_path: str = None,
+        model_type: str = "pytorch",
+        num_threads: int = 0,
+        registry_dir: Optional[str] = None
+    ):
         self.model_path = model_path
-        self.model = None
+        self.model_type = model_type
+        self.num_threads = num_threads
+        self.registry = ModelRegistry(registry_dir, model_type) if registry_dir else None
         self.device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
-        self.emotion_classes = ["happy", "sad", "neutral", "angry", "surprised", "fearful", "disgusted"]
         
+        # Serving model; replaced atomically by reload(), each batch reads it once
+        self.active: Optional[LoadedModel] = None
+        self.pinned_version: Optional[str] = None
+        self.reloads = 0
+        self.reload_failures = 0
+        self.last_reload_error: Optional[str] = None
+        self._reload_lock: Optional[asyncio.Lock] = None
+        self._watcher: Optional[asyncio.Task] = None
+        
+        self.padded_frames = 0
+        self.truncated_frames = 0
+        # Batches are assembled on several inference threads
+        self._input_stats_lock = threading.Lock()
+        
+        # Hidden state per session, used when the model is temporal
+        self.session_states = SessionStates(settings.temporal_max_sessions, settings.temporal_idle_ttl_s)
+        
+        # Results for recently seen (quantized) frames of frame-level models
+        self.cache = PredictionCache(settings.prediction_cache_size, settings.prediction_cache_precision)
+        
+        # Dedicated inference threads (or model processes) instead of anyio's shared pool
+        self.executor: InferenceExecutor = create_executor(
+            settings.inference_executor,
+            settings.inference_workers,
+            num_threads,
+            settings.inference_batch_size,
+            self.device
+        )
+        self.max_pending = settings.inference_max_pending
+        self.rejected = 0
+        
+        self.batcher = InferenceBatcher(
+            self._predict_requests,
+            max_batch_size=settings.inference_batch_size,
+            max_wait_ms=settings.inference_max_wait_ms,
+            executor=self.executor
+        )
+    
+    @property
+    def backend(self) -> Optional[InferenceBackend]:
+        return self.active.backend if self.active is not None else None
+    
+    @property
+    def emotion_classes(self) -> List[str]:
+        return self.active.emotion_classes if self.active is not None else DEFAULT_EMOTION_CLASSES
+    
+    @property
+    def input_size(self) -> Optional[int]:
+        return self.active.input_size if self.active is not None else None
+    
+    @property
+    def model_version(self) -> str:
+        return self.active.version if self.active is not None else "mock"
+    
+    def _resolve(self, version: Optional[str] = None) -> Optional[Tuple[str, str, str]]:
+        """(path, model_type, version) to load: a registry version, or MODEL_PATH"""
+        if self.registry is not None:
+            entry = self.registry.resolve(version)
+            if entry is not None:
+                return entry["path"], entry["model_type"], entry["version"]
+            if version is not None:
+                return None
+        if version is None and self.model_path and Path(self.model_path).exists():
+            return self.model_path, self.model_type, file_version(self.model_path)
+        return None
+    
+    def _load(self, path: str, model_type: str, version: str) -> LoadedModel:
+        """Load and warm up a model without touching the one being served"""
+        backend = create_backend(model_type, path, self.device, self.executor.threads_per_worker)
+        backend.load()
+        loaded = LoadedModel(backend, version, model_type, path, self.device)
+        self._warmup(loaded)
+        self.executor.prepare(loaded)
+        return loaded
+    
+    def _warmup(self, loaded: LoadedModel):
+        """Run dummy batches so first real frames don't pay for lazy initialization"""
+        if loaded.input_size is None:
+            return
+        backend = loaded.backend
+        with torch.no_grad():
+            for _ in range(settings.model_warmup_batches):
+                for size in sorted({1, self.batcher.max_batch_size}):
+                    batch = torch.zeros((size, loaded.input_size), dtype=torch.float32, device=self.device)
+                    if backend.stateful:
+                        backend.run_step(batch, torch.zeros((size, backend.state_size), device=self.device))
+                    else:
+                        backend.run(batch)
+    
+    def _swap(self, loaded: Optional[LoadedModel]):
+        """Serve `loaded` from the next batch on; batches already running keep the old one"""
+        self.active = loaded
+        # Cached results and hidden states belong to the previous model
+        self.cache.clear()
+        self.session_states.clear()
+    
     def load_model(self):
         """Load the trained model"""
-        if self.model_path and Path(self.model_path).exists():
+        source = self._resolve()
+        if source is None:
+            print("⚠ No model file found. Using mock inference for demo.")
+            self._swap(None)
+            return
+        
+        path, model_type, version = source
+        try:
+            loaded = self._load(path, model_type, version)
+        except Exception as e:
+            print(f"⚠ Could not load model: {e}. Using mock inference.")
+            self._swap(None)
+            return
+        self._swap(loaded)
+        kind = " (temporal)" if loaded.backend.stateful else ""
+        print(f"✓ Loaded {model_type} model{kind} {version} from {path}")
+    
+    async def reload(self, version: Optional[str] = None) -> Dict:
+        """
+        Load a model version in the background, then swap it in between batches
+        
+        Without a version the latest registry version (or MODEL_PATH) is loaded
+        and following registry updates are picked up again; an explicit version
+        pins it until the next reload without one. Raises LookupError for an
+        unknown version; load errors leave the current model serving.
+        """
+        if self._reload_lock is None:
+            self._reload_lock = asyncio.Lock()
+        
+        async with self._reload_lock:
+            source = self._resolve(version)
+            if source is None:
+                raise LookupError(f"Model version not found: {version or 'latest'}")
+            path, model_type, resolved = source
+            
             try:
-                self.model = torch.load(self.model_path, map_location=self.device)
-                self.model.eval()
-                print(f"✓ Loaded model from {self.model_path}")
+                loaded = await to_thread.run_sync(self._load, path, model_type, resolved)
             except Exception as e:
-                print(f"⚠ Could not load model: {e}. Using mock inference.")
-                self.model = None
-        else:
-            print("⚠ No model file found. Using mock inference for demo.")
-            self.model = None
+                self.reload_failures += 1
+                self.last_reload_error = f"{resolved}: {e}"
+                raise
+            
+            previous = self.model_version
+            self._swap(loaded)
+            self.pinned_version = version
+            self.reloads += 1
+            self.last_reload_error = None
+            print(f"✓ Swapped model {previous} -> {resolved}")
+            return self.model_info()
+    
+    async def _watch_registry(self, interval_s: float):
+        """Poll the registry and hot-swap when a newer version appears"""
+        failed = None
+        while True:
+            await asyncio.sleep(interval_s)
+            if self.pinned_version is not None:
+                continue
+            entry = self.registry.resolve()
+            if entry is None or entry["version"] == self.model_version:
+                continue
+            # Don't retry a broken artifact until it changes
+            marker = (entry["version"], entry["modified_at"])
+            if marker == failed:
+                continue
+            try:
+                await self.reload()
+                failed = None
+            except Exception as e:
+                failed = marker
+                print(f"⚠ Could not load model version {entry['version']}: {e}")
+    
+    def model_info(self) -> Dict:
+        """Serving version, reload counters and the versions available in the registry"""
+        return {
+            "active": self.active.info() if self.active is not None else {"version": "mock"},
+            "pinned_version": self.pinned_version,
+            "reloads": self.reloads,
+            "reload_failures": self.reload_failures,
+            "last_reload_error": self.last_reload_error,
+            "registry": str(self.registry.root) if self.registry is not None else None,
+            "versions": self.registry.versions() if self.registry is not None else [],
+        }
+    
+    def _assemble_batch(self, active: LoadedModel, features_batch: List[Dict[str, List[float]]]) -> torch.Tensor:
+        """
+        Write every frame into one preallocated [N, input_size] float32 tensor
+        
+        Face values fill the leading slots and pose values the trailing POSE_SIZE
+        slots. Missing or short parts are padded with the training mean (zero after
+        normalization); extra values (e.g. MediaPipe's refined iris landmarks when
+        the model was trained on 468 landmarks) are truncated.
+        """
+        batch = torch.empty((len(features_batch), active.input_size), dtype=torch.float32)
+        rows = batch.numpy()
+        rows[:] = active.mean_np
+        
+        face_size, pose_size = active.face_size, active.input_size - active.face_size
+        padded = truncated = 0
+        for row, features in zip(rows, features_batch):
+            face = features.get("face_kp", [])
+            pose = features.get("pose_kp", [])
+            face_len, pose_len = len(face), len(pose)
+            
+            if face_len > face_size or pose_len > pose_size:
+                truncated += 1
+            elif face_len < face_size or pose_len < pose_size:
+                padded += 1
+            
+            if face_len:
+                n = min(face_len, face_size)
+                row[:n] = face[:n]
+            if pose_len:
+                n = min(pose_len, pose_size)
+                row[face_size:face_size + n] = pose[:n]
+        
+        if padded or truncated:
+            with self._input_stats_lock:
+                self.padded_frames += padded
+                self.truncated_frames += truncated
+        
+        batch = batch.to(self.device)
+        if active.scale is not None:
+            # Fused in-place normalization: batch = shift + batch * scale
+            torch.addcmul(active.shift, batch, active.scale, out=batch)
+        return batch
     
     def _mock_inference(self, features: Dict[str, List[float]]) -> Tuple[Dict[str, float], float]:
         """
@@ -69,58 +349,255 @@ class EmotionStressModel:
     
     def _real_inference(self, features: Dict[str, List[float]]) -> Tuple[Dict[str, float], float]:
         """
-        Real model inference
+        Real model inference for a single frame
+        """
+        return self._real_inference_batch(self.active, [features])[0]
+    
+    def _run_backend(
+        self,
+        active: LoadedModel,
+        input_tensor: torch.Tensor,
+        session_ids: Optional[List[Optional[str]]]
+    ):
         """
-        # Prepare input tensor
-        face_kp = np.array(features.get("face_kp", []), dtype=np.float32)
-        pose_kp = np.array(features.get("pose_kp", []), dtype=np.float32)
+        Forward pass; temporal models advance each session's hidden state by one step
+        """
+        backend = active.backend
+        if not backend.stateful:
+            return self.executor.forward(active, input_tensor)
         
-        # Concatenate features
-        combined_features = np.concatenate([face_kp, pose_kp])
-        input_tensor = torch.from_numpy(combined_features).unsqueeze(0).to(self.device)
+        if session_ids is None:
+            session_ids = [None] * len(input_tensor)
         
-        # Run inference
-        with torch.no_grad():
-            output = self.model(input_tensor)
-            
-            # Assuming model outputs [emotion_logits, stress_score]
-            emotion_logits = output[0]
-            stress_score = torch.sigmoid(output[1]).item()
-            
-            # Convert logits to probabilities
-            emotion_probs_tensor = torch.softmax(emotion_logits, dim=-1)
-            emotion_probs = {
-                self.emotion_classes[i]: emotion_probs_tensor[0][i].item()
-                for i in range(len(self.emotion_classes))
-            }
+        # Frames of the same session must be applied in order: split the batch
+        # into rounds that hold at most one frame per session
+        rounds: List[List[int]] = []
+        seen_count: Dict[str, int] = {}
+        for i, session_id in enumerate(session_ids):
+            n = seen_count.get(session_id, 0) if session_id is not None else 0
+            if session_id is not None:
+                seen_count[session_id] = n + 1
+            if n == len(rounds):
+                rounds.append([])
+            rounds[n].append(i)
         
-        return emotion_probs, stress_score
+        logits = None
+        for rows in rounds:
+            ids = [session_ids[i] for i in rows]
+            state = self.session_states.gather(ids, backend.state_size, self.device)
+            round_logits, _, state = backend.run_step(input_tensor[rows], state)
+            self.session_states.scatter(ids, state)
+            if len(rounds) == 1:
+                return round_logits, None
+            if logits is None:
+                logits = torch.empty(
+                    (len(input_tensor), round_logits.shape[1]),
+                    dtype=round_logits.dtype, device=round_logits.device
+                )
+            logits[rows] = round_logits
+        return logits, None
     
-    def predict(self, features: Dict[str, List[float]]) -> Dict:
+    def _real_inference_batch(
+        self,
+        active: LoadedModel,
+        features_batch: List[Dict[str, List[float]]],
+        session_ids: Optional[List[Optional[str]]] = None
+    ) -> List[Tuple[Dict[str, float], float]]:
         """
-        Predict emotion and stress from features
+        Real model inference over a stacked batch of frames
         """
-        if self.model is not None:
-            emotion_probs, stress_score = self._real_inference(features)
+        # Prepare input tensor, one row per frame
+        if active.input_size is not None:
+            input_tensor = self._assemble_batch(active, features_batch)
         else:
-            emotion_probs, stress_score = self._mock_inference(features)
+            # Legacy pickled modules without metadata: raw concatenated keypoints
+            rows = [
+                np.concatenate([
+                    np.asarray(features.get("face_kp", []), dtype=np.float32),
+                    np.asarray(features.get("pose_kp", []), dtype=np.float32)
+                ])
+                for features in features_batch
+            ]
+            input_tensor = torch.from_numpy(np.stack(rows)).to(self.device)
+        
+        # Run inference
+        with torch.no_grad():
+            emotion_logits, stress_logits = self._run_backend(active, input_tensor, session_ids)
+            emotion_probs = torch.softmax(emotion_logits.float(), dim=-1)
+            
+            if stress_logits is not None:
+                stress = torch.sigmoid(stress_logits.float())
+            else:
+                stress = emotion_probs[:, active.stress_idx].sum(dim=-1)
+            
+            # Single device -> host copy per output
+            emotion_probs_rows = emotion_probs.tolist()
+            stress_scores = stress.tolist()
         
+        return [
+            (dict(zip(active.emotion_classes, probs)), stress_score)
+            for probs, stress_score in zip(emotion_probs_rows, stress_scores)
+        ]
+    
+    def _format_prediction(self, emotion_probs: Dict[str, float], stress_score: float, version: str) -> Dict:
+        """Build the prediction dict returned to callers"""
         # Get dominant emotion
         dominant_emotion = max(emotion_probs, key=emotion_probs.get)
         
         return {
             "emotion": dominant_emotion,
             "emotion_prob": emotion_probs,
-            "stress_score": stress_score
+            "stress_score": stress_score,
+            "model_version": version
         }
     
-    async def predict_async(self, features: Dict[str, List[float]]) -> Dict:
+    def predict(self, features: Dict[str, List[float]], session_id: Optional[str] = None) -> Dict:
+        """
+        Predict emotion and stress from features
+        """
+        return self.predict_batch([features], [session_id])[0]
+    
+    def predict_batch(
+        self,
+        features_batch: List[Dict[str, List[float]]],
+        session_ids: Optional[List[Optional[str]]] = None
+    ) -> List[Dict]:
         """
-        Async wrapper for prediction
+        Predict emotion and stress for several frames in one forward pass
+        
+        session_ids identify whose hidden state each frame advances when the
+        model is temporal; they are ignored by frame-level models. The whole
+        batch runs on the model that was active when it started, even if a
+        reload swaps in another version meanwhile.
         """
-        return await to_thread.run_sync(self.predict, features)
+        # Read the generation before the model: a swap in between then only
+        # causes a skipped cache write, never a stale one
+        generation = self.cache.generation
+        active = self.active
+        
+        if active is None:
+            outputs = [self._mock_inference(features) for features in features_batch]
+            return [self._format_prediction(probs, stress, "mock") for probs, stress in outputs]
+        if self.cache.enabled and not active.backend.stateful:
+            return self._predict_cached(active, features_batch, generation)
+        
+        outputs = self._real_inference_batch(active, features_batch, session_ids)
+        return [self._format_prediction(probs, stress, active.version) for probs, stress in outputs]
+    
+    def _predict_cached(
+        self,
+        active: LoadedModel,
+        features_batch: List[Dict[str, List[float]]],
+        generation: int
+    ) -> List[Dict]:
+        """
+        Serve frames from the prediction cache, running inference only for misses
+        
+        Temporal models bypass the cache: their output depends on session history.
+        """
+        keys = [self.cache.key(features) for features in features_batch]
+        results = [self.cache.get(key) for key in keys]
+        
+        # Identical frames within one batch are computed once
+        missing: Dict[bytes, int] = {}
+        for i, result in enumerate(results):
+            if result is None:
+                missing.setdefault(keys[i], i)
+        
+        if missing:
+            outputs = self._real_inference_batch(active, [features_batch[i] for i in missing.values()])
+            computed = {}
+            for key, (probs, stress) in zip(missing, outputs):
+                computed[key] = self._format_prediction(probs, stress, active.version)
+                self.cache.set(key, computed[key], generation)
+            results = [computed[key] if result is None else result for key, result in zip(keys, results)]
+        
+        # Callers get their own dicts; cached entries are shared
+        return [dict(result, emotion_prob=dict(result["emotion_prob"])) for result in results]
+    
+    def _predict_requests(self, requests: List[Tuple[Dict[str, List[float]], Optional[str]]]) -> List[Dict]:
+        """Batcher entry point: (features, session_id) pairs"""
+        return self.predict_batch([features for features, _ in requests], [sid for _, sid in requests])
+    
+    def pending_frames(self) -> int:
+        """Frames waiting for or running inference"""
+        if self.batcher.max_batch_size > 1:
+            return self.batcher.queue_depth + self.batcher.inflight_requests
+        return self.executor.pending
+    
+    async def predict_async(self, features: Dict[str, List[float]], session_id: Optional[str] = None) -> Dict:
+        """
+        Async prediction; concurrent callers are micro-batched together
+        
+        Raises InferenceOverloaded right away, without queueing, when
+        max_pending frames are already waiting or running.
+        """
+        if self.max_pending and self.pending_frames() >= self.max_pending:
+            self.rejected += 1
+            raise InferenceOverloaded(f"{self.max_pending} frames already pending")
+        if self.batcher.max_batch_size > 1:
+            return await self.batcher.submit((features, session_id))
+        return await self.executor.run(self.predict, features, session_id)
+    
+    def executor_stats(self) -> Dict:
+        """Executor mode, workers and occupancy, plus admission control counters"""
+        return dict(
+            self.executor.stats(),
+            pending_frames=self.pending_frames(),
+            max_pending=self.max_pending,
+            rejected=self.rejected
+        )
+    
+    def release_session(self, session_id: str):
+        """Drop a finished session's temporal state"""
+        self.session_states.release(session_id)
+    
+    def input_stats(self) -> Dict[str, int]:
+        """Counts of frames whose length did not match the model input"""
+        return {
+            "input_size": self.input_size,
+            "padded_frames": self.padded_frames,
+            "truncated_frames": self.truncated_frames,
+        }
+    
+    def temporal_stats(self) -> Dict:
+        """Whether the model is temporal, and the size of the per-session state store"""
+        backend = self.backend
+        stateful = backend is not None and backend.stateful
+        return dict(
+            self.session_states.stats(),
+            enabled=stateful,
+            state_size=backend.state_size if stateful else 0
+        )
+    
+    async def start(self):
+        """Start the inference executor, the batching worker and the registry watcher"""
+        self.executor.start()
+        if self.batcher.max_batch_size > 1:
+            self.batcher.start()
+        if self.registry is not None and settings.model_registry_poll_s > 0 and self._watcher is None:
+            self._watcher = asyncio.get_running_loop().create_task(
+                self._watch_registry(settings.model_registry_poll_s)
+            )
+    
+    async def stop(self):
+        """Stop the registry watcher and the batching worker"""
+        if self._watcher is not None:
+            self._watcher.cancel()
+            try:
+                await self._watcher
+            except asyncio.CancelledError:
+                pass
+            self._watcher = None
+        await self.batcher.stop()
+        self.executor.shutdown()
 
 
 # Global model instance
-model = EmotionStressModel()
+model = EmotionStressModel(
+    settings.model_path,
+    settings.model_type,
+    settings.inference_threads,
+    settings.model_registry_dir
+)
 
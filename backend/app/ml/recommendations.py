@@ -1,7 +1,7 @@
 """
 Rule-based recommendation engine
 """
-from typing import Dict, Tuple, Optional
+from typing import Tuple, Optional
 import uuid
 
 
@@ -39,63 +39,22 @@ RECOMMENDATIONS = {
 class RecommendationEngine:
     """Rule-based engine for generating personalized recommendations"""
     
-    def __init__(self):
-        self.stress_history = {}  # session_id -> list of recent stress scores
-        self.emotion_history = {}  # session_id -> list of recent emotions
-        
-    def add_prediction(self, session_id: str, emotion: str, stress_score: float):
-        """Track prediction history for temporal analysis"""
-        if session_id not in self.stress_history:
-            self.stress_history[session_id] = []
-            self.emotion_history[session_id] = []
-        
-        self.stress_history[session_id].append(stress_score)
-        self.emotion_history[session_id].append(emotion)
-        
-        # Keep only recent history (last 10 predictions)
-        self.stress_history[session_id] = self.stress_history[session_id][-10:]
-        self.emotion_history[session_id] = self.emotion_history[session_id][-10:]
-    
-    def _get_avg_stress(self, session_id: str, window: int = 5) -> float:
-        """Calculate average stress over recent predictions"""
-        if session_id not in self.stress_history:
-            return 0.0
-        
-        recent = self.stress_history[session_id][-window:]
-        return sum(recent) / len(recent) if recent else 0.0
-    
-    def _get_dominant_emotion(self, session_id: str, window: int = 5) -> Optional[str]:
-        """Get most frequent recent emotion"""
-        if session_id not in self.emotion_history:
-            return None
-        
-        recent = self.emotion_history[session_id][-window:]
-        if not recent:
-            return None
-        
-        return max(set(recent), key=recent.count)
-    
     def get_recommendation(
         self, 
-        session_id: str, 
-        emotion: str, 
-        stress_score: float
+        avg_stress: float, 
+        dominant_emotion: Optional[str]
     ) -> Tuple[str, str, float]:
         """
-        Generate recommendation based on current and historical data
+        Generate recommendation from a session's recent history
+        
+        avg_stress and dominant_emotion cover the last few predictions and
+        come from the session-state store (app.session_state).
         
         Returns:
             (advice_id, advice_text, confidence)
         """
         import random
         
-        # Update history
-        self.add_prediction(session_id, emotion, stress_score)
-        
-        # Get temporal context
-        avg_stress = self._get_avg_stress(session_id)
-        dominant_emotion = self._get_dominant_emotion(session_id)
-        
         # Determine recommendation category
         category = None
         confidence = 0.5
@@ -136,9 +95,8 @@ class RecommendationEngine:
 recommendation_engine = RecommendationEngine()
 
 
-def get_recommendation(session_id: str, emotion: str, stress_score: float) -> Tuple[str, str, float]:
+def get_recommendation(avg_stress: float, dominant_emotion: Optional[str]) -> Tuple[str, str, float]:
     """
     Public interface for getting recommendations
     """
-    return recommendation_engine.get_recommendation(session_id, emotion, stress_score)
-
+    return recommendation_engine.get_recommendation(avg_stress, dominant_emotion)
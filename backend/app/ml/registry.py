@@ -0,0 +1,95 @@
+"""
+Local registry of versioned model artifacts
+
+Layout (one directory per version, names sorted naturally, e.g. v1 < v2 < v10):
+
+    models/registry/
+        v001/emotion_model.pth
+        v002/emotion_model.pth
+        v002/emotion_model.onnx
+
+A version directory may hold artifacts for several backends; the one matching
+MODEL_TYPE is preferred. Directories starting with "." or "_" are ignored, so
+a new version can be staged there and renamed into place atomically.
+"""
+import hashlib
+import re
+from pathlib import Path
+from typing import Dict, List, Optional
+
+
+# Artifact suffix -> backend name (longest suffix first)
+ARTIFACT_TYPES = (
+    (".ts.pt", "torchscript"),
+    (".onnx", "onnx"),
+    (".pth", "pytorch"),
+    (".pt", "torchscript"),
+)
+
+
+def artifact_type(path: Path) -> Optional[str]:
+    """Backend able to load this file, based on its suffix"""
+    name = path.name
+    for suffix, model_type in ARTIFACT_TYPES:
+        if name.endswith(suffix):
+            return model_type
+    return None
+
+
+def _natural_key(name: str):
+    return [int(part) if part.isdigit() else part for part in re.split(r"(\d+)", name)]
+
+
+class ModelRegistry:
+    """Versioned model directories under a root path"""
+
+    def __init__(self, root: str, preferred_type: str = "pytorch"):
+        self.root = Path(root)
+        self.preferred_type = preferred_type
+
+    def _artifact(self, version_dir: Path) -> Optional[Dict]:
+        """Pick the artifact to serve from a version directory"""
+        candidates = {}
+        for path in sorted(version_dir.iterdir()):
+            model_type = artifact_type(path)
+            if model_type is not None and path.is_file():
+                candidates.setdefault(model_type, path)
+        if not candidates:
+            return None
+        model_type = self.preferred_type if self.preferred_type in candidates else next(iter(candidates))
+        path = candidates[model_type]
+        return {
+            "version": version_dir.name,
+            "path": str(path),
+            "model_type": model_type,
+            "modified_at": path.stat().st_mtime,
+        }
+
+    def versions(self) -> List[Dict]:
+        """Every servable version, oldest first"""
+        if not self.root.is_dir():
+            return []
+        entries = []
+        for version_dir in self.root.iterdir():
+            if not version_dir.is_dir() or version_dir.name[0] in "._":
+                continue
+            entry = self._artifact(version_dir)
+            if entry is not None:
+                entries.append(entry)
+        return sorted(entries, key=lambda e: _natural_key(e["version"]))
+
+    def resolve(self, version: Optional[str] = None) -> Optional[Dict]:
+        """A specific version, or the latest one when version is None"""
+        entries = self.versions()
+        if version is None:
+            return entries[-1] if entries else None
+        return next((e for e in entries if e["version"] == version), None)
+
+
+def file_version(path: str) -> str:
+    """Version label for an artifact outside the registry: name plus content digest"""
+    digest = hashlib.blake2b(digest_size=6)
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            digest.update(chunk)
+    return f"{Path(path).name}@{digest.hexdigest()}"
@@ -0,0 +1,79 @@
+"""
+Per-session hidden state for temporal (stateful) models
+
+Each session keeps one [H] float32 vector; every new frame advances it by a
+single model step, so no past frames are buffered or re-sent.
+"""
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, List, Optional
+
+import torch
+
+
+class SessionStates:
+    """LRU store of per-session hidden states, bounded by count and idle time"""
+
+    def __init__(self, max_sessions: int = 10000, idle_ttl_s: float = 1800.0):
+        self.max_sessions = max_sessions
+        self.idle_ttl_s = idle_ttl_s
+        # session_id -> (state [H], last_seen), least recently used first
+        self.sessions: "OrderedDict[str, tuple]" = OrderedDict()
+        self.evicted = 0
+        self.steps = 0
+        # Touched from inference worker threads and the event loop
+        self._lock = threading.Lock()
+
+    def gather(self, session_ids: List[Optional[str]], state_size: int, device: torch.device) -> torch.Tensor:
+        """Stack the current states [N, H]; unknown (or None) sessions start at zero"""
+        states = torch.zeros((len(session_ids), state_size), dtype=torch.float32, device=device)
+        with self._lock:
+            for i, session_id in enumerate(session_ids):
+                entry = self.sessions.get(session_id) if session_id is not None else None
+                if entry is not None and entry[0].shape[0] == state_size:
+                    states[i] = entry[0]
+        return states
+
+    def scatter(self, session_ids: List[Optional[str]], states: torch.Tensor):
+        """Store the advanced states; rows without a session are discarded"""
+        now = time.monotonic()
+        with self._lock:
+            for session_id, state in zip(session_ids, states):
+                if session_id is None:
+                    continue
+                self.sessions[session_id] = (state.detach().clone(), now)
+                self.sessions.move_to_end(session_id)
+                self.steps += 1
+            self._evict(now)
+
+    def _evict(self, now: float):
+        """Drop least recently used sessions over capacity or idle past the TTL"""
+        cutoff = now - self.idle_ttl_s
+        while self.sessions:
+            session_id, (_, last_seen) = next(iter(self.sessions.items()))
+            if len(self.sessions) <= self.max_sessions and last_seen >= cutoff:
+                break
+            del self.sessions[session_id]
+            self.evicted += 1
+
+    def release(self, session_id: str):
+        """Forget a session's state once it has ended"""
+        with self._lock:
+            self.sessions.pop(session_id, None)
+
+    def clear(self):
+        """Drop all states (e.g. when the model changes)"""
+        with self._lock:
+            self.sessions.clear()
+
+    def stats(self) -> Dict[str, int]:
+        """Tracked session count, evictions, steps and memory held by states"""
+        with self._lock:
+            return {
+                "sessions": len(self.sessions),
+                "max_sessions": self.max_sessions,
+                "evicted": self.evicted,
+                "steps": self.steps,
+                "approx_bytes": sum(s.numel() * s.element_size() for s, _ in self.sessions.values()),
+            }
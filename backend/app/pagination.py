@@ -0,0 +1,122 @@
+"""
+Keyset pagination and field projection for list endpoints
+
+Pages are ordered on (sort field, _id) and a cursor encodes the last
+document's pair, so fetching page N costs the same as page 1 (no skip) and
+results stay stable while new documents arrive. Cursors are opaque to
+clients: base64url of the sort value in milliseconds and the 12-byte
+ObjectId. The queries are backed by compound indexes ending in _id
+(see app.indexes).
+"""
+import base64
+import binascii
+import json
+import struct
+from datetime import datetime, timedelta
+from typing import Any, Dict, Iterable, List, Optional, Set, Tuple
+
+from bson import ObjectId
+from motor.motor_asyncio import AsyncIOMotorCollection
+from pymongo import ASCENDING, DESCENDING
+
+
+_EPOCH = datetime(1970, 1, 1)
+_CURSOR = struct.Struct(">q12s")
+
+
+class InvalidPageRequest(ValueError):
+    """Malformed cursor or unknown projected field (reported as 400)"""
+
+
+def encode_cursor(sort_value: datetime, oid: ObjectId) -> str:
+    """Opaque cursor pointing just past (sort_value, oid)"""
+    ms = (sort_value.replace(tzinfo=None) - _EPOCH) // timedelta(milliseconds=1)
+    return base64.urlsafe_b64encode(_CURSOR.pack(ms, oid.binary)).rstrip(b"=").decode()
+
+
+def decode_cursor(cursor: str) -> Tuple[datetime, ObjectId]:
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        ms, oid = _CURSOR.unpack(raw)
+    except (binascii.Error, struct.error, ValueError):
+        raise InvalidPageRequest("Invalid cursor")
+    return _EPOCH + timedelta(milliseconds=ms), ObjectId(oid)
+
+
+def parse_fields(fields: Optional[str], allowed: Iterable[str]) -> Optional[Set[str]]:
+    """Comma-separated field names from ?fields=, None when all fields are wanted"""
+    if not fields:
+        return None
+    requested = {f.strip() for f in fields.split(",") if f.strip()}
+    unknown = requested - set(allowed)
+    if unknown:
+        raise InvalidPageRequest(f"Unknown fields {sorted(unknown)}; expected some of {sorted(allowed)}")
+    return requested
+
+
+def projection(fields: Optional[Set[str]], required: Iterable[str] = ()) -> Optional[Dict[str, int]]:
+    """MongoDB projection for the requested fields plus those the server needs"""
+    if fields is None:
+        return None
+    return {field: 1 for field in fields | set(required)}
+
+
+def keyset_filter(sort_field: str, cursor: Optional[str], descending: bool) -> Dict[str, Any]:
+    """Documents strictly after the cursor in (sort_field, _id) order"""
+    if not cursor:
+        return {}
+    value, oid = decode_cursor(cursor)
+    op = "$lt" if descending else "$gt"
+    return {"$or": [
+        {sort_field: {op: value}},
+        {sort_field: value, "_id": {op: oid}},
+    ]}
+
+
+async def fetch_page(
+    collection: AsyncIOMotorCollection,
+    query: Dict[str, Any],
+    sort_field: str,
+    limit: int,
+    cursor: Optional[str] = None,
+    descending: bool = False,
+    fields: Optional[Set[str]] = None
+) -> Tuple[List[Dict], Optional[str]]:
+    """
+    One page of documents and the cursor of the next page
+
+    Returns:
+        (documents, next_cursor); next_cursor is None on the last page
+    """
+    after = keyset_filter(sort_field, cursor, descending)
+    if after:
+        query = {"$and": [query, after]} if query else after
+
+    direction = DESCENDING if descending else ASCENDING
+    # One extra document tells whether another page exists
+    docs = await collection.find(query, projection(fields, [sort_field])).sort(
+        [(sort_field, direction), ("_id", direction)]
+    ).limit(limit + 1).to_list(length=limit + 1)
+
+    next_cursor = None
+    if len(docs) > limit:
+        docs = docs[:limit]
+        next_cursor = encode_cursor(docs[-1][sort_field], docs[-1]["_id"])
+
+    if fields is not None and sort_field not in fields:
+        for doc in docs:
+            doc.pop(sort_field, None)
+    return docs, next_cursor
+
+
+def _json_default(value: Any) -> Any:
+    if isinstance(value, datetime):
+        return value.isoformat()
+    if isinstance(value, ObjectId):
+        return str(value)
+    raise TypeError(f"{type(value).__name__} is not JSON serializable")
+
+
+def ndjson_line(doc: Dict[str, Any]) -> str:
+    """One document as a line of newline-delimited JSON"""
+    return json.dumps(doc, default=_json_default, separators=(",", ":")) + "\n"
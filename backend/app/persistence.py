@@ -0,0 +1,204 @@
+"""
+Write-behind persistence for high-frequency documents
+
+Prediction and insight documents are buffered in memory across all sessions
+and flushed with insert_many(ordered=False) when a size or time trigger fires,
+so the WebSocket loop never waits on a MongoDB round trip.
+"""
+import asyncio
+import time
+from typing import Dict, List, Optional
+
+from bson.errors import InvalidDocument
+from pymongo.errors import BulkWriteError, PyMongoError
+
+from .config import settings
+from .database import db
+from .metrics import db_insert_seconds
+
+
+class WriteBehindBuffer:
+    """Bounded in-memory buffer flushed to MongoDB in the background"""
+
+    def __init__(
+        self,
+        batch_size: int = 500,
+        flush_interval_ms: float = 200.0,
+        max_pending: int = 20000,
+        enqueue_timeout_ms: float = 50.0
+    ):
+        self.batch_size = max(1, batch_size)
+        self.flush_interval_s = max(0.001, flush_interval_ms / 1000.0)
+        self.max_pending = max(self.batch_size, max_pending)
+        self.enqueue_timeout_s = max(0.0, enqueue_timeout_ms / 1000.0)
+
+        self._buffers: Dict[str, List[dict]] = {}
+        self._pending = 0  # buffered + in-flight documents
+        self._wakeup: Optional[asyncio.Event] = None
+        self._space: Optional[asyncio.Event] = None
+        self._flush_lock: Optional[asyncio.Lock] = None
+        self._task: Optional[asyncio.Task] = None
+        self._stopping = False
+
+        # Statistics
+        self.enqueued = 0
+        self.written = 0
+        self.dropped = 0
+        self.failed = 0
+        self.flushes = 0
+        self.backpressure_waits = 0
+        self.total_flush_s = 0.0
+
+    @property
+    def running(self) -> bool:
+        return self._task is not None and not self._task.done()
+
+    def start(self):
+        """Start the background flusher on the running event loop"""
+        if self.running:
+            return
+        self._wakeup = asyncio.Event()
+        self._space = asyncio.Event()
+        self._space.set()
+        self._flush_lock = asyncio.Lock()
+        self._stopping = False
+        self._task = asyncio.get_running_loop().create_task(self._run())
+
+    async def stop(self):
+        """Drain everything still buffered, then stop the flusher"""
+        if not self.running:
+            return
+        self._stopping = True
+        self._wakeup.set()
+        await self._task
+        self._task = None
+        print(f"✓ Write-behind buffer drained ({self.written} written, {self.dropped} dropped, {self.failed} failed)")
+
+    async def put(self, collection: str, document: dict) -> bool:
+        """
+        Buffer a document for insertion
+
+        Waits up to enqueue_timeout_ms for space when the buffer is full and
+        drops the document if none frees up. Returns False if dropped.
+        """
+        if not self.running:
+            self.start()
+
+        if self._pending >= self.max_pending:
+            self.backpressure_waits += 1
+            self._space.clear()
+            self._wakeup.set()
+            try:
+                await asyncio.wait_for(self._space.wait(), self.enqueue_timeout_s)
+            except asyncio.TimeoutError:
+                pass
+            if self._pending >= self.max_pending:
+                self.dropped += 1
+                return False
+
+        self._buffers.setdefault(collection, []).append(document)
+        self._pending += 1
+        self.enqueued += 1
+
+        if self.buffered >= self.batch_size:
+            self._wakeup.set()
+        return True
+
+    @property
+    def buffered(self) -> int:
+        return sum(len(docs) for docs in self._buffers.values())
+
+    async def flush(self):
+        """Write every document buffered so far and wait for completion"""
+        if self.running:
+            await self._flush_safely()
+
+    async def _flush_safely(self):
+        """_flush_once, logging unexpected errors so the flusher keeps running"""
+        try:
+            await self._flush_once()
+        except Exception as e:
+            print(f"⚠ Write-behind flush failed: {e!r}")
+
+    async def _run(self):
+        """Flush on size trigger, time trigger, or shutdown"""
+        while True:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), self.flush_interval_s)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+
+            await self._flush_safely()
+
+            if self._stopping and not self._buffers:
+                return
+
+    async def _flush_once(self):
+        """Swap out the current buffers and bulk-insert them"""
+        async with self._flush_lock:
+            if not self._buffers:
+                return
+            buffers, self._buffers = self._buffers, {}
+
+            started = time.perf_counter()
+            remaining = sum(len(documents) for documents in buffers.values())
+            try:
+                for collection, documents in buffers.items():
+                    for start in range(0, len(documents), self.batch_size):
+                        chunk = documents[start:start + self.batch_size]
+                        await self._insert(collection, chunk)
+                        self._pending -= len(chunk)
+                        remaining -= len(chunk)
+                        self._space.set()
+            finally:
+                if remaining:
+                    # An unexpected error ended the flush: the rest of the swapped-out
+                    # documents are lost, release their slots so put() does not block
+                    self.failed += remaining
+                    self._pending -= remaining
+                    self._space.set()
+
+            self.flushes += 1
+            self.total_flush_s += time.perf_counter() - started
+
+    async def _insert(self, collection: str, documents: List[dict]):
+        """insert_many that records partial failures instead of raising"""
+        started = time.perf_counter()
+        try:
+            result = await db.db[collection].insert_many(documents, ordered=False)
+            self.written += len(result.inserted_ids)
+        except BulkWriteError as e:
+            errors = len(e.details.get("writeErrors", []))
+            self.failed += errors
+            self.written += len(documents) - errors
+            print(f"⚠ Bulk insert into {collection}: {errors} documents failed")
+        except (PyMongoError, InvalidDocument) as e:
+            self.failed += len(documents)
+            print(f"⚠ Bulk insert into {collection} failed: {e}")
+        finally:
+            db_insert_seconds.labels(collection).observe(time.perf_counter() - started)
+
+    def stats(self) -> Dict[str, float]:
+        """Buffer occupancy, throughput and drop counters"""
+        return {
+            "buffered": self.buffered,
+            "pending": self._pending,
+            "max_pending": self.max_pending,
+            "enqueued": self.enqueued,
+            "written": self.written,
+            "dropped": self.dropped,
+            "failed": self.failed,
+            "flushes": self.flushes,
+            "backpressure_waits": self.backpressure_waits,
+            "avg_flush_ms": round(self.total_flush_s / self.flushes * 1000.0, 3) if self.flushes else 0.0,
+        }
+
+
+# Global write-behind buffer
+writer = WriteBehindBuffer(
+    batch_size=settings.persist_batch_size,
+    flush_interval_ms=settings.persist_flush_interval_ms,
+    max_pending=settings.persist_max_pending,
+    enqueue_timeout_ms=settings.persist_enqueue_timeout_ms
+)
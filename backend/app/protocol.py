@@ -0,0 +1,102 @@
+"""
+Binary feature frame protocol for the real-time WebSocket
+
+Clients opt in by sending {"type": "hello", "encoding": "binary"}. Once the
+server acknowledges, feature frames may be sent as binary messages:
+
+    offset  size  field
+    0       1     message type (1 = features)
+    1       1     dtype (1 = float32, 2 = float16)
+    2       2     reserved
+    4       8     timestamp (ms, unsigned)
+    12      2     face_kp length (values, not bytes)
+    14      2     pose_kp length (values, not bytes)
+    16      ...   face_kp values followed by pose_kp values
+
+All fields are little-endian. JSON frames remain accepted at any time.
+"""
+import struct
+from typing import Dict, Tuple, Union
+
+import numpy as np
+
+
+PROTOCOL_VERSION = 1
+
+MSG_FEATURES = 1
+
+DTYPE_CODES = {
+    1: np.dtype("<f4"),
+    2: np.dtype("<f2"),
+}
+DTYPE_NAMES = {"float32": 1, "float16": 2}
+
+HEADER = struct.Struct("<BBHQHH")
+
+
+class ProtocolError(ValueError):
+    """Raised when a binary frame cannot be decoded"""
+
+
+def decode_feature_frame(data: bytes) -> Tuple[int, Dict[str, np.ndarray]]:
+    """
+    Decode a binary feature frame without building Python float lists
+
+    Returns:
+        (timestamp, {"face_kp": ndarray, "pose_kp": ndarray})
+    """
+    if len(data) < HEADER.size:
+        raise ProtocolError("Frame shorter than header")
+
+    msg_type, dtype_code, _, timestamp, face_len, pose_len = HEADER.unpack_from(data)
+    if msg_type != MSG_FEATURES:
+        raise ProtocolError(f"Unsupported message type: {msg_type}")
+
+    dtype = DTYPE_CODES.get(dtype_code)
+    if dtype is None:
+        raise ProtocolError(f"Unsupported dtype code: {dtype_code}")
+
+    expected = HEADER.size + (face_len + pose_len) * dtype.itemsize
+    if len(data) != expected:
+        raise ProtocolError(f"Frame length {len(data)} does not match header ({expected})")
+
+    values = np.frombuffer(data, dtype=dtype, count=face_len + pose_len, offset=HEADER.size)
+    return timestamp, {
+        "face_kp": values[:face_len],
+        "pose_kp": values[face_len:],
+    }
+
+
+def encode_feature_frame(
+    timestamp: int,
+    face_kp,
+    pose_kp,
+    dtype: str = "float32"
+) -> bytes:
+    """Encode a feature frame (used by clients and load tests)"""
+    dtype_code = DTYPE_NAMES[dtype]
+    np_dtype = DTYPE_CODES[dtype_code]
+    face = np.asarray(face_kp, dtype=np_dtype)
+    pose = np.asarray(pose_kp, dtype=np_dtype)
+    header = HEADER.pack(MSG_FEATURES, dtype_code, 0, int(timestamp), face.size, pose.size)
+    return header + face.tobytes() + pose.tobytes()
+
+
+def negotiate(hello: Dict) -> Dict:
+    """Build the server's reply to a client hello message"""
+    requested = hello.get("encoding", "json")
+    encoding = "binary" if requested == "binary" else "json"
+    return {
+        "type": "hello",
+        "version": PROTOCOL_VERSION,
+        "encoding": encoding,
+        "dtypes": list(DTYPE_NAMES),
+    }
+
+
+def features_to_lists(features: Dict[str, Union[np.ndarray, list]]) -> Dict[str, list]:
+    """Convert decoded feature arrays into BSON/JSON friendly lists"""
+    return {
+        key: value.tolist() if isinstance(value, np.ndarray) else value
+        for key, value in features.items()
+    }
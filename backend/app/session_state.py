@@ -0,0 +1,569 @@
+"""
+Per-session state shared by every worker serving the WebSocket
+
+Recommendations look at a session's last few predictions and the session
+keeps running aggregates; both used to live in the memory of whichever
+worker handled the frame, so with several uvicorn workers a session whose
+connection landed on another worker lost them. A store holds that state:
+
+    memory  in this process; one worker, or a local stand-in for tests
+    socket  a state server shared by all workers over a Unix socket (one
+            host) or TCP (several hosts):  python -m app.session_state
+
+Over TCP the server requires the shared SESSION_STORE_TOKEN: each client
+sends it as the first line of a connection and the server hangs up on a
+missing or wrong token. A Unix socket is guarded by its file permissions
+(and by the token too when one is set).
+
+Each inferred frame costs one request: record() appends to the history,
+folds the prediction into the aggregates and returns the recent window.
+The store also versions each user's trends, so ending a session on one
+worker invalidates the trends cached by every worker (app.analytics).
+Tests can run against MemorySessionStore directly, or start a
+SessionStateServer in-process on a temporary socket and point a
+SocketSessionStore at it.
+"""
+import argparse
+import asyncio
+import hmac
+import json
+import os
+import socket
+import sys
+import time
+from collections import OrderedDict, deque
+from datetime import datetime
+from typing import Any, Dict, Optional, Set, Tuple
+
+from .aggregates import SessionAggregator
+from .config import settings
+
+
+# Longest request or reply line (aggregates of a long session are the largest)
+MAX_MESSAGE_BYTES = 16 * 1024 * 1024
+# Time a new connection has to present the token
+AUTH_TIMEOUT_S = 5.0
+
+
+class SessionStoreUnavailable(RuntimeError):
+    """Raised when the shared state server cannot be reached in time"""
+
+
+class SessionHistory:
+    """Ring buffers of recent predictions with running window statistics"""
+
+    __slots__ = ("stress", "emotions", "window", "stress_sum", "emotion_counts", "last_seen")
+
+    def __init__(self, size: int = 10, window: int = 5):
+        if size < 1 or window < 1:
+            raise ValueError(f"History size and window must be at least 1, got {size} and {window}")
+        self.stress = deque(maxlen=size)
+        self.emotions = deque(maxlen=size)
+        self.window = min(window, size)
+        self.stress_sum = 0.0  # over the last `window` predictions
+        self.emotion_counts: Dict[str, int] = {}  # over the last `window` predictions
+        self.last_seen = time.monotonic()
+
+    def add(self, emotion: str, stress_score: float):
+        """Append a prediction, sliding the running window forward"""
+        if len(self.stress) >= self.window:
+            # Remove the values leaving the window
+            self.stress_sum -= self.stress[-self.window]
+            leaving = self.emotions[-self.window]
+            self.emotion_counts[leaving] -= 1
+            if not self.emotion_counts[leaving]:
+                del self.emotion_counts[leaving]
+
+        self.stress.append(stress_score)
+        self.emotions.append(emotion)
+        self.stress_sum += stress_score
+        self.emotion_counts[emotion] = self.emotion_counts.get(emotion, 0) + 1
+        self.last_seen = time.monotonic()
+
+    def avg_stress(self) -> float:
+        count = min(len(self.stress), self.window)
+        return self.stress_sum / count if count else 0.0
+
+    def dominant_emotion(self) -> Optional[str]:
+        if not self.emotion_counts:
+            return None
+        return max(self.emotion_counts, key=self.emotion_counts.get)
+
+    def nbytes(self) -> int:
+        """Approximate resident size of this session's history"""
+        return (
+            sys.getsizeof(self.stress) + sys.getsizeof(self.emotions)
+            + sys.getsizeof(self.emotion_counts) + 8 * len(self.stress)
+        )
+
+
+class SessionStateStore:
+    """Interface of a session-state store; all methods are coroutines"""
+
+    backend = "none"
+
+    async def start(self):
+        pass
+
+    async def stop(self):
+        pass
+
+    async def record(
+        self, session_id: str, started_at: datetime, prediction: Dict, timestamp: datetime
+    ) -> Tuple[float, Optional[str]]:
+        """Track a prediction; returns (average stress, dominant emotion) over the recent window"""
+        raise NotImplementedError
+
+    async def aggregates(self, session_id: str) -> Optional[Dict]:
+        """Live aggregates of a running session, None if not tracked"""
+        raise NotImplementedError
+
+    async def end(self, session_id: str) -> Optional[Dict]:
+        """Forget a session; returns its final aggregates, None if not tracked in full"""
+        raise NotImplementedError
+
+    async def invalidate_trends(self, user_id: str) -> str:
+        """Bump a user's trends version, marking every worker's cached trends stale"""
+        raise NotImplementedError
+
+    async def trends_version(self, user_id: str) -> str:
+        """Opaque version of a user's trends; changes whenever they are invalidated"""
+        raise NotImplementedError
+
+    async def stats(self) -> Dict[str, Any]:
+        raise NotImplementedError
+
+
+class MemorySessionStore(SessionStateStore):
+    """Session histories and aggregates held in this process"""
+
+    backend = "memory"
+
+    def __init__(
+        self,
+        history_size: int = 10,
+        window: int = 5,
+        max_sessions: int = 10000,
+        idle_ttl_s: float = 1800.0,
+        aggregator: Optional[SessionAggregator] = None
+    ):
+        if history_size < 1 or window < 1:
+            raise ValueError(f"History size and window must be at least 1, got {history_size} and {window}")
+        self.history_size = history_size
+        self.window = window
+        self.max_sessions = max_sessions
+        self.idle_ttl_s = idle_ttl_s
+        # session_id -> SessionHistory, least recently used first
+        self.histories: "OrderedDict[str, SessionHistory]" = OrderedDict()
+        self.evicted = 0
+        self.aggregator = aggregator if aggregator is not None else SessionAggregator()
+
+        # user_id -> sequence number of the user's last invalidation, least recent first.
+        # Users dropped over capacity read as the highest dropped number, so a version
+        # cached before their last invalidation never matches again; the epoch does the
+        # same across restarts of the store
+        self.trends_versions: "OrderedDict[str, int]" = OrderedDict()
+        self._trends_seq = 0
+        self._trends_floor = 0
+        self._trends_epoch = os.urandom(4).hex()
+
+    def _evict(self):
+        """Drop least recently used histories over capacity or idle past the TTL"""
+        cutoff = time.monotonic() - self.idle_ttl_s
+        while self.histories:
+            session_id, history = next(iter(self.histories.items()))
+            if len(self.histories) <= self.max_sessions and history.last_seen >= cutoff:
+                break
+            del self.histories[session_id]
+            self.evicted += 1
+
+    def record_sync(
+        self, session_id: str, started_at: datetime, emotion: str, stress_score: float,
+        emotion_prob: Dict[str, float], timestamp: datetime
+    ) -> Tuple[float, Optional[str]]:
+        history = self.histories.get(session_id)
+        if history is None:
+            history = self.histories[session_id] = SessionHistory(self.history_size, self.window)
+        else:
+            self.histories.move_to_end(session_id)
+        history.add(emotion, stress_score)
+        self._evict()
+
+        self.aggregator.add(
+            session_id, started_at, {"emotion_prob": emotion_prob, "stress_score": stress_score}, timestamp
+        )
+        return history.avg_stress(), history.dominant_emotion()
+
+    def aggregates_sync(self, session_id: str) -> Optional[Dict]:
+        aggregate = self.aggregator.get(session_id)
+        return aggregate.to_dict() if aggregate is not None else None
+
+    def end_sync(self, session_id: str) -> Optional[Dict]:
+        self.histories.pop(session_id, None)
+        aggregate = self.aggregator.pop(session_id)
+        return aggregate.to_dict() if aggregate is not None else None
+
+    def invalidate_trends_sync(self, user_id: str) -> str:
+        self._trends_seq += 1
+        self.trends_versions[user_id] = self._trends_seq
+        self.trends_versions.move_to_end(user_id)
+        while len(self.trends_versions) > self.max_sessions:
+            _, seq = self.trends_versions.popitem(last=False)
+            self._trends_floor = max(self._trends_floor, seq)
+        return self.trends_version_sync(user_id)
+
+    def trends_version_sync(self, user_id: str) -> str:
+        return f"{self._trends_epoch}:{self.trends_versions.get(user_id, self._trends_floor)}"
+
+    def stats_sync(self) -> Dict[str, Any]:
+        return {
+            "backend": self.backend,
+            "recommendations": {
+                "sessions": len(self.histories),
+                "max_sessions": self.max_sessions,
+                "evicted": self.evicted,
+                "approx_bytes": sum(h.nbytes() for h in self.histories.values()),
+            },
+            "aggregates": {"sessions": len(self.aggregator), "evicted": self.aggregator.evicted},
+            "trends_versions": {"users": len(self.trends_versions), "invalidations": self._trends_seq},
+        }
+
+    async def record(self, session_id, started_at, prediction, timestamp):
+        return self.record_sync(
+            session_id, started_at, prediction["emotion"], prediction["stress_score"],
+            prediction["emotion_prob"], timestamp
+        )
+
+    async def aggregates(self, session_id):
+        return self.aggregates_sync(session_id)
+
+    async def end(self, session_id):
+        return self.end_sync(session_id)
+
+    async def invalidate_trends(self, user_id):
+        return self.invalidate_trends_sync(user_id)
+
+    async def trends_version(self, user_id):
+        return self.trends_version_sync(user_id)
+
+    async def stats(self):
+        return self.stats_sync()
+
+
+def _parse_address(address: str) -> Tuple[Optional[str], Optional[int], Optional[str]]:
+    """(host, port, None) for "host:port", (None, None, path) for a Unix socket path"""
+    host, sep, port = address.rpartition(":")
+    if sep and port.isdigit() and "/" not in address:
+        return host or "127.0.0.1", int(port), None
+    return None, None, address
+
+
+async def _open_connection(address: str):
+    host, port, path = _parse_address(address)
+    if path is not None:
+        return await asyncio.open_unix_connection(path, limit=MAX_MESSAGE_BYTES)
+    return await asyncio.open_connection(host, port, limit=MAX_MESSAGE_BYTES)
+
+
+class SessionStateServer:
+    """Serves a MemorySessionStore to SocketSessionStore clients, one JSON line per request"""
+
+    def __init__(self, store: MemorySessionStore, address: str, token: Optional[str] = None):
+        self.store = store
+        self.address = address
+        self.token = token
+        self._server: Optional[asyncio.AbstractServer] = None
+        self._writers: Set[asyncio.StreamWriter] = set()
+        self.requests = 0
+        self.rejected = 0
+
+    def _authenticated(self, line: bytes) -> bool:
+        """Whether the first line of a connection carries the shared token"""
+        try:
+            token = json.loads(line).get("auth")
+        except (ValueError, AttributeError):
+            return False
+        return isinstance(token, str) and hmac.compare_digest(token.encode(), self.token.encode())
+
+    def _dispatch(self, op: str, args: list) -> Any:
+        if op == "record":
+            session_id, started_at, emotion, stress_score, emotion_prob, timestamp = args
+            return self.store.record_sync(
+                session_id, datetime.fromisoformat(started_at), emotion, stress_score,
+                emotion_prob, datetime.fromisoformat(timestamp)
+            )
+        if op == "aggregates":
+            return self.store.aggregates_sync(*args)
+        if op == "end":
+            return self.store.end_sync(*args)
+        if op == "invalidate_trends":
+            return self.store.invalidate_trends_sync(*args)
+        if op == "trends_version":
+            return self.store.trends_version_sync(*args)
+        if op == "stats":
+            return dict(
+                self.store.stats_sync(), connections=len(self._writers),
+                requests=self.requests, rejected=self.rejected
+            )
+        raise ValueError(f"Unknown operation '{op}'")
+
+    async def _handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        self._writers.add(writer)
+        try:
+            if self.token and not self._authenticated(
+                await asyncio.wait_for(reader.readline(), AUTH_TIMEOUT_S)
+            ):
+                self.rejected += 1
+                writer.write(json.dumps({"error": "authentication failed"}).encode() + b"\n")
+                await writer.drain()
+                return
+            async for line in reader:
+                # Operations are in-memory and synchronous, so requests are
+                # answered in order and never interleave
+                request = json.loads(line)
+                self.requests += 1
+                try:
+                    reply = {"id": request["id"], "result": self._dispatch(request["op"], request["args"])}
+                except Exception as e:
+                    reply = {"id": request["id"], "error": repr(e)}
+                writer.write(json.dumps(reply).encode() + b"\n")
+                await writer.drain()
+        except (ConnectionError, asyncio.IncompleteReadError, asyncio.TimeoutError, ValueError,
+                asyncio.CancelledError):
+            pass
+        finally:
+            self._writers.discard(writer)
+            writer.close()
+
+    async def start(self):
+        host, port, path = _parse_address(self.address)
+        if path is None:
+            if not self.token:
+                raise RuntimeError(
+                    f"Refusing to serve session state on {host}:{port} without a token; set SESSION_STORE_TOKEN"
+                )
+            self._server = await asyncio.start_server(self._handle, host, port, limit=MAX_MESSAGE_BYTES)
+            return
+
+        if os.path.exists(path):
+            # Refuse to take over a socket another server is still listening on
+            probe = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            try:
+                probe.connect(path)
+            except OSError:
+                os.unlink(path)
+            else:
+                raise RuntimeError(f"A session state server is already listening on {path}")
+            finally:
+                probe.close()
+        self._server = await asyncio.start_unix_server(self._handle, path, limit=MAX_MESSAGE_BYTES)
+
+    async def stop(self):
+        if self._server is not None:
+            self._server.close()
+            # Drop client connections too, so clients fail over instead of waiting
+            for writer in list(self._writers):
+                writer.close()
+            await self._server.wait_closed()
+            self._server = None
+            _, _, path = _parse_address(self.address)
+            if path is not None and os.path.exists(path):
+                os.unlink(path)
+
+
+class SocketSessionStore(SessionStateStore):
+    """Client of a SessionStateServer; requests from all sessions share one connection"""
+
+    backend = "socket"
+
+    def __init__(
+        self, address: str, timeout_s: float = 1.0, retry_s: float = 1.0, token: Optional[str] = None
+    ):
+        self.address = address
+        self.token = token
+        self.timeout_s = timeout_s
+        self.retry_s = retry_s
+        self._writer: Optional[asyncio.StreamWriter] = None
+        self._receiver: Optional[asyncio.Task] = None
+        self._pending: Dict[int, asyncio.Future] = {}
+        self._next_id = 0
+        self._connect_lock: Optional[asyncio.Lock] = None
+        self._retry_at = 0.0
+
+        # Statistics
+        self.requests = 0
+        self.failures = 0
+        self.reconnects = 0
+
+    async def _connect(self):
+        if self._connect_lock is None:
+            self._connect_lock = asyncio.Lock()
+        async with self._connect_lock:
+            if self._writer is not None:
+                return
+            # After a failed attempt, fail fast until retry_s has passed
+            if time.monotonic() < self._retry_at:
+                raise SessionStoreUnavailable(f"Session state server at {self.address} is unreachable")
+            try:
+                reader, writer = await asyncio.wait_for(_open_connection(self.address), self.timeout_s)
+            except (OSError, asyncio.TimeoutError) as e:
+                self._retry_at = time.monotonic() + self.retry_s
+                raise SessionStoreUnavailable(f"Session state server at {self.address} is unreachable: {e!r}")
+            if self.token:
+                writer.write(json.dumps({"auth": self.token}).encode() + b"\n")
+            self._writer = writer
+            self._receiver = asyncio.create_task(self._receive(reader, writer))
+            self.reconnects += 1
+
+    async def _receive(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        """Resolve pending requests as replies arrive; fail them all when the connection drops"""
+        try:
+            async for line in reader:
+                reply = json.loads(line)
+                if "id" not in reply:
+                    # Connection-level error, e.g. a rejected token; the server hangs up next
+                    print(f"⚠ Session state server at {self.address}: {reply.get('error')}")
+                    self._retry_at = time.monotonic() + self.retry_s
+                    continue
+                future = self._pending.pop(reply["id"], None)
+                if future is None or future.done():
+                    continue
+                if "error" in reply:
+                    future.set_exception(RuntimeError(f"Session state server: {reply['error']}"))
+                else:
+                    future.set_result(reply["result"])
+        except (ConnectionError, asyncio.IncompleteReadError, ValueError):
+            pass
+        finally:
+            if self._writer is writer:
+                self._writer = None
+            writer.close()
+            pending, self._pending = self._pending, {}
+            for future in pending.values():
+                if not future.done():
+                    future.set_exception(SessionStoreUnavailable("Connection to the session state server was lost"))
+
+    async def _call(self, op: str, *args) -> Any:
+        if self._writer is None:
+            try:
+                await self._connect()
+            except SessionStoreUnavailable:
+                self.failures += 1
+                raise
+
+        self._next_id += 1
+        request_id = self._next_id
+        future = asyncio.get_running_loop().create_future()
+        self._pending[request_id] = future
+        self.requests += 1
+        try:
+            self._writer.write(json.dumps({"id": request_id, "op": op, "args": args}).encode() + b"\n")
+            return await asyncio.wait_for(future, self.timeout_s)
+        except asyncio.TimeoutError:
+            self.failures += 1
+            raise SessionStoreUnavailable(f"Session state server did not answer within {self.timeout_s}s")
+        except SessionStoreUnavailable:
+            self.failures += 1
+            raise
+        finally:
+            self._pending.pop(request_id, None)
+
+    async def start(self):
+        try:
+            await self._connect()
+            print(f"✓ Connected to session state server at {self.address}")
+        except SessionStoreUnavailable as e:
+            print(f"⚠ {e}; retrying on demand")
+
+    async def stop(self):
+        if self._writer is not None:
+            self._writer.close()
+            self._writer = None
+        if self._receiver is not None:
+            self._receiver.cancel()
+            self._receiver = None
+
+    async def record(self, session_id, started_at, prediction, timestamp):
+        avg_stress, dominant_emotion = await self._call(
+            "record", session_id, started_at.isoformat(), prediction["emotion"],
+            prediction["stress_score"], prediction["emotion_prob"], timestamp.isoformat()
+        )
+        return avg_stress, dominant_emotion
+
+    async def aggregates(self, session_id):
+        return await self._call("aggregates", session_id)
+
+    async def end(self, session_id):
+        return await self._call("end", session_id)
+
+    async def invalidate_trends(self, user_id):
+        return await self._call("invalidate_trends", user_id)
+
+    async def trends_version(self, user_id):
+        return await self._call("trends_version", user_id)
+
+    async def stats(self):
+        client = {
+            "address": self.address,
+            "connected": self._writer is not None,
+            "requests": self.requests,
+            "failures": self.failures,
+            "reconnects": self.reconnects,
+        }
+        try:
+            server = await self._call("stats")
+        except (SessionStoreUnavailable, RuntimeError) as e:
+            server = {"backend": self.backend, "error": str(e)}
+        return dict(server, backend=self.backend, client=client)
+
+
+def create_memory_store() -> MemorySessionStore:
+    """In-process store configured from settings"""
+    return MemorySessionStore(
+        history_size=settings.recommendation_history_size,
+        window=settings.recommendation_window,
+        max_sessions=settings.recommendation_max_sessions,
+        idle_ttl_s=settings.recommendation_idle_ttl_s,
+        aggregator=SessionAggregator(
+            bucket_s=settings.aggregate_bucket_s,
+            max_sessions=settings.aggregate_max_sessions
+        )
+    )
+
+
+def create_session_store() -> SessionStateStore:
+    """Store configured by SESSION_STORE"""
+    if settings.session_store == "socket":
+        return SocketSessionStore(
+            settings.session_store_address, settings.session_store_timeout_s,
+            token=settings.session_store_token
+        )
+    if settings.session_store != "memory":
+        raise ValueError(f"Unknown session store '{settings.session_store}', expected 'memory' or 'socket'")
+    return create_memory_store()
+
+
+# Global session state store
+session_store = create_session_store()
+
+
+async def serve(address: str):
+    server = SessionStateServer(create_memory_store(), address, token=settings.session_store_token)
+    await server.start()
+    print(f"✓ Session state server listening on {address}")
+    try:
+        await asyncio.Event().wait()
+    finally:
+        await server.stop()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Session state server shared by API workers")
+    parser.add_argument("--address", default=settings.session_store_address,
+                        help="Unix socket path, or host:port for TCP (requires SESSION_STORE_TOKEN; "
+                             "a bare :port binds 127.0.0.1)")
+    args = parser.parse_args()
+    try:
+        asyncio.run(serve(args.address))
+    except KeyboardInterrupt:
+        pass
@@ -0,0 +1,406 @@
+"""
+Load test and latency benchmark for the real-time WebSocket inference path
+
+Usage:
+    python benchmark_ws.py --clients 50 --fps 15 --duration 30 --json results.json
+    python benchmark_ws.py --env INFERENCE_BATCH_SIZE=1 --env MODEL_TYPE=onnx --json onnx.json
+    python benchmark_ws.py --url http://127.0.0.1:8000 --clients 20
+
+By default the app is served in this process by uvicorn on a free localhost
+port, with MongoDB replaced by mongomock-motor so the run is self-contained.
+Simulated clients run in separate processes (--client-procs) so their JSON
+encoding does not compete with the server's event loop. Each client opens a
+session and sends 1,566-float feature frames (face + pose landmarks with
+per-frame jitter) at --fps.
+
+Reported:
+    latency     p50/p95/p99/max from sending a frame to receiving the
+                prediction carrying its timestamp
+    throughput  predictions/s; frames without a reply were coalesced by the
+                server's frame governor
+    loop lag    how late a periodic timer on the server's event loop fires
+    cpu         server process CPU (all threads) per second and per session
+
+In-process runs also include the app's own counters (micro-batching,
+executor, prediction cache, frame governor, write-behind buffer). Settings are read
+from the environment at import, so pass them with --env; compare runs with
+different settings by diffing their --json files.
+"""
+
+import argparse
+import asyncio
+import json
+import multiprocessing as mp
+import os
+import platform
+import resource
+import socket
+import time
+
+import numpy as np
+
+
+FACE_SIZE = 478 * 3
+POSE_SIZE = 33 * 4
+
+
+# ============================================================================
+# Simulated clients (run in child processes)
+# ============================================================================
+
+def make_frames(rng, count, jitter):
+    """A still-ish user: fixed base landmarks plus Gaussian jitter per frame"""
+    base = rng.uniform(0.2, 0.8, FACE_SIZE + POSE_SIZE).astype(np.float32)
+    noise = rng.normal(0.0, jitter, (count, FACE_SIZE + POSE_SIZE)).astype(np.float32)
+    return base + noise
+
+
+def encode_frames(frames, encoding):
+    """Pre-encode frames so the send loop only stamps the timestamp"""
+    from app.protocol import encode_feature_frame
+
+    if encoding == "binary":
+        return [
+            lambda ts, f=f: encode_feature_frame(ts, f[:FACE_SIZE], f[FACE_SIZE:])
+            for f in frames
+        ]
+    encoded = []
+    for f in frames:
+        features = json.dumps({"face_kp": f[:FACE_SIZE].tolist(), "pose_kp": f[FACE_SIZE:].tolist()})
+        encoded.append(lambda ts, body=features: f'{{"type": "features", "timestamp": {ts}, "features": {body}}}')
+    return encoded
+
+
+async def run_client(index, base_url, args, window, results):
+    """One session: send frames at args.fps, match replies by timestamp"""
+    import httpx
+    import websockets
+
+    rng = np.random.default_rng(args.seed + index)
+    frames = encode_frames(make_frames(rng, args.frame_pool, args.jitter), args.encoding)
+
+    async with httpx.AsyncClient(base_url=base_url) as http:
+        response = await http.post("/api/v1/sessions", json={"user_id": f"bench-{index}"})
+        response.raise_for_status()
+        session_id = response.json()["session_id"]
+
+    ws_url = base_url.replace("http", "ws", 1) + f"/ws/{session_id}"
+    sent_at = {}
+    stats = {"sent": 0, "answered": 0, "errors": 0, "latencies_ms": []}
+    measure_from, measure_until = window
+
+    async with websockets.connect(ws_url, max_size=None) as ws:
+        if args.encoding == "binary":
+            await ws.send(json.dumps({"type": "hello", "encoding": "binary"}))
+            await ws.recv()
+
+        async def receive():
+            async for message in ws:
+                received = time.perf_counter()
+                data = json.loads(message)
+                if data.get("type") != "prediction":
+                    stats["errors"] += 1
+                    continue
+                sent = sent_at.pop(data["timestamp"], None)
+                if sent is not None and measure_from <= sent < measure_until:
+                    stats["answered"] += 1
+                    stats["latencies_ms"].append((received - sent) * 1000.0)
+
+        receiver = asyncio.create_task(receive())
+        interval = 1.0 / args.fps
+        next_at = time.perf_counter() + rng.uniform(0, interval)
+        timestamp = 0
+        while next_at < measure_until:
+            await asyncio.sleep(max(0.0, next_at - time.perf_counter()))
+            timestamp += 1
+            now = time.perf_counter()
+            sent_at[timestamp] = now
+            await ws.send(frames[timestamp % len(frames)](timestamp))
+            if measure_from <= now < measure_until:
+                stats["sent"] += 1
+            next_at += interval
+
+        # Let in-flight replies arrive
+        await asyncio.sleep(args.drain)
+        receiver.cancel()
+
+    results.append(stats)
+
+
+async def run_clients(indices, base_url, args, queue):
+    started = time.perf_counter()
+    window = (started + args.warmup, started + args.warmup + args.duration)
+    queue.put(("started", os.getpid()))
+
+    results = []
+    outcomes = await asyncio.gather(
+        *(run_client(i, base_url, args, window, results) for i in indices),
+        return_exceptions=True
+    )
+    failures = [repr(o) for o in outcomes if isinstance(o, Exception)]
+    queue.put(("done", {"clients": results, "failures": failures}))
+
+
+def client_process(indices, base_url, args, queue):
+    asyncio.run(run_clients(indices, base_url, args, queue))
+
+
+# ============================================================================
+# Server-side measurement
+# ============================================================================
+
+class LoopLagMonitor:
+    """Samples how late a timer on the event loop fires"""
+
+    def __init__(self, interval_s=0.01):
+        self.interval_s = interval_s
+        self.samples_ms = []
+        self.recording = False
+        self._task = None
+
+    async def _run(self):
+        while True:
+            expected = time.perf_counter() + self.interval_s
+            await asyncio.sleep(self.interval_s)
+            if self.recording:
+                self.samples_ms.append(max(0.0, time.perf_counter() - expected) * 1000.0)
+
+    def start(self):
+        self._task = asyncio.get_running_loop().create_task(self._run())
+
+    def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+
+
+def percentiles(values):
+    if not values:
+        return {"p50": None, "p95": None, "p99": None, "max": None, "mean": None}
+    values = np.asarray(values)
+    p50, p95, p99 = np.percentile(values, [50, 95, 99])
+    return {
+        "p50": round(float(p50), 3),
+        "p95": round(float(p95), 3),
+        "p99": round(float(p99), 3),
+        "max": round(float(values.max()), 3),
+        "mean": round(float(values.mean()), 3),
+    }
+
+
+def free_port():
+    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def peak_rss_mb():
+    # ru_maxrss is KiB on Linux, bytes on macOS
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return rss / (1024 * 1024) if platform.system() == "Darwin" else rss / 1024
+
+
+async def start_server(port):
+    """Serve the app on localhost in this process, MongoDB replaced in memory"""
+    try:
+        from mongomock_motor import AsyncMongoMockClient
+    except ImportError:
+        raise SystemExit("In-process mode needs mongomock-motor (pip install mongomock-motor), or pass --url")
+    import uvicorn
+    from app.config import settings
+    from app.database import db
+    from app.main import app
+
+    async def connect_in_memory():
+        db.client = AsyncMongoMockClient()
+        db.db = db.client[settings.mongo_db_name]
+
+    db.connect = connect_in_memory
+
+    server = uvicorn.Server(uvicorn.Config(app, host="127.0.0.1", port=port, log_level="warning"))
+    task = asyncio.get_running_loop().create_task(server.serve())
+    while not server.started:
+        if task.done():
+            task.result()
+        await asyncio.sleep(0.05)
+    return server, task
+
+
+def app_counters():
+    """The app's own statistics (in-process mode only)"""
+    from app.governor import governor_stats
+    from app.ml import model
+    from app.persistence import writer
+
+    return {
+        "model": model.model_info()["active"],
+        "batching": model.batcher.stats(),
+        "executor": model.executor_stats(),
+        "cache": model.cache.stats(),
+        "governor": governor_stats.stats(),
+        "write_behind": writer.stats(),
+    }
+
+
+def app_settings():
+    from app.config import settings
+
+    keys = [
+        "model_type", "model_path", "model_registry_dir", "inference_executor", "inference_workers",
+        "inference_threads", "inference_max_pending", "inference_batch_size",
+        "inference_max_wait_ms", "prediction_cache_size", "governor_target_fps", "governor_skip_delta",
+        "persist_batch_size", "persist_flush_interval_ms", "session_store", "store_raw_frames",
+    ]
+    return {key: getattr(settings, key) for key in keys}
+
+
+# ============================================================================
+# Run
+# ============================================================================
+
+async def run(args):
+    in_process = args.url is None
+    server = None
+    if in_process:
+        port = free_port()
+        base_url = f"http://127.0.0.1:{port}"
+        server, server_task = await start_server(port)
+    else:
+        base_url = args.url.rstrip("/")
+
+    lag = LoopLagMonitor(args.lag_interval_ms / 1000.0)
+    lag.start()
+
+    # Spread clients over processes and start them
+    ctx = mp.get_context("spawn")
+    queue = ctx.Queue()
+    groups = [list(g) for g in np.array_split(np.arange(args.clients), args.client_procs) if len(g)]
+    processes = [
+        ctx.Process(target=client_process, args=([int(i) for i in g], base_url, args, queue))
+        for g in groups
+    ]
+    for p in processes:
+        p.start()
+
+    loop = asyncio.get_running_loop()
+    started = 0
+    while started < len(processes):
+        kind, _ = await loop.run_in_executor(None, queue.get)
+        started += kind == "started"
+
+    # Measured window on the server side matches the clients' window
+    await asyncio.sleep(args.warmup)
+    lag.recording = True
+    cpu_start, wall_start = time.process_time(), time.perf_counter()
+    await asyncio.sleep(args.duration)
+    cpu_s, wall_s = time.process_time() - cpu_start, time.perf_counter() - wall_start
+    lag.recording = False
+
+    clients, failures = [], []
+    for _ in processes:
+        kind, payload = await loop.run_in_executor(None, queue.get)
+        clients.extend(payload["clients"])
+        failures.extend(payload["failures"])
+    for p in processes:
+        await loop.run_in_executor(None, p.join)
+    lag.stop()
+
+    counters = app_counters() if in_process else None
+    if server is not None:
+        server.should_exit = True
+        await server_task
+
+    latencies = [ms for c in clients for ms in c["latencies_ms"]]
+    sent = sum(c["sent"] for c in clients)
+    answered = sum(c["answered"] for c in clients)
+    result = {
+        "clients": args.clients,
+        "connected": len(clients),
+        "failures": failures,
+        "duration_s": round(wall_s, 3),
+        "frames_sent": sent,
+        "predictions": answered,
+        "offered_fps": round(sent / wall_s, 2),
+        "throughput_fps": round(answered / wall_s, 2),
+        "unanswered_ratio": round(1 - answered / sent, 4) if sent else None,
+        "errors": sum(c["errors"] for c in clients),
+        "latency_ms": percentiles(latencies),
+    }
+    if in_process:
+        cores = cpu_s / wall_s
+        result.update({
+            "loop_lag_ms": percentiles(lag.samples_ms),
+            "server_cpu_cores": round(cores, 3),
+            "cpu_ms_per_session_s": round(cores * 1000.0 / max(1, len(clients)), 3),
+            "cpu_ms_per_prediction": round(cpu_s * 1000.0 / answered, 3) if answered else None,
+            "peak_rss_mb": round(peak_rss_mb(), 1),
+        })
+    return result, counters
+
+
+def report(result):
+    lat = result["latency_ms"]
+    print(f"\nClients: {result['connected']}/{result['clients']} connected, {result['duration_s']:.1f}s measured")
+    print(f"Frames:  {result['frames_sent']} sent ({result['offered_fps']:.1f}/s), "
+          f"{result['predictions']} answered ({result['throughput_fps']:.1f}/s)")
+    if lat["p50"] is not None:
+        print(f"Latency: p50 {lat['p50']:.2f} ms  p95 {lat['p95']:.2f} ms  "
+              f"p99 {lat['p99']:.2f} ms  max {lat['max']:.2f} ms")
+    if "loop_lag_ms" in result:
+        lag = result["loop_lag_ms"]
+        if lag["p50"] is not None:
+            print(f"Loop lag: p50 {lag['p50']:.2f} ms  p99 {lag['p99']:.2f} ms  max {lag['max']:.2f} ms")
+        print(f"CPU:     {result['server_cpu_cores']:.2f} cores, "
+              f"{result['cpu_ms_per_session_s']:.2f} ms/s per session, "
+              f"{result['cpu_ms_per_prediction'] or 0:.3f} ms per prediction")
+    for failure in result["failures"][:5]:
+        print(f"⚠ Client failed: {failure}")
+
+
+def main(args):
+    for item in args.env:
+        key, _, value = item.partition("=")
+        os.environ[key] = value
+
+    result, counters = asyncio.run(run(args))
+    report(result)
+
+    if args.json:
+        output = {
+            "label": args.label,
+            "environment": {
+                "python": platform.python_version(),
+                "platform": platform.platform(),
+                "cpu_count": os.cpu_count(),
+            },
+            "args": vars(args),
+            "settings": app_settings() if args.url is None else None,
+            "results": result,
+            "app": counters,
+        }
+        with open(args.json, "w") as f:
+            json.dump(output, f, indent=2, default=str)
+        print(f"✓ Wrote {args.json}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Load test the WebSocket inference path")
+    parser.add_argument("--clients", type=int, default=20, help="Simulated sessions")
+    parser.add_argument("--fps", type=float, default=15.0, help="Frames per second per client")
+    parser.add_argument("--duration", type=float, default=20.0, help="Measured seconds")
+    parser.add_argument("--warmup", type=float, default=3.0, help="Seconds before measuring")
+    parser.add_argument("--drain", type=float, default=1.0, help="Seconds to wait for replies after the last frame")
+    parser.add_argument("--encoding", choices=["json", "binary"], default="json", help="Frame encoding")
+    parser.add_argument("--jitter", type=float, default=0.002, help="Per-frame landmark noise (std)")
+    parser.add_argument("--frame-pool", type=int, default=64, help="Distinct pre-encoded frames per client")
+    parser.add_argument("--client-procs", type=int, default=max(1, min(4, (os.cpu_count() or 2) // 2)),
+                        help="Processes running the clients")
+    parser.add_argument("--lag-interval-ms", type=float, default=10.0, help="Event-loop lag probe period")
+    parser.add_argument("--url", type=str, default=None, help="Test a running server instead of serving in-process")
+    parser.add_argument("--env", action="append", default=[], metavar="KEY=VALUE",
+                        help="Setting override for the in-process app (repeatable)")
+    parser.add_argument("--seed", type=int, default=0, help="Seed for the synthetic landmarks")
+    parser.add_argument("--label", type=str, default=None, help="Name stored in the JSON results")
+    parser.add_argument("--json", type=str, default=None, help="Write results to this file")
+
+    args = parser.parse_args()
+    main(args)
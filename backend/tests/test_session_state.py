@@ -0,0 +1,199 @@
+"""
+Session state store: the in-process store and the shared server and client
+"""
+from datetime import datetime, timedelta
+
+import pytest
+
+from app.aggregates import SessionAggregator
+from app.session_state import (
+    MemorySessionStore,
+    SessionStateServer,
+    SessionStoreUnavailable,
+    SocketSessionStore,
+)
+
+
+STARTED_AT = datetime(2026, 1, 1, 12, 0, 0)
+
+
+def prediction(emotion: str, stress_score: float) -> dict:
+    return {"emotion": emotion, "stress_score": stress_score, "emotion_prob": {emotion: 1.0}}
+
+
+def memory_store(**kwargs) -> MemorySessionStore:
+    kwargs.setdefault("aggregator", SessionAggregator(bucket_s=60))
+    return MemorySessionStore(**kwargs)
+
+
+async def record_all(store, session_id: str, predictions):
+    result = None
+    for i, (emotion, stress_score) in enumerate(predictions):
+        timestamp = STARTED_AT + timedelta(seconds=30 * i)
+        result = await store.record(session_id, STARTED_AT, prediction(emotion, stress_score), timestamp)
+    return result
+
+
+async def tcp_server(token):
+    server = SessionStateServer(memory_store(), "127.0.0.1:0", token=token)
+    await server.start()
+    port = server._server.sockets[0].getsockname()[1]
+    return server, f"127.0.0.1:{port}"
+
+
+# MemorySessionStore
+
+@pytest.mark.asyncio
+async def test_record_returns_recent_window():
+    store = memory_store(history_size=5, window=3)
+
+    avg_stress, dominant = await record_all(store, "s1", [
+        ("happy", 0.9), ("sad", 0.1), ("sad", 0.2), ("angry", 0.6),
+    ])
+
+    # Only the last three predictions count
+    assert avg_stress == pytest.approx(0.3)
+    assert dominant == "sad"
+
+
+@pytest.mark.asyncio
+async def test_sessions_are_tracked_separately():
+    store = memory_store(window=2)
+
+    await record_all(store, "s1", [("happy", 0.2)])
+    avg_stress, dominant = await record_all(store, "s2", [("angry", 0.8)])
+
+    assert (avg_stress, dominant) == (pytest.approx(0.8), "angry")
+
+
+@pytest.mark.asyncio
+async def test_aggregates_and_end():
+    store = memory_store()
+    await record_all(store, "s1", [("happy", 0.2), ("happy", 0.4), ("sad", 0.6)])
+
+    aggregates = await store.aggregates("s1")
+    assert aggregates["prediction_count"] == 3
+    assert aggregates["dominant_mood"] == "happy"
+    assert aggregates["stress_score"] == pytest.approx(0.4)
+    assert [bucket["count"] for bucket in aggregates["timeline"]] == [2, 1]
+
+    assert await store.end("s1") == aggregates
+    assert await store.aggregates("s1") is None
+    assert await store.end("s1") is None
+    assert (await store.stats())["recommendations"]["sessions"] == 0
+
+
+@pytest.mark.asyncio
+async def test_trends_versions():
+    store = memory_store(max_sessions=2)
+
+    initial = await store.trends_version("u1")
+    assert await store.trends_version("u1") == initial
+
+    bumped = await store.invalidate_trends("u1")
+    assert bumped != initial
+    assert await store.trends_version("u1") == bumped
+    assert await store.trends_version("u2") == initial
+
+    # Dropping u1 over capacity must not bring back a version from before its invalidation
+    await store.invalidate_trends("u2")
+    await store.invalidate_trends("u3")
+    assert "u1" not in store.trends_versions
+    assert await store.trends_version("u1") != initial
+
+
+@pytest.mark.parametrize("history_size, window", [(10, 0), (0, 5), (-1, -1)])
+def test_rejects_empty_window(history_size, window):
+    with pytest.raises(ValueError):
+        MemorySessionStore(history_size=history_size, window=window)
+
+
+# SessionStateServer / SocketSessionStore
+
+@pytest.mark.asyncio
+async def test_socket_store_round_trip(tmp_path):
+    address = str(tmp_path / "state.sock")
+    server = SessionStateServer(memory_store(window=2), address)
+    await server.start()
+    client = SocketSessionStore(address)
+    try:
+        avg_stress, dominant = await record_all(client, "s1", [("happy", 0.2), ("sad", 0.4), ("sad", 0.8)])
+        assert avg_stress == pytest.approx(0.6)
+        assert dominant == "sad"
+
+        aggregates = await client.aggregates("s1")
+        assert aggregates == server.store.aggregates_sync("s1")
+        assert aggregates["prediction_count"] == 3
+
+        version = await client.trends_version("u1")
+        assert await client.invalidate_trends("u1") != version
+
+        stats = await client.stats()
+        assert stats["backend"] == "socket"
+        assert stats["client"]["connected"]
+        assert stats["connections"] == 1
+
+        assert await client.end("s1") == aggregates
+        assert await client.aggregates("s1") is None
+    finally:
+        await client.stop()
+        await server.stop()
+    assert not (tmp_path / "state.sock").exists()
+
+
+@pytest.mark.asyncio
+async def test_socket_store_unreachable(tmp_path):
+    client = SocketSessionStore(str(tmp_path / "missing.sock"), timeout_s=0.5)
+
+    with pytest.raises(SessionStoreUnavailable):
+        await record_all(client, "s1", [("happy", 0.2)])
+    # Fails fast until retry_s has passed
+    with pytest.raises(SessionStoreUnavailable):
+        await client.aggregates("s1")
+    assert client.failures == 2
+
+
+@pytest.mark.asyncio
+async def test_unix_socket_already_in_use(tmp_path):
+    address = str(tmp_path / "state.sock")
+    server = SessionStateServer(memory_store(), address)
+    await server.start()
+    try:
+        with pytest.raises(RuntimeError):
+            await SessionStateServer(memory_store(), address).start()
+    finally:
+        await server.stop()
+
+
+@pytest.mark.asyncio
+async def test_tcp_requires_token():
+    with pytest.raises(RuntimeError, match="SESSION_STORE_TOKEN"):
+        await SessionStateServer(memory_store(), "127.0.0.1:0").start()
+
+
+@pytest.mark.asyncio
+async def test_tcp_with_token():
+    server, address = await tcp_server("s3cret")
+    client = SocketSessionStore(address, token="s3cret")
+    try:
+        avg_stress, dominant = await record_all(client, "s1", [("neutral", 0.3)])
+        assert (avg_stress, dominant) == (pytest.approx(0.3), "neutral")
+        assert server.rejected == 0
+    finally:
+        await client.stop()
+        await server.stop()
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("token", [None, "wrong"])
+async def test_tcp_rejects_missing_or_wrong_token(token):
+    server, address = await tcp_server("s3cret")
+    client = SocketSessionStore(address, timeout_s=1.0, token=token)
+    try:
+        with pytest.raises(SessionStoreUnavailable):
+            await record_all(client, "s1", [("neutral", 0.3)])
+        assert server.rejected == 1
+        assert server.store.aggregates_sync("s1") is None
+    finally:
+        await client.stop()
+        await server.stop()
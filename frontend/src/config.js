@@ -12,6 +12,7 @@ const config = {
     faceDetectionConfidence: 0.5,
     poseDetectionConfidence: 0.5,
     extractionIntervalMs: 500, // Send features every 500ms
+    binaryFrames: true, // Negotiate packed float32 frames instead of JSON
   },
   
   // UI settings
@@ -3,6 +3,7 @@ import { useNavigate } from 'react-router-dom'
 import CameraCapture from '../components/CameraCapture'
 import LiveMoodCard from '../components/LiveMoodCard'
 import config from '../config'
+import { encodeFeatureFrame } from '../utils/featureExtraction'
 
 export default function Live() {
   const navigate = useNavigate()
@@ -15,6 +16,7 @@ export default function Live() {
   const [duration, setDuration] = useState(0)
   
   const wsRef = useRef(null)
+  const binaryFramesRef = useRef(false)
   const featureQueueRef = useRef([])
   const sendIntervalRef = useRef(null)
 
@@ -76,9 +78,14 @@ export default function Live() {
   // Connect WebSocket
   const connectWebSocket = (sid) => {
     const ws = new WebSocket(`${config.wsUrl}/ws/${sid}`)
+    binaryFramesRef.current = false
     
     ws.onopen = () => {
       console.log('WebSocket connected')
+      if (config.featureExtraction.binaryFrames) {
+        // Frames stay JSON until the server acknowledges binary encoding
+        ws.send(JSON.stringify({ type: 'hello', encoding: 'binary', dtype: 'float32' }))
+      }
       setConnectionStatus('connected')
       setIsConnecting(false)
     }
@@ -88,6 +95,8 @@ export default function Live() {
         const data = JSON.parse(event.data)
         if (data.type === 'prediction') {
           setPrediction(data)
+        } else if (data.type === 'hello') {
+          binaryFramesRef.current = data.encoding === 'binary'
         }
       } catch (error) {
         console.error('Error parsing WebSocket message:', error)
@@ -122,6 +131,10 @@ export default function Live() {
     featureQueueRef.current = []
 
     // Send via WebSocket
+    if (binaryFramesRef.current) {
+      wsRef.current.send(encodeFeatureFrame(features, Date.now()))
+      return
+    }
     wsRef.current.send(JSON.stringify({
       type: 'features',
       timestamp: Date.now(),
@@ -102,3 +102,33 @@ export function combineFeatures(faceKeypoints, poseKeypoints) {
   }
 }
 
+
+/**
+ * Binary feature frame layout (see backend app/protocol.py)
+ */
+const FRAME_HEADER_BYTES = 16
+const MSG_FEATURES = 1
+const DTYPE_FLOAT32 = 1
+
+/**
+ * Encode features as a binary frame: 16-byte header + packed float32 values
+ */
+export function encodeFeatureFrame(features, timestamp) {
+  const face = features.face_kp || []
+  const pose = features.pose_kp || []
+  const buffer = new ArrayBuffer(FRAME_HEADER_BYTES + (face.length + pose.length) * 4)
+  const view = new DataView(buffer)
+
+  view.setUint8(0, MSG_FEATURES)
+  view.setUint8(1, DTYPE_FLOAT32)
+  view.setUint16(2, 0, true)
+  view.setBigUint64(4, BigInt(timestamp), true)
+  view.setUint16(12, face.length, true)
+  view.setUint16(14, pose.length, true)
+
+  const values = new Float32Array(buffer, FRAME_HEADER_BYTES)
+  values.set(face, 0)
+  values.set(pose, face.length)
+
+  return buffer
+}
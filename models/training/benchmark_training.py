@@ -0,0 +1,175 @@
+"""
+Reproducible training throughput benchmark on synthetic landmark data
+
+Usage:
+    python benchmark_training.py --samples 50000 --epochs 3 --modes memory memmap stream \\
+        --threads 4 --json results.json
+
+Generates a seeded synthetic dataset (class-conditional Gaussians with the
+production feature size) as a shard cache, then trains EmotionModel on it
+through each data path:
+
+    memory   in-RAM float32 array + EmotionDataset
+    memmap   memory-mapped shards + EmotionDataset (train_emotion.py --cache)
+    stream   ShardStream over the shards (train_emotion.py --cache --stream)
+
+and reports samples/s, data vs compute time and peak RSS per mode. The first
+epoch is treated as warmup; steady-state numbers are medians of the rest.
+Run the same command before and after a change on the same host to compare.
+"""
+
+import argparse
+import json
+import os
+import platform
+import tempfile
+from pathlib import Path
+
+import numpy as np
+import torch
+import torch.nn as nn
+import torch.optim as optim
+
+from dataset_cache import TRAIN, load_cache, open_shards, write_manifest, CACHE_VERSION
+from profiling import StepTimer, peak_rss_mb
+from train_emotion import (
+    EmotionModel, EmotionDataset, ShardStream, make_loader, loader_options, train_epoch
+)
+
+
+MODES = ['memory', 'memmap', 'stream']
+
+
+def write_synthetic_cache(cache_dir, samples, feature_dim, num_classes, seed=0, shard_size=50000):
+    """Write a seeded synthetic dataset directly in the dataset_cache layout"""
+    cache_dir = Path(cache_dir)
+    cache_dir.mkdir(parents=True, exist_ok=True)
+    rng = np.random.default_rng(seed)
+    centers = rng.normal(0.0, 0.5, size=(num_classes, feature_dim)).astype(np.float32)
+
+    manifest = {'version': CACHE_VERSION, 'feature_dim': feature_dim, 'shards': []}
+    for offset in range(0, samples, shard_size):
+        count = min(shard_size, samples - offset)
+        name = f"shard-{len(manifest['shards']):05d}"
+        labels = rng.integers(0, num_classes, size=count)
+
+        features = np.lib.format.open_memmap(
+            cache_dir / f"{name}.features.npy", mode='w+', dtype=np.float32, shape=(count, feature_dim)
+        )
+        for start in range(0, count, 8192):
+            rows = labels[start:start + 8192]
+            noise = rng.standard_normal((len(rows), feature_dim), dtype=np.float32)
+            features[start:start + len(rows)] = centers[rows] + noise
+        features.flush()
+        del features
+
+        np.save(cache_dir / f"{name}.labels.npy", labels.astype(np.int64))
+        files = [f"synthetic-{i:09d}.json" for i in range(offset, offset + count)]
+        manifest['shards'].append({'name': name, 'count': count, 'files': files})
+    write_manifest(cache_dir, manifest)
+
+
+def make_train_loader(mode, cache_dir, batch_size, options):
+    """Training loader over every cached sample for the given data path"""
+    if mode == 'stream':
+        shards = open_shards(cache_dir)
+        assignments = [np.full(len(s['labels']), TRAIN, dtype=np.uint8) for s in shards]
+        dim = shards[0]['features'].shape[1]
+        stream = ShardStream(cache_dir, assignments, TRAIN, np.zeros(dim), np.ones(dim), batch_size, shuffle=True)
+        return torch.utils.data.DataLoader(stream, batch_size=None, **options)
+
+    features, labels, _ = load_cache(cache_dir)
+    if mode == 'memory':
+        features = np.array(features[np.arange(len(labels))], dtype=np.float32)
+    dataset = EmotionDataset(features, labels)
+    return make_loader(dataset, batch_size, shuffle=True, **options)
+
+
+def run_mode(mode, cache_dir, args, device):
+    """Train for args.epochs on one data path and return per-epoch summaries"""
+    torch.manual_seed(args.seed)
+    loader = make_train_loader(mode, cache_dir, args.batch_size, loader_options(args.num_workers, device))
+
+    model = EmotionModel(input_size=args.feature_dim, num_emotions=args.classes).to(device)
+    criterion = nn.CrossEntropyLoss()
+    optimizer = optim.Adam(model.parameters(), lr=1e-3, weight_decay=1e-5)
+
+    epochs = []
+    for epoch in range(args.epochs):
+        if mode == 'stream':
+            loader.dataset.set_epoch(epoch)
+        timer = StepTimer(device)
+        loss, acc, _ = train_epoch(model, loader, criterion, optimizer, device, timer)
+        summary = dict(timer.summary(), epoch=epoch, loss=loss, accuracy=acc)
+        epochs.append(summary)
+        print(f"  [{mode}] epoch {epoch + 1}: {timer.report()}")
+    return epochs
+
+
+def steady_state(epochs):
+    """Median of the post-warmup epochs (all epochs if only one ran)"""
+    measured = epochs[1:] or epochs
+    keys = ['samples_per_s', 'data_s', 'compute_s', 'data_fraction', 'wall_s']
+    return {key: float(np.median([e[key] for e in measured])) for key in keys}
+
+
+def environment(args):
+    return {
+        'python': platform.python_version(),
+        'torch': torch.__version__,
+        'numpy': np.__version__,
+        'platform': platform.platform(),
+        'processor': platform.processor(),
+        'cpu_count': os.cpu_count(),
+        'torch_threads': torch.get_num_threads(),
+        'args': vars(args),
+    }
+
+
+def main(args):
+    if args.threads:
+        torch.set_num_threads(args.threads)
+    device = torch.device('cuda' if torch.cuda.is_available() and not args.cpu else 'cpu')
+
+    with tempfile.TemporaryDirectory(dir=args.workdir) as tmp:
+        cache_dir = Path(tmp) / 'cache'
+        print(f"Generating {args.samples} synthetic samples ({args.feature_dim} features)...")
+        write_synthetic_cache(cache_dir, args.samples, args.feature_dim, args.classes, args.seed, args.shard_size)
+
+        results = {}
+        for mode in args.modes:
+            epochs = run_mode(mode, cache_dir, args, device)
+            results[mode] = {'epochs': epochs, 'steady_state': steady_state(epochs)}
+
+    print(f"\n{'mode':<8} {'samples/s':>10} {'data s':>8} {'compute s':>10} {'data %':>7} {'epoch s':>8}")
+    for mode, result in results.items():
+        s = result['steady_state']
+        print(f"{mode:<8} {s['samples_per_s']:>10.0f} {s['data_s']:>8.2f} {s['compute_s']:>10.2f} "
+              f"{s['data_fraction']:>6.0%} {s['wall_s']:>8.2f}")
+    print(f"\nPeak RSS: {peak_rss_mb():.0f} MB ({device}, {torch.get_num_threads()} threads)")
+
+    if args.json:
+        report = {'environment': environment(args), 'device': str(device), 'results': results}
+        with open(args.json, 'w') as f:
+            json.dump(report, f, indent=2)
+        print(f"✓ Wrote {args.json}")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark training throughput on synthetic data')
+    parser.add_argument('--samples', type=int, default=50000, help='Synthetic samples')
+    parser.add_argument('--feature-dim', type=int, default=1536, help='Features per sample')
+    parser.add_argument('--classes', type=int, default=7, help='Number of classes')
+    parser.add_argument('--epochs', type=int, default=3, help='Epochs per mode (first is warmup)')
+    parser.add_argument('--batch-size', type=int, default=64, help='Batch size')
+    parser.add_argument('--modes', nargs='+', default=MODES, choices=MODES, help='Data paths to benchmark')
+    parser.add_argument('--num-workers', type=int, default=0, help='DataLoader worker processes')
+    parser.add_argument('--threads', type=int, default=0, help='torch intra-op threads (0 = default)')
+    parser.add_argument('--shard-size', type=int, default=50000, help='Samples per synthetic shard')
+    parser.add_argument('--seed', type=int, default=0, help='Seed for data and model init')
+    parser.add_argument('--cpu', action='store_true', help='Force CPU even if CUDA is available')
+    parser.add_argument('--workdir', type=str, default=None, help='Directory for the temporary cache')
+    parser.add_argument('--json', type=str, default=None, help='Write results and environment to this file')
+
+    args = parser.parse_args()
+    main(args)
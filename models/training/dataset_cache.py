@@ -0,0 +1,434 @@
+"""
+Columnar, memory-mapped cache for landmark datasets
+
+Usage:
+    python dataset_cache.py --data ../datasets/landmarks --cache ../datasets/landmarks_cache
+
+Converts a directory of per-sample JSON files into float32 .npy shards:
+
+    manifest.json                  feature dim, shard list, source files per shard
+    shard-00000.features.npy       float32 [n, feature_dim]
+    shard-00000.labels.npy         int64 [n]
+
+Rebuilding is incremental: only JSON files not yet listed in the manifest are
+converted, into new shards. Shards are opened with np.load(mmap_mode='r') so
+training reads them without copying the dataset into memory.
+
+JSON parsing is spread over a process pool (orjson is used when installed) and
+streamed into preallocated float32 arrays; malformed samples are logged and
+skipped rather than aborting the run.
+"""
+
+import argparse
+import hashlib
+import json
+import os
+import time
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from pathlib import Path
+
+import numpy as np
+
+try:
+    import orjson
+    _loads = orjson.loads
+except ImportError:
+    _loads = json.loads
+
+
+EMOTION_NAMES = ['happy', 'sad', 'neutral', 'angry', 'surprised', 'fearful', 'disgusted']
+
+MANIFEST = 'manifest.json'
+CACHE_VERSION = 1
+
+# Files per task sent to an ingest worker
+INGEST_CHUNK = 256
+# Malformed samples printed individually before only counting them
+MAX_LOGGED_ERRORS = 20
+
+# Split assignments produced by hash_split
+TRAIN, VAL, TEST = 0, 1, 2
+
+
+def read_manifest(cache_dir):
+    """Load the cache manifest, or an empty one if the cache doesn't exist yet"""
+    path = Path(cache_dir) / MANIFEST
+    if not path.exists():
+        return {'version': CACHE_VERSION, 'feature_dim': None, 'shards': []}
+    with open(path, 'r') as f:
+        return json.load(f)
+
+
+def write_manifest(cache_dir, manifest):
+    """Atomically replace the manifest so readers never see a partial file"""
+    path = Path(cache_dir) / MANIFEST
+    tmp = path.with_suffix('.tmp')
+    with open(tmp, 'w') as f:
+        json.dump(manifest, f)
+    tmp.replace(path)
+
+
+def parse_label(label):
+    """Labels may be class indices or emotion names"""
+    if isinstance(label, str):
+        return EMOTION_NAMES.index(label)
+    return int(label)
+
+
+def parse_files(paths, feature_dim):
+    """
+    Worker task: parse a chunk of JSON samples into a float32 block
+
+    Returns:
+        (features [n, feature_dim], labels [n], valid [n], errors, sequences)
+        where errors lists (path, message) for every sample that could not be
+        used and sequences holds each sample's optional (sequence_id, frame)
+    """
+    features = np.zeros((len(paths), feature_dim), dtype=np.float32)
+    labels = np.full(len(paths), -1, dtype=np.int64)
+    valid = np.zeros(len(paths), dtype=bool)
+    errors = []
+    sequences = [(None, 0)] * len(paths)
+
+    for i, path in enumerate(paths):
+        try:
+            with open(path, 'rb') as f:
+                data = _loads(f.read())
+            row = data['features']
+            if len(row) != feature_dim:
+                raise ValueError(f"expected {feature_dim} features, got {len(row)}")
+            features[i] = row
+            labels[i] = parse_label(data['label'])
+            if 'sequence_id' in data:
+                sequences[i] = (str(data['sequence_id']), int(data.get('frame', 0)))
+            valid[i] = True
+        except (OSError, ValueError, KeyError, TypeError) as e:
+            errors.append((str(path), f"{type(e).__name__}: {e}"))
+
+    return features, labels, valid, errors, sequences
+
+
+def infer_feature_dim(files, sample=100):
+    """Most common feature dimension among the first readable samples"""
+    dims = []
+    for path in files:
+        try:
+            with open(path, 'rb') as f:
+                dims.append(len(_loads(f.read())['features']))
+        except (OSError, ValueError, KeyError, TypeError):
+            continue
+        if len(dims) >= sample:
+            break
+    if not dims:
+        raise ValueError("No readable samples to infer the feature dimension from")
+    return Counter(dims).most_common(1)[0][0]
+
+
+def ingest(files, out, workers=None, chunk_size=INGEST_CHUNK):
+    """
+    Parse JSON samples in parallel into a preallocated array
+
+    Args:
+        files: Sample paths; row i of `out` receives files[i]
+        out: float32 array or memmap of shape [len(files), feature_dim]
+        workers: Process count (default: all cores, 1 parses inline)
+
+    Returns:
+        (labels, valid, sequences): rows with valid=False were malformed and
+        left zeroed; sequences[i] is the (sequence_id, frame) of files[i], with
+        sequence_id None for samples that are not part of a sequence
+    """
+    workers = workers or os.cpu_count() or 1
+    paths = [str(p) for p in files]
+    labels = np.full(len(paths), -1, dtype=np.int64)
+    valid = np.zeros(len(paths), dtype=bool)
+    sequences = [(None, 0)] * len(paths)
+    offsets = range(0, len(paths), chunk_size)
+    feature_dim = out.shape[1]
+
+    done = 0
+    errors = 0
+    start = last_report = time.perf_counter()
+
+    def store(offset, result):
+        nonlocal done, errors, last_report
+        block, block_labels, block_valid, block_errors, block_sequences = result
+        end = offset + len(block)
+        out[offset:end] = block
+        labels[offset:end] = block_labels
+        valid[offset:end] = block_valid
+        sequences[offset:end] = block_sequences
+
+        for path, message in block_errors:
+            if errors < MAX_LOGGED_ERRORS:
+                print(f"⚠ Skipping malformed sample {path}: {message}")
+            errors += 1
+
+        done += len(block)
+        now = time.perf_counter()
+        if now - last_report >= 2.0 or done == len(paths):
+            last_report = now
+            print(f"  Parsed {done}/{len(paths)} files ({done / (now - start):.0f} files/s)")
+
+    if workers <= 1 or len(paths) <= chunk_size:
+        for offset in offsets:
+            store(offset, parse_files(paths[offset:offset + chunk_size], feature_dim))
+    else:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            futures = {
+                pool.submit(parse_files, paths[offset:offset + chunk_size], feature_dim): offset
+                for offset in offsets
+            }
+            for future in as_completed(futures):
+                store(futures[future], future.result())
+
+    if errors:
+        print(f"⚠ Skipped {errors} malformed samples out of {len(paths)}")
+    return labels, valid, sequences
+
+
+def compact_rows(array, valid, chunk_size=8192):
+    """
+    Move valid rows to the front in place (order preserved)
+
+    Returns the number of valid rows; safe for memmaps since rows are copied
+    forward in chunks.
+    """
+    keep = np.flatnonzero(valid)
+    for start in range(0, len(keep), chunk_size):
+        rows = keep[start:start + chunk_size]
+        array[start:start + len(rows)] = array[rows]
+    return len(keep)
+
+
+def write_shard(cache_dir, name, files, feature_dim, workers=None):
+    """
+    Parse JSON samples straight into a float32 memmap shard
+
+    Returns:
+        (count, kept_files): malformed samples are left out of the shard
+    """
+    cache_dir = Path(cache_dir)
+    path = cache_dir / f"{name}.features.npy"
+    features = np.lib.format.open_memmap(path, mode='w+', dtype=np.float32, shape=(len(files), feature_dim))
+    labels, valid, _ = ingest(files, features, workers)
+
+    count = len(files)
+    if not valid.all():
+        # Rewrite the shard with only the valid rows
+        count = compact_rows(features, valid)
+        tmp = cache_dir / f"{name}.features.tmp.npy"
+        compacted = np.lib.format.open_memmap(tmp, mode='w+', dtype=np.float32, shape=(count, feature_dim))
+        for start in range(0, count, 8192):
+            compacted[start:start + 8192] = features[start:min(start + 8192, count)]
+        compacted.flush()
+        del compacted
+        tmp.replace(path)
+        labels = labels[valid]
+        files = [f for f, ok in zip(files, valid) if ok]
+    else:
+        features.flush()
+    del features
+
+    np.save(cache_dir / f"{name}.labels.npy", labels)
+    return count, files
+
+
+def build_cache(data_path, cache_dir, shard_size=50000, workers=None):
+    """
+    Convert JSON samples not yet in the cache into new shards
+
+    Malformed samples are skipped and not recorded, so they are retried (and
+    reported again) on the next build.
+
+    Returns:
+        Number of newly converted samples
+    """
+    data_path = Path(data_path)
+    cache_dir = Path(cache_dir)
+    cache_dir.mkdir(parents=True, exist_ok=True)
+
+    manifest = read_manifest(cache_dir)
+    known = {name for shard in manifest['shards'] for name in shard['files']}
+    new_files = sorted(p for p in data_path.glob('*.json') if p.name not in known)
+    if not new_files:
+        return 0
+
+    if manifest['feature_dim'] is None:
+        manifest['feature_dim'] = infer_feature_dim(new_files)
+
+    added = 0
+    start = time.perf_counter()
+    for offset in range(0, len(new_files), shard_size):
+        chunk = new_files[offset:offset + shard_size]
+        name = f"shard-{len(manifest['shards']):05d}"
+        count, kept = write_shard(cache_dir, name, chunk, manifest['feature_dim'], workers)
+        if count == 0:
+            continue
+        manifest['shards'].append({'name': name, 'count': count, 'files': [p.name for p in kept]})
+        # Commit each shard so an interrupted build resumes where it stopped
+        write_manifest(cache_dir, manifest)
+        added += count
+
+    elapsed = time.perf_counter() - start
+    print(f"Cached {added} new samples in {elapsed:.1f}s ({len(new_files) / elapsed:.0f} files/s)")
+    return added
+
+
+class RunningStats:
+    """
+    Streaming per-feature mean/std (Welford, merged chunk by chunk with Chan's update)
+
+    Matches np.mean / np.std (population) without holding the data in memory.
+    """
+
+    def __init__(self, dim):
+        self.count = 0
+        self.mean = np.zeros(dim, dtype=np.float64)
+        self.m2 = np.zeros(dim, dtype=np.float64)
+
+    def update(self, chunk):
+        chunk = np.asarray(chunk, dtype=np.float64)
+        n = chunk.shape[0]
+        if n == 0:
+            return
+        chunk_mean = chunk.mean(axis=0)
+        chunk_m2 = ((chunk - chunk_mean) ** 2).sum(axis=0)
+
+        total = self.count + n
+        delta = chunk_mean - self.mean
+        self.mean += delta * (n / total)
+        self.m2 += chunk_m2 + delta ** 2 * (self.count * n / total)
+        self.count = total
+
+    def merge(self, other):
+        """Combine with stats accumulated elsewhere (e.g. another worker)"""
+        if other.count == 0:
+            return
+        total = self.count + other.count
+        delta = other.mean - self.mean
+        self.mean += delta * (other.count / total)
+        self.m2 += other.m2 + delta ** 2 * (self.count * other.count / total)
+        self.count = total
+
+    @property
+    def std(self):
+        return np.sqrt(self.m2 / max(self.count, 1))
+
+
+def feature_stats(features, indices, chunk_size=8192):
+    """Mean/std over the given rows, read in chunks so memmaps stay on disk"""
+    stats = RunningStats(features.shape[1])
+    indices = np.sort(np.asarray(indices))
+    for start in range(0, len(indices), chunk_size):
+        stats.update(features[indices[start:start + chunk_size]])
+    return stats.mean.astype(np.float32), stats.std.astype(np.float32)
+
+
+class ShardedArray:
+    """Read-only 2D array view over several memory-mapped shards"""
+
+    def __init__(self, shards):
+        self.shards = shards
+        self.offsets = np.cumsum([0] + [len(s) for s in shards])
+        self.shape = (int(self.offsets[-1]), shards[0].shape[1] if shards else 0)
+        self.dtype = np.float32
+
+    def __len__(self):
+        return self.shape[0]
+
+    def __getitem__(self, index):
+        """Gather rows by integer index or index array"""
+        if np.isscalar(index):
+            shard = int(np.searchsorted(self.offsets, index, side='right')) - 1
+            return self.shards[shard][index - self.offsets[shard]]
+
+        index = np.asarray(index)
+        out = np.empty((len(index), self.shape[1]), dtype=self.dtype)
+        shard_ids = np.searchsorted(self.offsets, index, side='right') - 1
+        for shard in np.unique(shard_ids):
+            mask = shard_ids == shard
+            out[mask] = self.shards[shard][index[mask] - self.offsets[shard]]
+        return out
+
+
+def open_shards(cache_dir):
+    """
+    Open every shard zero-copy
+
+    Returns:
+        List of {'features': memmap, 'labels': int64 array, 'ids': sample ids}
+    """
+    cache_dir = Path(cache_dir)
+    manifest = read_manifest(cache_dir)
+    if not manifest['shards']:
+        raise FileNotFoundError(f"No cached shards in {cache_dir}")
+
+    return [
+        {
+            'features': np.load(cache_dir / f"{s['name']}.features.npy", mmap_mode='r'),
+            'labels': np.load(cache_dir / f"{s['name']}.labels.npy"),
+            'ids': [Path(name).stem for name in s['files']],
+        }
+        for s in manifest['shards']
+    ]
+
+
+def load_cache(cache_dir):
+    """
+    Open the cache zero-copy
+
+    Returns:
+        (features, labels, sample_ids): features is a memmap (single shard) or
+        ShardedArray, labels an int64 array and sample_ids the source file stems
+    """
+    shards = open_shards(cache_dir)
+    labels = np.concatenate([s['labels'] for s in shards])
+    sample_ids = [sample_id for s in shards for sample_id in s['ids']]
+
+    features = shards[0]['features'] if len(shards) == 1 else ShardedArray([s['features'] for s in shards])
+    return features, labels, sample_ids
+
+
+def hash_split(sample_ids, val_fraction=0.15, test_fraction=0.15, salt=''):
+    """
+    Deterministic TRAIN/VAL/TEST assignment from a hash of each sample id
+
+    Unlike a shuffled split, a sample keeps its assignment as the corpus
+    grows, and nothing but the ids has to be in memory.
+    """
+    assignment = np.full(len(sample_ids), TRAIN, dtype=np.uint8)
+    for i, sample_id in enumerate(sample_ids):
+        digest = hashlib.blake2b(f"{salt}{sample_id}".encode(), digest_size=8).digest()
+        u = int.from_bytes(digest, 'little') / 2 ** 64
+        if u < test_fraction:
+            assignment[i] = TEST
+        elif u < test_fraction + val_fraction:
+            assignment[i] = VAL
+    return assignment
+
+
+def stream_stats(shards, assignments, split=TRAIN, chunk_rows=65536):
+    """Mean/std of one split in a single sequential pass over the shards"""
+    stats = RunningStats(shards[0]['features'].shape[1])
+    for shard, assignment in zip(shards, assignments):
+        features = shard['features']
+        for start in range(0, len(assignment), chunk_rows):
+            mask = assignment[start:start + chunk_rows] == split
+            if mask.any():
+                stats.update(features[start:start + chunk_rows][mask])
+    return stats.mean.astype(np.float32), stats.std.astype(np.float32)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Build or update the memory-mapped dataset cache')
+    parser.add_argument('--data', type=str, required=True, help='Directory of JSON samples')
+    parser.add_argument('--cache', type=str, required=True, help='Cache directory')
+    parser.add_argument('--shard-size', type=int, default=50000, help='Samples per shard')
+    parser.add_argument('--ingest-workers', type=int, default=None, help='JSON parsing processes (default: all cores)')
+
+    args = parser.parse_args()
+    added = build_cache(args.data, args.cache, args.shard_size, args.ingest_workers)
+    features, labels, _ = load_cache(args.cache)
+    print(f"Cache: {len(labels)} samples x {features.shape[1]} features ({added} added)")
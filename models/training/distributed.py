@@ -0,0 +1,83 @@
+"""
+Multi-process CPU data-parallel training helpers (torch.distributed, gloo)
+
+launch() spawns one training process per worker on this host. Each process
+joins a gloo process group, caps its intra-op threads so the workers share
+the cores instead of oversubscribing them, and runs fn(rank, world_size, *args).
+"""
+
+import contextlib
+import os
+import socket
+
+import torch
+import torch.distributed as dist
+import torch.multiprocessing as mp
+
+
+def free_port():
+    """Unused local TCP port for the rendezvous"""
+    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def default_threads(world_size):
+    """Split the host's cores evenly across workers"""
+    return max(1, (os.cpu_count() or 1) // world_size)
+
+
+def _worker(rank, world_size, threads, fn, args):
+    torch.set_num_threads(threads)
+    dist.init_process_group('gloo', rank=rank, world_size=world_size)
+    try:
+        fn(rank, world_size, *args)
+    finally:
+        dist.destroy_process_group()
+
+
+def launch(fn, world_size, args=(), threads=None):
+    """Run fn(rank, world_size, *args) in `world_size` processes"""
+    os.environ.setdefault('MASTER_ADDR', '127.0.0.1')
+    os.environ.setdefault('MASTER_PORT', str(free_port()))
+    threads = threads or default_threads(world_size)
+    mp.spawn(_worker, args=(world_size, threads, fn, args), nprocs=world_size, join=True)
+
+
+def is_distributed():
+    return dist.is_available() and dist.is_initialized()
+
+
+def barrier():
+    if is_distributed():
+        dist.barrier()
+
+
+def all_reduce_metrics(loss, accuracy, count=1):
+    """
+    Count-weighted mean of (loss, accuracy) across ranks
+
+    Ranks all-reduce (loss sum, correct sum, count) and divide afterwards, so
+    a rank with an empty shard (count 0) still joins the collective and adds
+    nothing. Every rank gets the same values back, so decisions made on them
+    (LR schedule, checkpointing, early stopping) stay in lockstep.
+    """
+    if not is_distributed():
+        return loss, accuracy
+    totals = torch.tensor([loss * count, accuracy * count, count], dtype=torch.float64)
+    dist.all_reduce(totals)
+    if not totals[2]:
+        return 0.0, 0.0
+    return (totals[0] / totals[2]).item(), (totals[1] / totals[2]).item()
+
+
+def join(model):
+    """Tolerate ranks running out of batches at different steps (uneven shards)"""
+    if isinstance(model, torch.nn.parallel.DistributedDataParallel):
+        return model.join()
+    return contextlib.nullcontext()
+
+
+def unwrap(model):
+    """The underlying module of a DistributedDataParallel wrapper"""
+    return model.module if isinstance(model, torch.nn.parallel.DistributedDataParallel) else model
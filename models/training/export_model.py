@@ -0,0 +1,198 @@
+"""
+Export a train_emotion.py checkpoint to the serving formats
+
+Usage:
+    python export_model.py --checkpoint ../emotion_model.pth --output-dir .. --formats torchscript onnx
+
+Writes:
+    emotion_model.ts.pt   traced + frozen TorchScript (MODEL_TYPE=torchscript)
+    emotion_model.onnx    ONNX graph for ONNX Runtime (MODEL_TYPE=onnx)
+
+Both artifacts embed a JSON metadata blob with the input size, emotion
+classes and normalization statistics. After exporting, a parity check runs
+every artifact against the eager model and reports per-backend latency.
+"""
+
+import argparse
+import json
+import sys
+import time
+from pathlib import Path
+
+import numpy as np
+import torch
+
+from train_emotion import EmotionModel, EMOTION_NAMES, hidden_sizes_from_state_dict
+
+
+METADATA_KEY = "metadata.json"
+
+
+def load_checkpoint_model(checkpoint_path):
+    """Rebuild the eager EmotionModel and its metadata from a checkpoint"""
+    checkpoint = torch.load(checkpoint_path, map_location='cpu', weights_only=False)
+    if checkpoint.get('config', {}).get('architecture') == 'temporal':
+        raise ValueError("Temporal checkpoints keep per-session state; serve them directly with MODEL_TYPE=pytorch")
+    state_dict = checkpoint['model_state_dict']
+
+    mean = np.asarray(checkpoint['mean'], dtype=np.float32)
+    std = np.asarray(checkpoint['std'], dtype=np.float32)
+    input_size = mean.shape[0]
+
+    # Last Linear layer determines the number of classes
+    linear_weights = [k for k, v in state_dict.items() if k.endswith('.weight') and v.dim() == 2]
+    num_emotions = state_dict[linear_weights[-1]].shape[0]
+
+    model = EmotionModel(
+        input_size=input_size, num_emotions=num_emotions, hidden_sizes=hidden_sizes_from_state_dict(state_dict)
+    )
+    model.load_state_dict(state_dict)
+    model.eval()
+
+    metadata = {
+        'input_size': int(input_size),
+        'num_emotions': int(num_emotions),
+        'emotion_classes': EMOTION_NAMES[:num_emotions],
+        'mean': mean.tolist(),
+        'std': std.tolist(),
+    }
+    split = checkpoint.get('config', {}).get('split')
+    if split is not None:
+        metadata['split'] = split
+    return model, metadata
+
+
+def export_torchscript(model, metadata, output_path):
+    """Trace, freeze and save with embedded metadata"""
+    example = torch.randn(2, metadata['input_size'])
+    with torch.no_grad():
+        traced = torch.jit.trace(model, example)
+        frozen = torch.jit.freeze(traced)
+    torch.jit.save(frozen, str(output_path), _extra_files={METADATA_KEY: json.dumps(metadata)})
+    return output_path
+
+
+def export_onnx(model, metadata, output_path, opset=17):
+    """Export with a dynamic batch dimension and embedded metadata"""
+    import onnx
+
+    example = torch.randn(2, metadata['input_size'])
+    torch.onnx.export(
+        model, example, str(output_path),
+        input_names=['features'],
+        output_names=['emotion_logits'],
+        dynamic_axes={'features': {0: 'batch'}, 'emotion_logits': {0: 'batch'}},
+        opset_version=opset,
+    )
+
+    graph = onnx.load(str(output_path))
+    entry = graph.metadata_props.add()
+    entry.key = METADATA_KEY
+    entry.value = json.dumps(metadata)
+    onnx.save(graph, str(output_path))
+    return output_path
+
+
+def load_runner(fmt, path, threads):
+    """Return a callable running a float32 numpy batch through an exported artifact"""
+    if fmt == 'torchscript':
+        module = torch.jit.load(str(path))
+
+        def run(batch):
+            with torch.inference_mode():
+                return module(torch.from_numpy(batch)).numpy()
+        return run
+
+    if fmt == 'onnx':
+        import onnxruntime as ort
+
+        options = ort.SessionOptions()
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        options.inter_op_num_threads = 1
+        options.intra_op_num_threads = threads
+        session = ort.InferenceSession(str(path), options, providers=['CPUExecutionProvider'])
+        input_name = session.get_inputs()[0].name
+        return lambda batch: session.run(None, {input_name: batch})[0]
+
+    raise ValueError(f"Unknown format: {fmt}")
+
+
+def time_runner(run, batch, iterations):
+    """Median latency in milliseconds"""
+    run(batch)
+    timings = []
+    for _ in range(iterations):
+        start = time.perf_counter()
+        run(batch)
+        timings.append((time.perf_counter() - start) * 1000)
+    return float(np.median(timings))
+
+
+def parity_check(model, metadata, artifacts, samples=256, threads=1, iterations=200, atol=1e-4):
+    """
+    Compare every artifact with the eager model on the same inputs
+
+    Returns True if all artifacts agree within `atol` on logits.
+    """
+    rng = np.random.default_rng(0)
+    batch = rng.standard_normal((samples, metadata['input_size'])).astype(np.float32)
+
+    def eager(x):
+        with torch.inference_mode():
+            return model(torch.from_numpy(x)).numpy()
+
+    reference = eager(batch)
+    runners = {'pytorch': eager}
+    runners.update({fmt: load_runner(fmt, path, threads) for fmt, path in artifacts.items()})
+
+    ok = True
+    print(f"\n{'backend':<12} {'max |diff|':>12} {'argmax agree':>13} {'p50 b=1 ms':>11} {'p50 b=16 ms':>12}")
+    for name, run in runners.items():
+        output = run(batch)
+        diff = float(np.abs(output - reference).max())
+        agree = float((output.argmax(1) == reference.argmax(1)).mean() * 100)
+        lat1 = time_runner(run, batch[:1], iterations)
+        lat16 = time_runner(run, batch[:16], iterations)
+        print(f"{name:<12} {diff:>12.2e} {agree:>12.2f}% {lat1:>11.3f} {lat16:>12.3f}")
+        ok = ok and diff <= atol
+    return ok
+
+
+def main(args):
+    torch.set_num_threads(args.threads)
+    model, metadata = load_checkpoint_model(args.checkpoint)
+    output_dir = Path(args.output_dir)
+    output_dir.mkdir(parents=True, exist_ok=True)
+
+    artifacts = {}
+    if 'torchscript' in args.formats:
+        artifacts['torchscript'] = export_torchscript(model, metadata, output_dir / f"{args.name}.ts.pt")
+    if 'onnx' in args.formats:
+        artifacts['onnx'] = export_onnx(model, metadata, output_dir / f"{args.name}.onnx")
+
+    for fmt, path in artifacts.items():
+        print(f"✓ Exported {fmt}: {path}")
+
+    if args.skip_parity:
+        return
+
+    if not parity_check(model, metadata, artifacts, args.parity_samples, args.threads, atol=args.atol):
+        print(f"✗ Parity check failed (atol={args.atol})")
+        sys.exit(1)
+    print("\n✓ Parity check passed")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Export emotion model for serving')
+    parser.add_argument('--checkpoint', type=str, required=True, help='train_emotion.py checkpoint')
+    parser.add_argument('--output-dir', type=str, default='..', help='Directory for exported artifacts')
+    parser.add_argument('--name', type=str, default='emotion_model', help='Artifact base name')
+    parser.add_argument('--formats', nargs='+', default=['torchscript', 'onnx'],
+                        choices=['torchscript', 'onnx'], help='Formats to export')
+    parser.add_argument('--threads', type=int, default=1, help='Intra-op threads for parity timing')
+    parser.add_argument('--parity-samples', type=int, default=256, help='Random inputs for parity check')
+    parser.add_argument('--atol', type=float, default=1e-4, help='Max allowed logit difference')
+    parser.add_argument('--skip-parity', action='store_true', help='Skip the parity check')
+
+    args = parser.parse_args()
+    main(args)
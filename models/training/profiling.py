@@ -0,0 +1,102 @@
+"""
+Training throughput instrumentation
+
+StepTimer splits an epoch into data-loading time (waiting on the loader) and
+compute time (transfer, forward, backward, optimizer step). trace_profiler
+wraps torch.profiler to write a Chrome trace of a few training steps.
+"""
+
+import contextlib
+import resource
+import sys
+import time
+
+import torch
+
+
+def peak_rss_mb():
+    """Peak resident set size of this process in MB"""
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in bytes on macOS, kilobytes on Linux
+    return peak / (1024 * 1024) if sys.platform == 'darwin' else peak / 1024
+
+
+class StepTimer:
+    """Accumulates data vs compute time and throughput for one epoch"""
+
+    def __init__(self, device, torch_profiler=None):
+        self.device = device
+        self.torch_profiler = torch_profiler
+        self.samples = 0
+        self.steps = 0
+        self.data_s = 0.0
+        self.compute_s = 0.0
+        self.wall_s = 0.0
+
+    def start(self):
+        self._start = self._mark = time.perf_counter()
+
+    def loaded(self):
+        """Batch received from the loader"""
+        now = time.perf_counter()
+        self.data_s += now - self._mark
+        self._mark = now
+
+    def done(self, batch_size):
+        """Optimizer step finished"""
+        if self.device.type == 'cuda':
+            # Only when profiling: otherwise kernels are left to run asynchronously
+            torch.cuda.synchronize(self.device)
+        now = time.perf_counter()
+        self.compute_s += now - self._mark
+        self._mark = now
+        self.samples += batch_size
+        self.steps += 1
+        if self.torch_profiler is not None:
+            self.torch_profiler.step()
+
+    def stop(self):
+        self.wall_s = time.perf_counter() - self._start
+
+    def summary(self):
+        busy = self.data_s + self.compute_s
+        return {
+            'samples': self.samples,
+            'steps': self.steps,
+            'samples_per_s': self.samples / self.wall_s if self.wall_s else 0.0,
+            'data_s': self.data_s,
+            'compute_s': self.compute_s,
+            'data_fraction': self.data_s / busy if busy else 0.0,
+            'wall_s': self.wall_s,
+            'peak_rss_mb': peak_rss_mb(),
+        }
+
+    def report(self):
+        s = self.summary()
+        return (f"{s['samples_per_s']:.0f} samples/s | data {s['data_s']:.2f}s ({s['data_fraction']:.0%}) | "
+                f"compute {s['compute_s']:.2f}s | train {s['wall_s']:.2f}s | peak RSS {s['peak_rss_mb']:.0f} MB")
+
+
+def trace_profiler(path, device, steps=20):
+    """
+    torch.profiler over `steps` training steps (after one wait and one warmup
+    step), exported as a Chrome trace to `path`. Returns a null context if no
+    path is given.
+    """
+    if not path:
+        return contextlib.nullcontext()
+
+    activities = [torch.profiler.ProfilerActivity.CPU]
+    if device.type == 'cuda':
+        activities.append(torch.profiler.ProfilerActivity.CUDA)
+
+    def export(prof):
+        prof.export_chrome_trace(str(path))
+        print(f"✓ Wrote profiler trace to {path}")
+
+    return torch.profiler.profile(
+        activities=activities,
+        schedule=torch.profiler.schedule(wait=1, warmup=1, active=steps, repeat=1),
+        on_trace_ready=export,
+        record_shapes=True,
+    )
@@ -0,0 +1,187 @@
+"""
+Post-training quantization for the emotion model
+
+Usage:
+    python quantize_emotion.py --checkpoint ../emotion_model.pth --data ../datasets/landmarks \\
+        --dtype int8 --output ../emotion_model.int8.pt
+
+Folds every BatchNorm1d into the preceding Linear layer, applies dynamic
+quantization to the Linear layers (int8 weights with dynamically quantized
+activations, or float16 weights) and saves a TorchScript artifact that the
+backend serves with MODEL_TYPE=torchscript. With --data (and --cache for
+models trained from the cache), the accuracy delta is reported on the same
+held-out test split the checkpoint was trained with. Checkpoints that do not
+record their split get no accuracy report, since a rebuilt split could
+include training rows.
+"""
+
+import argparse
+import io
+import json
+import time
+
+import numpy as np
+import torch
+import torch.nn as nn
+from torch.nn.utils.fusion import fuse_linear_bn_eval
+from torch.utils.data import DataLoader
+
+from dataset_cache import TEST, hash_split, load_cache
+from train_emotion import EmotionDataset, load_data, split_indices, validate
+from export_model import METADATA_KEY, load_checkpoint_model
+
+
+QUANT_DTYPES = {
+    'int8': torch.qint8,
+    'float16': torch.float16,
+}
+
+
+def fold_batchnorm(model):
+    """
+    Return an inference-only copy of the model with BatchNorm folded into Linear
+
+    Dropout is dropped as well since it is the identity at inference.
+    """
+    layers = []
+    modules = list(model.fc)
+    i = 0
+    while i < len(modules):
+        module = modules[i]
+        if isinstance(module, nn.Linear) and i + 1 < len(modules) and isinstance(modules[i + 1], nn.BatchNorm1d):
+            layers.append(fuse_linear_bn_eval(module, modules[i + 1]))
+            i += 2
+            continue
+        if not isinstance(module, nn.Dropout):
+            layers.append(module)
+        i += 1
+
+    folded = nn.Sequential(*layers)
+    folded.eval()
+    return folded
+
+
+def quantize(model, dtype='int8'):
+    """Fold BatchNorm, then dynamically quantize all Linear layers"""
+    folded = fold_batchnorm(model)
+    return torch.ao.quantization.quantize_dynamic(folded, {nn.Linear}, dtype=QUANT_DTYPES[dtype])
+
+
+def to_torchscript(model, input_size):
+    """Trace (and freeze when supported) for serving"""
+    example = torch.randn(2, input_size)
+    with torch.no_grad():
+        traced = torch.jit.trace(model, example)
+    try:
+        return torch.jit.freeze(traced)
+    except RuntimeError:
+        return traced
+
+
+def serialized_size(module):
+    """Size in bytes of a saved TorchScript module"""
+    buffer = io.BytesIO()
+    torch.jit.save(module, buffer)
+    return buffer.getbuffer().nbytes
+
+
+def latency_ms(module, input_size, batch_size=1, iterations=500):
+    """Median single-batch latency"""
+    batch = torch.randn(batch_size, input_size)
+    with torch.inference_mode():
+        module(batch)
+        timings = []
+        for _ in range(iterations):
+            start = time.perf_counter()
+            module(batch)
+            timings.append((time.perf_counter() - start) * 1000)
+    return float(np.median(timings))
+
+
+def test_set(metadata, data_path=None, cache_dir=None):
+    """
+    Rebuild the checkpoint's held-out test split, normalized
+
+    Raises ValueError when it cannot be rebuilt exactly.
+    """
+    split = metadata.get('split')
+    if split is None:
+        raise ValueError("checkpoint does not record how it was split (retrain with the current train_emotion.py)")
+
+    if split['mode'] == 'hash' and split.get('unit') == 'sample':
+        if not cache_dir:
+            raise ValueError("trained with a hash split over the cache; pass --cache")
+        features, labels, sample_ids = load_cache(cache_dir)
+        test_idx = np.flatnonzero(hash_split(sample_ids) == TEST)
+    elif split['mode'] == 'stratified':
+        if split['source'] == 'cache':
+            if not cache_dir:
+                raise ValueError("trained from the cache (its row order defines the split); pass --cache")
+            features, labels, _ = load_cache(cache_dir)
+        else:
+            if not data_path:
+                raise ValueError("trained from JSON files; pass --data")
+            features, labels = load_data(data_path)
+        _, _, test_idx = split_indices(labels, split['seed'])
+    else:
+        raise ValueError(f"cannot rebuild a {split['mode']} split over {split.get('unit')}s")
+
+    mean = np.asarray(metadata['mean'], dtype=np.float32)
+    std = np.asarray(metadata['std'], dtype=np.float32)
+    X_test = (np.asarray(features[test_idx], dtype=np.float32) - mean) / (std + 1e-8)
+    return X_test, np.asarray(labels)[test_idx]
+
+
+def test_accuracy(model, X_test, y_test, batch_size=256):
+    """Accuracy on the normalized test set from test_set()"""
+    loader = DataLoader(EmotionDataset(X_test, y_test), batch_size=batch_size)
+    _, accuracy, _, _ = validate(model, loader, nn.CrossEntropyLoss(), torch.device('cpu'))
+    return accuracy
+
+
+def main(args):
+    torch.set_num_threads(args.threads)
+    model, metadata = load_checkpoint_model(args.checkpoint)
+    input_size = metadata['input_size']
+
+    quantized = quantize(model, args.dtype)
+    metadata = dict(metadata, quantization=args.dtype, batchnorm_folded=True)
+
+    float_script = to_torchscript(model, input_size)
+    quant_script = to_torchscript(quantized, input_size)
+    torch.jit.save(quant_script, args.output, _extra_files={METADATA_KEY: json.dumps(metadata)})
+    print(f"✓ Saved {args.dtype} model to {args.output}")
+
+    float_size = serialized_size(float_script)
+    quant_size = serialized_size(quant_script)
+    print(f"\nSize:    float32 {float_size / 1e6:.2f} MB -> {args.dtype} {quant_size / 1e6:.2f} MB "
+          f"({quant_size / float_size:.0%})")
+
+    float_lat = latency_ms(float_script, input_size)
+    quant_lat = latency_ms(quant_script, input_size)
+    print(f"Latency: float32 {float_lat:.3f} ms -> {args.dtype} {quant_lat:.3f} ms (batch 1, median)")
+
+    if args.data or args.cache:
+        try:
+            X_test, y_test = test_set(metadata, args.data, args.cache)
+        except ValueError as e:
+            print(f"⚠ Test accuracy not reported: {e}")
+            return
+        float_acc = test_accuracy(model, X_test, y_test)
+        quant_acc = test_accuracy(quantized, X_test, y_test)
+        print(f"Test accuracy: float32 {float_acc:.2f}% -> {args.dtype} {quant_acc:.2f}% "
+              f"(delta {quant_acc - float_acc:+.2f} pts)")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Quantize emotion model for CPU serving')
+    parser.add_argument('--checkpoint', type=str, required=True, help='train_emotion.py checkpoint')
+    parser.add_argument('--data', type=str, default=None, help='Dataset used for training (for accuracy delta)')
+    parser.add_argument('--cache', type=str, default=None,
+                        help='Dataset cache used for training, for checkpoints trained with --cache/--stream')
+    parser.add_argument('--dtype', type=str, default='int8', choices=list(QUANT_DTYPES), help='Weight dtype')
+    parser.add_argument('--threads', type=int, default=1, help='Intra-op threads for latency measurement')
+    parser.add_argument('--output', type=str, default='../emotion_model.int8.pt', help='Output TorchScript path')
+
+    args = parser.parse_args()
+    main(args)
@@ -0,0 +1,387 @@
+"""
+Hyperparameter sweep for the emotion model
+
+Usage:
+    python sweep_emotion.py --data ../datasets/landmarks --cache ../datasets/landmarks_cache \\
+        --lr 1e-3 3e-4 --batch-size 64 128 --dropout 0.2 0.3 --hidden-sizes 512,256,128 256,128 \\
+        --parallel 4 --epochs 30 --output ../emotion_model.pth
+
+The dataset is loaded, split and normalized once, then placed in shared
+memory; trials run concurrently in a process pool (each capped to
+--threads-per-trial intra-op threads) and read it without copying.
+
+Trials are pruned with a median stopping rule: after --prune-after epochs, a
+trial whose best val accuracy so far is below the median of earlier trials at
+the same epoch stops early. Results are appended to <out-dir>/results.jsonl
+keyed by a hash of the config and the dataset, so re-running a sweep skips
+configs that were already evaluated. A trial that crashes is recorded as
+failed and retried by the next run. The best completed trial is exported to
+--output as a regular train_emotion.py checkpoint, ready for the backend or
+export_model.py.
+"""
+
+import argparse
+import hashlib
+import itertools
+import json
+import multiprocessing
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from concurrent.futures.process import BrokenProcessPool
+from multiprocessing import shared_memory
+from pathlib import Path
+
+import numpy as np
+import torch
+import torch.nn as nn
+import torch.optim as optim
+
+from dataset_cache import build_cache, load_cache, feature_stats
+from distributed import default_threads
+from train_emotion import (
+    EmotionModel, EmotionDataset, load_data, split_indices, stratified_split_config, make_loader,
+    train_epoch, validate
+)
+
+
+RESULTS_FILE = 'results.jsonl'
+
+# Arrays attached in each pool worker by _init_worker
+_shared = {}
+
+
+def share_array(array_like, rows=None, mean=None, std=None, chunk_size=8192):
+    """
+    Copy (optionally a row subset of, normalized) data into shared memory
+
+    Returns:
+        (SharedMemory, descriptor) where the descriptor is what workers attach with
+    """
+    rows = np.arange(len(array_like)) if rows is None else np.asarray(rows)
+    shape = (len(rows),) + tuple(np.shape(array_like)[1:])
+    dtype = np.float32 if len(shape) > 1 else np.int64
+    shm = shared_memory.SharedMemory(create=True, size=max(1, int(np.prod(shape)) * np.dtype(dtype).itemsize))
+    out = np.ndarray(shape, dtype=dtype, buffer=shm.buf)
+
+    for start in range(0, len(rows), chunk_size):
+        block = np.asarray(array_like[np.sort(rows[start:start + chunk_size])], dtype=dtype)
+        if mean is not None:
+            block = (block - mean) / (std + 1e-8)
+        out[start:start + len(block)] = block
+    return shm, {'name': shm.name, 'shape': shape, 'dtype': np.dtype(dtype).str}
+
+
+def attach_array(descriptor):
+    """
+    Map a shared array created by share_array (no copy)
+
+    Pool workers are spawned and share the parent's resource tracker, so the
+    block stays registered once and is unlinked by the parent only.
+    """
+    shm = shared_memory.SharedMemory(name=descriptor['name'])
+    return shm, np.ndarray(descriptor['shape'], dtype=np.dtype(descriptor['dtype']), buffer=shm.buf)
+
+
+def _init_worker(descriptors, threads):
+    torch.set_num_threads(threads)
+    for name, descriptor in descriptors.items():
+        _shared[name] = attach_array(descriptor)
+
+
+def config_key(config, fingerprint):
+    """Stable id of a trial: config + dataset fingerprint"""
+    payload = json.dumps({'config': config, 'data': fingerprint}, sort_keys=True)
+    return hashlib.sha1(payload.encode()).hexdigest()[:12]
+
+
+def dataset_fingerprint(labels, feature_dim, split_seed):
+    """Identifies the data (and split) a result was measured on"""
+    digest = hashlib.sha1(np.ascontiguousarray(labels).tobytes())
+    digest.update(f"{len(labels)}:{feature_dim}:{split_seed}".encode())
+    return digest.hexdigest()[:12]
+
+
+def build_grid(args):
+    """Cartesian product of the searched values"""
+    grid = [
+        {
+            'lr': lr,
+            'batch_size': batch_size,
+            'dropout': dropout,
+            'hidden_sizes': hidden_sizes,
+            'epochs': args.epochs,
+            'patience': args.patience,
+        }
+        for lr, batch_size, dropout, hidden_sizes in itertools.product(
+            args.lr, args.batch_size, args.dropout, args.hidden_sizes
+        )
+    ]
+    if args.max_trials and len(grid) > args.max_trials:
+        rng = np.random.default_rng(args.seed)
+        grid = [grid[i] for i in sorted(rng.choice(len(grid), args.max_trials, replace=False))]
+    return grid
+
+
+def read_results(path):
+    """All recorded trials keyed by config hash"""
+    results = {}
+    if Path(path).exists():
+        with open(path, 'r') as f:
+            for line in f:
+                if line.strip():
+                    record = json.loads(line)
+                    results[record['key']] = record
+    return results
+
+
+def append_result(path, record):
+    with open(path, 'a') as f:
+        f.write(json.dumps(record) + '\n')
+
+
+def should_prune(best_so_far, epoch, reference_curves, prune_after, min_reference=2):
+    """Median stopping rule on best-so-far val accuracy"""
+    if epoch + 1 < prune_after:
+        return False
+    peers = [curve[epoch] for curve in reference_curves if len(curve) > epoch]
+    if len(peers) < min_reference:
+        return False
+    return best_so_far < float(np.median(peers))
+
+
+def run_trial(key, config, reference_curves, prune_after, checkpoint_dir, seed):
+    """
+    Train one config on the shared data (runs in a pool worker)
+
+    Returns the result record; completed trials also save their best weights
+    to <checkpoint_dir>/<key>.pth.
+    """
+    torch.manual_seed(seed)
+    start = time.perf_counter()
+    device = torch.device('cpu')
+
+    _, X_train = _shared['X_train']
+    _, y_train = _shared['y_train']
+    _, X_val = _shared['X_val']
+    _, y_val = _shared['y_val']
+
+    train_loader = make_loader(EmotionDataset(X_train, y_train), config['batch_size'], shuffle=True)
+    val_loader = make_loader(EmotionDataset(X_val, y_val), config['batch_size'])
+
+    num_emotions = int(max(y_train.max(), y_val.max())) + 1
+    model = EmotionModel(
+        input_size=X_train.shape[1], num_emotions=num_emotions,
+        dropout=config['dropout'], hidden_sizes=config['hidden_sizes']
+    )
+    criterion = nn.CrossEntropyLoss()
+    optimizer = optim.Adam(model.parameters(), lr=config['lr'], weight_decay=1e-5)
+    scheduler = optim.lr_scheduler.ReduceLROnPlateau(optimizer, mode='max', factor=0.5, patience=5)
+
+    best_val_acc = 0.0
+    best_epoch = -1
+    best_state = None
+    curve = []
+    status = 'complete'
+    patience_counter = 0
+
+    for epoch in range(config['epochs']):
+        train_epoch(model, train_loader, criterion, optimizer, device)
+        _, val_acc, _, _ = validate(model, val_loader, criterion, device)
+        scheduler.step(val_acc)
+
+        if val_acc > best_val_acc:
+            best_val_acc, best_epoch = val_acc, epoch
+            best_state = {k: v.detach().clone() for k, v in model.state_dict().items()}
+            patience_counter = 0
+        else:
+            patience_counter += 1
+        curve.append(best_val_acc)
+
+        if should_prune(best_val_acc, epoch, reference_curves, prune_after):
+            status = 'pruned'
+            break
+        if patience_counter >= config['patience']:
+            break
+
+    if status == 'complete' and best_state is not None:
+        torch.save({
+            'epoch': best_epoch,
+            'model_state_dict': best_state,
+            'val_acc': best_val_acc,
+            'config': config,
+        }, Path(checkpoint_dir) / f"{key}.pth")
+
+    return {
+        'key': key,
+        'config': config,
+        'status': status,
+        'best_val_acc': best_val_acc,
+        'best_epoch': best_epoch,
+        'epochs_run': len(curve),
+        'curve': curve,
+        'seconds': time.perf_counter() - start,
+    }
+
+
+def failed_record(key, config, error):
+    """Result record of a trial that raised or whose worker died"""
+    return {
+        'key': key,
+        'config': config,
+        'status': 'failed',
+        'error': repr(error),
+        'best_val_acc': 0.0,
+        'best_epoch': -1,
+        'epochs_run': 0,
+        'curve': [],
+        'seconds': 0.0,
+    }
+
+
+def export_best(results, checkpoint_dir, mean, std, split, output):
+    """
+    Copy the best completed trial into a servable checkpoint
+
+    Adds the normalization statistics, and the split to the config so
+    quantize_emotion.py can rebuild the test set the sweep held out.
+    """
+    completed = [r for r in results if r['status'] == 'complete']
+    if not completed:
+        print("⚠ No completed trials to export")
+        return None
+    best = max(completed, key=lambda r: r['best_val_acc'])
+    trial = torch.load(Path(checkpoint_dir) / f"{best['key']}.pth", weights_only=False)
+    trial.update(mean=mean, std=std, config=dict(trial['config'], split=split))
+    torch.save(trial, output)
+    print(f"✓ Exported best config {best['key']} (val_acc: {best['best_val_acc']:.2f}%) to {output}")
+    return best
+
+
+def print_table(results):
+    print(f"\n{'key':<13} {'status':<9} {'val acc':>8} {'epochs':>7} {'secs':>7}  "
+          f"{'lr':>8} {'batch':>6} {'dropout':>8}  hidden")
+    for r in sorted(results, key=lambda r: -r['best_val_acc']):
+        c = r['config']
+        print(f"{r['key']:<13} {r['status']:<9} {r['best_val_acc']:>7.2f}% {r['epochs_run']:>7} "
+              f"{r['seconds']:>7.1f}  {c['lr']:>8.1e} {c['batch_size']:>6} {c['dropout']:>8.2f}  "
+              f"{','.join(map(str, c['hidden_sizes']))}")
+
+
+def main(args):
+    out_dir = Path(args.out_dir)
+    checkpoint_dir = out_dir / 'trials'
+    checkpoint_dir.mkdir(parents=True, exist_ok=True)
+    results_path = out_dir / RESULTS_FILE
+
+    # Load and split once
+    print("Loading data...")
+    if args.cache:
+        build_cache(args.data, args.cache, workers=args.ingest_workers)
+        features, labels, _ = load_cache(args.cache)
+    else:
+        features, labels = load_data(args.data, args.ingest_workers)
+    train_idx, val_idx, _ = split_indices(labels, args.split_seed)
+    mean, std = feature_stats(features, train_idx)
+    fingerprint = dataset_fingerprint(labels, features.shape[1], args.split_seed)
+
+    grid = build_grid(args)
+    recorded = read_results(results_path)
+    keys = [config_key(config, fingerprint) for config in grid]
+    # Failed trials are retried
+    pending = [
+        (key, config) for key, config in zip(keys, grid)
+        if key not in recorded or recorded[key]['status'] == 'failed'
+    ]
+    print(f"{len(grid)} configs, {len(grid) - len(pending)} already in {results_path}, {len(pending)} to run")
+
+    # Normalized train/val in shared memory, read by every trial
+    blocks = {}
+    try:
+        blocks['X_train'] = share_array(features, np.sort(train_idx), mean, std)
+        blocks['y_train'] = share_array(labels, np.sort(train_idx))
+        blocks['X_val'] = share_array(features, np.sort(val_idx), mean, std)
+        blocks['y_val'] = share_array(labels, np.sort(val_idx))
+        descriptors = {name: descriptor for name, (_, descriptor) in blocks.items()}
+
+        threads = args.threads_per_trial or default_threads(args.parallel)
+        curves = [r['curve'] for r in recorded.values() if r['config'] in grid and r['status'] != 'failed']
+        context = multiprocessing.get_context('spawn')
+
+        queue = list(pending)
+        while queue:
+            # A worker killed mid-trial (e.g. by the OOM killer) breaks the pool; start a new one
+            with ProcessPoolExecutor(args.parallel, mp_context=context,
+                                     initializer=_init_worker, initargs=(descriptors, threads)) as pool:
+                running = {}
+                broken = False
+                while (queue and not broken) or running:
+                    # Keep the pool full; newer trials are pruned against everything finished so far
+                    while queue and not broken and len(running) < args.parallel:
+                        key, config = queue.pop(0)
+                        try:
+                            future = pool.submit(
+                                run_trial, key, config, list(curves), args.prune_after, checkpoint_dir, args.seed
+                            )
+                        except BrokenProcessPool:
+                            queue.insert(0, (key, config))
+                            broken = True
+                            break
+                        running[future] = (key, config)
+
+                    if not running:
+                        break
+                    done, _ = wait(running, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        key, config = running.pop(future)
+                        try:
+                            record = future.result()
+                        except Exception as e:
+                            # One crashing trial (OOM, NaN assertion) must not end the sweep
+                            broken = broken or isinstance(e, BrokenProcessPool)
+                            record = failed_record(key, config, e)
+                        else:
+                            curves.append(record['curve'])
+                        append_result(results_path, record)
+                        recorded[record['key']] = record
+                        print(f"  {record['key']} {record['status']:<8} val_acc {record['best_val_acc']:.2f}% "
+                              f"after {record['epochs_run']} epochs ({record['seconds']:.1f}s)"
+                              + (f": {record['error']}" if record['status'] == 'failed' else ''))
+    finally:
+        for shm, _ in blocks.values():
+            shm.close()
+            shm.unlink()
+
+    results = [recorded[key] for key in dict.fromkeys(keys)]
+    print_table(results)
+    split = stratified_split_config(args.split_seed, from_cache=bool(args.cache))
+    export_best(results, checkpoint_dir, mean, std, split, args.output)
+
+
+def hidden_sizes_arg(value):
+    return [int(width) for width in value.split(',')]
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Hyperparameter sweep for the emotion model')
+    parser.add_argument('--data', type=str, required=True, help='Path to landmarks dataset')
+    parser.add_argument('--cache', type=str, default=None, help='Memory-mapped dataset cache dir')
+    parser.add_argument('--ingest-workers', type=int, default=None, help='Processes parsing JSON samples')
+    parser.add_argument('--lr', type=float, nargs='+', default=[1e-3], help='Learning rates')
+    parser.add_argument('--batch-size', type=int, nargs='+', default=[64], help='Batch sizes')
+    parser.add_argument('--dropout', type=float, nargs='+', default=[0.3], help='Dropout rates')
+    parser.add_argument('--hidden-sizes', type=hidden_sizes_arg, nargs='+', default=[[512, 256, 128]],
+                        help='Comma-separated hidden layer widths, e.g. 512,256,128 256,128')
+    parser.add_argument('--max-trials', type=int, default=None, help='Randomly sample this many configs')
+    parser.add_argument('--epochs', type=int, default=50, help='Max epochs per trial')
+    parser.add_argument('--patience', type=int, default=10, help='Early stopping patience')
+    parser.add_argument('--prune-after', type=int, default=5, help='Epochs before median pruning applies')
+    parser.add_argument('--parallel', type=int, default=2, help='Concurrent trials')
+    parser.add_argument('--threads-per-trial', type=int, default=None,
+                        help='Intra-op threads per trial (default: cores / parallel)')
+    parser.add_argument('--seed', type=int, default=0, help='Seed for model init and --max-trials sampling')
+    parser.add_argument('--split-seed', type=int, default=42, help='Seed of the train/val/test split')
+    parser.add_argument('--out-dir', type=str, default='../sweeps', help='Results table and trial checkpoints')
+    parser.add_argument('--output', type=str, default='../emotion_model.pth', help='Best checkpoint path')
+
+    args = parser.parse_args()
+    main(args)
@@ -3,95 +3,444 @@ Training script for emotion classification model
 
 Usage:
     python train_emotion.py --data ../datasets/landmarks --epochs 50 --batch-size 64
+
+    # Convert to (and train from) the memory-mapped float32 cache
+    python train_emotion.py --data ../datasets/landmarks --cache ../datasets/landmarks_cache
+
+    # Stream shards for datasets larger than RAM (hash-based split)
+    python train_emotion.py --data ../datasets/landmarks --cache ../datasets/landmarks_cache \
+        --stream --num-workers 4
+
+    # Data-parallel training in 4 processes (gloo), cores split between them
+    python train_emotion.py --data ../datasets/landmarks --cache ../datasets/landmarks_cache --workers 4
+
+    # Temporal GRU head on windows of consecutive frames (samples carry sequence_id/frame)
+    python train_emotion.py --data ../datasets/landmark_sequences --temporal --window 16
 """
 
 import torch
 import torch.nn as nn
 import torch.optim as optim
-from torch.utils.data import Dataset, DataLoader
+from torch.nn.parallel import DistributedDataParallel
+from torch.utils.data import (
+    Dataset, IterableDataset, DataLoader, BatchSampler, RandomSampler, SequentialSampler, DistributedSampler,
+    get_worker_info
+)
 import numpy as np
 import argparse
+import time
 from pathlib import Path
-import json
 from sklearn.model_selection import train_test_split
 from sklearn.metrics import classification_report, accuracy_score
 
+from dataset_cache import (
+    EMOTION_NAMES, TRAIN, VAL, TEST, build_cache, load_cache, open_shards, feature_stats, stream_stats,
+    hash_split, infer_feature_dim, ingest, compact_rows
+)
+from profiling import StepTimer, trace_profiler
+from distributed import launch, barrier, all_reduce_metrics, join, unwrap
+
 
 class EmotionDataset(Dataset):
-    """Dataset for emotion classification from landmarks"""
+    """
+    Dataset for emotion classification from landmarks
+
+    `features` may be an in-memory array, a memmap or a ShardedArray. Rows are
+    gathered (and normalized when mean/std are given) per batch, so the
+    underlying data is never copied as a whole.
+    """
+    
+    def __init__(self, features, labels, indices=None, mean=None, std=None):
+        self.features = features
+        self.labels = torch.as_tensor(np.asarray(labels), dtype=torch.long)
+        self.indices = np.arange(len(labels)) if indices is None else np.asarray(indices)
+        self.mean = None if mean is None else np.asarray(mean, dtype=np.float32)
+        self.scale = None if std is None else (1.0 / (np.asarray(std, dtype=np.float32) + 1e-8))
+    
+    def __len__(self):
+        return len(self.indices)
+    
+    def __getitem__(self, idx):
+        """Fetch one sample, or a whole batch when given a list of indices"""
+        rows = self.indices[idx]
+        if not np.isscalar(rows):
+            # Sorted reads are sequential on memmapped shards
+            rows = np.sort(rows)
+        
+        x = np.array(self.features[rows], dtype=np.float32)
+        if self.mean is not None:
+            x -= self.mean
+            x *= self.scale
+        return torch.from_numpy(x), self.labels[rows]
+
+
+def loader_options(num_workers, device, prefetch_factor=4):
+    """DataLoader worker settings shared by the in-memory and streaming modes"""
+    options = {'num_workers': num_workers, 'pin_memory': device.type == 'cuda'}
+    if num_workers > 0:
+        options.update(prefetch_factor=prefetch_factor, persistent_workers=True)
+    return options
+
+
+def make_loader(dataset, batch_size, shuffle=False, sampler=None, **kwargs):
+    """DataLoader that fetches each batch with a single EmotionDataset lookup"""
+    if sampler is None:
+        sampler = RandomSampler(dataset) if shuffle else SequentialSampler(dataset)
+    return DataLoader(
+        dataset,
+        sampler=BatchSampler(sampler, batch_size=batch_size, drop_last=False),
+        batch_size=None,
+        **kwargs
+    )
+
+
+def make_stream_loaders(cache_dir, batch_size, rank=0, world_size=1, **kwargs):
+    """
+    Streaming train/val/test loaders over the shard cache
+
+    Splits by sample-id hash and computes normalization statistics in a
+    single pass, so nothing proportional to the dataset is held in memory.
+    Train and val are sharded across ranks; test is not (rank 0 evaluates it).
+
+    Returns:
+        (train_loader, val_loader, test_loader, mean, std)
+    """
+    shards = open_shards(cache_dir)
+    assignments = [hash_split(shard['ids']) for shard in shards]
+    mean, std = stream_stats(shards, assignments, TRAIN)
     
-    def __init__(self, features, labels):
-        self.features = torch.FloatTensor(features)
-        self.labels = torch.LongTensor(labels)
+    loaders = []
+    for split in (TRAIN, VAL, TEST):
+        sharded = split != TEST
+        stream = ShardStream(
+            cache_dir, assignments, split, mean, std, batch_size, shuffle=(split == TRAIN),
+            rank=rank if sharded else 0, world_size=world_size if sharded else 1
+        )
+        loaders.append(DataLoader(stream, batch_size=None, **kwargs))
+    return (*loaders, mean, std)
+
+
+class WindowDataset(Dataset):
+    """
+    Windows of consecutive frames for the temporal model
+
+    Batches are (x [B, window, F], y [B * window]) so the flattened per-frame
+    logits of TemporalEmotionModel line up with train_epoch/validate.
+    """
+    
+    def __init__(self, features, labels, order, starts, window, mean=None, std=None):
+        self.features = features
+        self.labels = torch.as_tensor(np.asarray(labels), dtype=torch.long)
+        self.order = order
+        self.starts = np.asarray(starts)
+        self.offsets = np.arange(window)
+        self.mean = None if mean is None else np.asarray(mean, dtype=np.float32)
+        self.scale = None if std is None else (1.0 / (np.asarray(std, dtype=np.float32) + 1e-8))
     
     def __len__(self):
-        return len(self.features)
+        return len(self.starts)
     
     def __getitem__(self, idx):
-        return self.features[idx], self.labels[idx]
+        """Fetch a batch of windows given a list of window indices"""
+        rows = self.order[self.starts[np.atleast_1d(idx)][:, None] + self.offsets]
+        x = np.array(self.features[rows.reshape(-1)], dtype=np.float32)
+        if self.mean is not None:
+            x -= self.mean
+            x *= self.scale
+        x = x.reshape(rows.shape + (x.shape[-1],))
+        return torch.from_numpy(x), self.labels[rows.reshape(-1)]
+
+
+class ShardStream(IterableDataset):
+    """
+    Streams one split of a sharded dataset cache as normalized batches
+
+    Rows are read in contiguous blocks. With shuffle, the block order is
+    permuted every epoch and rows are shuffled within groups of
+    `shuffle_blocks` blocks, so memory per worker stays bounded regardless of
+    dataset size. Blocks are divided between distributed ranks, then between
+    DataLoader workers.
+    """
+    
+    def __init__(self, cache_dir, assignments, split, mean, std, batch_size,
+                 shuffle=False, seed=42, block_rows=2048, shuffle_blocks=8, rank=0, world_size=1):
+        self.cache_dir = str(cache_dir)
+        self.assignments = assignments
+        self.split = split
+        self.mean = np.asarray(mean, dtype=np.float32)
+        self.scale = 1.0 / (np.asarray(std, dtype=np.float32) + 1e-8)
+        self.batch_size = batch_size
+        self.shuffle = shuffle
+        self.seed = seed
+        self.block_rows = block_rows
+        self.shuffle_blocks = shuffle_blocks if shuffle else 1
+        self.rank = rank
+        self.world_size = world_size
+        self.epoch = 0
+        self.blocks = [
+            (shard, start, min(start + block_rows, len(assignment)))
+            for shard, assignment in enumerate(assignments)
+            for start in range(0, len(assignment), block_rows)
+            if (assignment[start:start + block_rows] == split).any()
+        ]
+    
+    def set_epoch(self, epoch):
+        """Reseed the shuffle (workers are re-created from this copy unless persistent)"""
+        self.epoch = epoch
+    
+    def num_samples(self):
+        return int(sum((a == self.split).sum() for a in self.assignments))
+    
+    def __iter__(self):
+        # Persistent workers keep their own copy, so advance the epoch here too
+        epoch = self.epoch
+        self.epoch += 1
+        
+        blocks = self.blocks
+        if self.shuffle:
+            # Same permutation in every rank and worker, then each takes its share
+            order = np.random.default_rng([self.seed, epoch]).permutation(len(blocks))
+            blocks = [blocks[i] for i in order]
+        blocks = blocks[self.rank::self.world_size]
+        
+        worker = get_worker_info()
+        worker_id = 0
+        if worker is not None:
+            worker_id = worker.id
+            blocks = blocks[worker.id::worker.num_workers]
+        rng = np.random.default_rng([self.seed, epoch, self.rank, worker_id])
+        
+        shards = open_shards(self.cache_dir)
+        pending_x = np.empty((0, len(self.mean)), dtype=np.float32)
+        pending_y = np.empty(0, dtype=np.int64)
+        
+        for group in range(0, len(blocks), self.shuffle_blocks):
+            xs, ys = [pending_x], [pending_y]
+            for shard, start, end in blocks[group:group + self.shuffle_blocks]:
+                mask = self.assignments[shard][start:end] == self.split
+                xs.append(shards[shard]['features'][start:end][mask])
+                ys.append(shards[shard]['labels'][start:end][mask])
+            x = np.concatenate(xs)
+            y = np.concatenate(ys)
+            
+            if self.shuffle:
+                perm = rng.permutation(len(x))
+                x, y = x[perm], y[perm]
+            
+            full = len(x) - len(x) % self.batch_size
+            for start in range(0, full, self.batch_size):
+                yield self._batch(x[start:start + self.batch_size], y[start:start + self.batch_size])
+            pending_x, pending_y = x[full:], y[full:]
+        
+        if len(pending_x):
+            yield self._batch(pending_x, pending_y)
+    
+    def _batch(self, x, y):
+        x = (x - self.mean) * self.scale
+        return torch.from_numpy(x), torch.from_numpy(y)
 
 
 class EmotionModel(nn.Module):
     """Simple fully connected model for emotion classification"""
     
-    def __init__(self, input_size=1536, num_emotions=7, dropout=0.3):
+    def __init__(self, input_size=1536, num_emotions=7, dropout=0.3, hidden_sizes=(512, 256, 128)):
         super().__init__()
         
-        self.fc = nn.Sequential(
-            nn.Linear(input_size, 512),
-            nn.BatchNorm1d(512),
-            nn.ReLU(),
-            nn.Dropout(dropout),
-            
-            nn.Linear(512, 256),
-            nn.BatchNorm1d(256),
-            nn.ReLU(),
-            nn.Dropout(dropout),
-            
-            nn.Linear(256, 128),
-            nn.BatchNorm1d(128),
-            nn.ReLU(),
-            nn.Dropout(dropout),
-            
-            nn.Linear(128, num_emotions)
-        )
+        layers = []
+        in_features = input_size
+        for hidden in hidden_sizes:
+            layers += [
+                nn.Linear(in_features, hidden),
+                nn.BatchNorm1d(hidden),
+                nn.ReLU(),
+                nn.Dropout(dropout),
+            ]
+            in_features = hidden
+        layers.append(nn.Linear(in_features, num_emotions))
+        
+        self.fc = nn.Sequential(*layers)
     
     def forward(self, x):
         return self.fc(x)
 
 
-def load_data(data_path):
+def hidden_sizes_from_state_dict(state_dict):
+    """Hidden layer widths of a saved EmotionModel"""
+    linear_weights = sorted(
+        (int(key.split('.')[1]), tensor.shape[0])
+        for key, tensor in state_dict.items()
+        if key.startswith('fc.') and key.endswith('.weight') and tensor.dim() == 2
+    )
+    return [width for _, width in linear_weights[:-1]]
+
+
+class TemporalEmotionModel(nn.Module):
     """
-    Load landmark features and labels
-    Expected format: JSON files with 'features' and 'label' keys
+    Per-frame encoder followed by a GRU over time
+
+    The model is causal, so at serving time it runs one frame at a time with
+    step() and a carried hidden state instead of re-reading a window.
     """
+    
+    def __init__(self, input_size=1536, num_emotions=7, hidden_size=128, frame_sizes=(256,), dropout=0.3):
+        super().__init__()
+        
+        layers = []
+        in_features = input_size
+        for width in frame_sizes:
+            layers += [
+                nn.Linear(in_features, width),
+                nn.LayerNorm(width),
+                nn.ReLU(),
+                nn.Dropout(dropout),
+            ]
+            in_features = width
+        
+        self.encoder = nn.Sequential(*layers)
+        self.gru = nn.GRU(in_features, hidden_size, batch_first=True)
+        self.head = nn.Linear(hidden_size, num_emotions)
+    
+    def forward(self, x):
+        """Windows [B, T, F] -> per-frame logits flattened to [B * T, C]"""
+        out, _ = self.gru(self.encoder(x))
+        return self.head(out).reshape(-1, self.head.out_features)
+    
+    def step(self, x, h):
+        """One new frame per sequence: x [B, F], h [B, H] -> (logits [B, C], h [B, H])"""
+        out, h = self.gru(self.encoder(x).unsqueeze(1), h.unsqueeze(0))
+        return self.head(out[:, 0]), h[0]
+
+
+def _load_json(data_path, workers=None):
+    """Parse every JSON sample; returns (features, labels, sequences) without malformed rows"""
     data_path = Path(data_path)
+    files = sorted(data_path.glob('*.json'))
     
-    features = []
-    labels = []
+    features = np.empty((len(files), infer_feature_dim(files)), dtype=np.float32)
+    labels, valid, sequences = ingest(files, features, workers)
     
-    # Load all JSON files
-    for json_file in data_path.glob('*.json'):
-        with open(json_file, 'r') as f:
-            data = json.load(f)
-            features.append(data['features'])
-            labels.append(data['label'])
+    count = compact_rows(features, valid)
+    sequences = [seq if seq[0] is not None else (path.stem, 0) for seq, path, ok in zip(sequences, files, valid) if ok]
+    return features[:count], labels[valid], sequences
+
+
+def load_data(data_path, workers=None):
+    """
+    Load landmark features and labels
+    Expected format: JSON files with 'features' and 'label' keys
+
+    Files are parsed by `workers` processes into a preallocated float32
+    array; malformed samples are logged and skipped.
+    """
+    features, labels, _ = _load_json(data_path, workers)
+    return features, labels
+
+
+def load_sequences(data_path, workers=None):
+    """
+    Load samples with their sequence ids and frame indices
+
+    Samples may carry optional 'sequence_id' and 'frame' keys (consecutive
+    frames of one recording); samples without them are single-frame sequences.
+
+    Returns:
+        (features, labels, sequence_ids, frames)
+    """
+    features, labels, sequences = _load_json(data_path, workers)
+    sequence_ids = [sequence_id for sequence_id, _ in sequences]
+    frames = np.array([frame for _, frame in sequences], dtype=np.int64)
+    return features, labels, sequence_ids, frames
+
+
+def sequence_windows(sequence_ids, frames, window, stride):
+    """
+    Cut every sequence into windows of `window` consecutive frames
+
+    Returns:
+        (order, starts, window_sequences): rows sorted by (sequence, frame),
+        the offset into `order` where each window starts, and each window's
+        sequence id. Sequences shorter than `window` are skipped.
+    """
+    order = np.array(sorted(range(len(frames)), key=lambda i: (sequence_ids[i], frames[i])), dtype=np.int64)
     
-    return np.array(features), np.array(labels)
+    starts, window_sequences = [], []
+    begin = 0
+    while begin < len(order):
+        sequence_id = sequence_ids[order[begin]]
+        end = begin
+        while end < len(order) and sequence_ids[order[end]] == sequence_id:
+            end += 1
+        for start in range(begin, end - window + 1, stride):
+            starts.append(start)
+            window_sequences.append(sequence_id)
+        begin = end
+    return order, np.array(starts, dtype=np.int64), window_sequences
+
+
+def split_indices(labels, seed=42):
+    """Stratified 70/15/15 train/val/test split of sample indices"""
+    labels = np.asarray(labels)
+    indices = np.arange(len(labels))
+    train_idx, temp_idx = train_test_split(
+        indices, test_size=0.3, random_state=seed, stratify=labels
+    )
+    val_idx, test_idx = train_test_split(
+        temp_idx, test_size=0.5, random_state=seed, stratify=labels[temp_idx]
+    )
+    return train_idx, val_idx, test_idx
+
+
+def split_config(args):
+    """
+    How train/val/test were split, stored in the checkpoint so evaluation
+    tools (quantize_emotion.py) can rebuild the same test set
+    """
+    if args.temporal:
+        return {'mode': 'hash', 'unit': 'sequence'}
+    if args.stream:
+        return {'mode': 'hash', 'unit': 'sample', 'source': 'cache'}
+    return stratified_split_config(42, from_cache=bool(args.cache))
+
+
+def stratified_split_config(seed, from_cache):
+    """Split record of split_indices(labels, seed) over the JSON files or the cache"""
+    # Stratified over rows in load order, which differs between the JSON files and the cache
+    return {'mode': 'stratified', 'seed': seed, 'source': 'cache' if from_cache else 'json'}
+
+
+def split_data(features, labels, seed=42):
+    """Stratified 70/15/15 train/val/test split"""
+    labels = np.asarray(labels)
+    train_idx, val_idx, test_idx = split_indices(labels, seed)
+    return tuple((features[idx], labels[idx]) for idx in (train_idx, val_idx, test_idx))
+
 
+def train_epoch(model, loader, criterion, optimizer, device, timer=None):
+    """
+    Train for one epoch
 
-def train_epoch(model, loader, criterion, optimizer, device):
-    """Train for one epoch"""
+    Loss and accuracy are accumulated on the device and read back once at the
+    end, so steps don't wait on a host sync. Pass a profiling.StepTimer as
+    `timer` to split the epoch into data-loading and compute time.
+    
+    Returns (mean loss, accuracy, samples); a rank with an empty shard gets
+    (0.0, 0.0, 0), which all_reduce_metrics weights out.
+    """
     model.train()
-    total_loss = 0
-    correct = 0
+    total_loss = torch.zeros((), device=device)
+    correct = torch.zeros((), dtype=torch.long, device=device)
     total = 0
     
+    if timer:
+        timer.start()
     for features, labels in loader:
-        features, labels = features.to(device), labels.to(device)
+        if timer:
+            timer.loaded()
+        features = features.to(device, non_blocking=True)
+        labels = labels.to(device, non_blocking=True)
         
         # Forward pass
-        optimizer.zero_grad()
+        optimizer.zero_grad(set_to_none=True)
         outputs = model(features)
         loss = criterion(outputs, labels)
         
@@ -100,85 +449,167 @@ def train_epoch(model, loader, criterion, optimizer, device):
         optimizer.step()
         
         # Statistics
-        total_loss += loss.item()
-        _, predicted = outputs.max(1)
+        total_loss += loss.detach() * labels.size(0)
+        correct += outputs.detach().argmax(1).eq(labels).sum()
         total += labels.size(0)
-        correct += predicted.eq(labels).sum().item()
+        if timer:
+            timer.done(labels.size(0))
+    if timer:
+        timer.stop()
     
-    return total_loss / len(loader), 100. * correct / total
+    if not total:
+        return 0.0, 0.0, 0
+    return total_loss.item() / total, 100. * correct.item() / total, total
 
 
 def validate(model, loader, criterion, device):
-    """Validate model"""
+    """Validate model; an empty loader gives (0.0, 0.0, [], [])"""
     model.eval()
-    total_loss = 0
-    correct = 0
+    total_loss = torch.zeros((), device=device)
     total = 0
     all_preds = []
     all_labels = []
     
     with torch.no_grad():
         for features, labels in loader:
-            features, labels = features.to(device), labels.to(device)
+            features = features.to(device, non_blocking=True)
+            labels = labels.to(device, non_blocking=True)
             
             outputs = model(features)
-            loss = criterion(outputs, labels)
-            
-            total_loss += loss.item()
-            _, predicted = outputs.max(1)
+            total_loss += criterion(outputs, labels) * labels.size(0)
             total += labels.size(0)
-            correct += predicted.eq(labels).sum().item()
             
-            all_preds.extend(predicted.cpu().numpy())
-            all_labels.extend(labels.cpu().numpy())
+            all_preds.append(outputs.argmax(1))
+            all_labels.append(labels)
+    
+    if not total:
+        return 0.0, 0.0, np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64)
     
-    accuracy = 100. * correct / total
-    return total_loss / len(loader), accuracy, all_preds, all_labels
+    # Single transfer back to the host
+    all_preds = torch.cat(all_preds).cpu().numpy()
+    all_labels = torch.cat(all_labels).cpu().numpy()
+    accuracy = 100. * float((all_preds == all_labels).mean())
+    return total_loss.item() / total, accuracy, all_preds, all_labels
 
 
-def main(args):
-    # Device
-    device = torch.device('cuda' if torch.cuda.is_available() else 'cpu')
-    print(f"Using device: {device}")
-    
-    # Load data
-    print("Loading data...")
-    features, labels = load_data(args.data)
-    print(f"Loaded {len(features)} samples")
+def train(rank, world_size, args):
+    """
+    Training run for one process
+
+    With world_size > 1 this runs in every rank: gradients are all-reduced by
+    DistributedDataParallel, validation metrics are all-reduced so the LR
+    schedule and early stopping agree, and only rank 0 writes the checkpoint
+    and evaluates the test set.
+    """
+    is_main = rank == 0
+    distributed = world_size > 1
     
-    # Split data
-    X_train, X_temp, y_train, y_temp = train_test_split(
-        features, labels, test_size=0.3, random_state=42, stratify=labels
-    )
-    X_val, X_test, y_val, y_test = train_test_split(
-        X_temp, y_temp, test_size=0.5, random_state=42, stratify=y_temp
-    )
+    def log(*values):
+        if is_main:
+            print(*values)
     
-    print(f"Train: {len(X_train)}, Val: {len(X_val)}, Test: {len(X_test)}")
+    # Device
+    device = torch.device('cuda' if torch.cuda.is_available() and not distributed else 'cpu')
+    log(f"Using device: {device}" + (f" ({world_size} workers x {torch.get_num_threads()} threads)" if distributed else ""))
     
-    # Normalize features
-    mean = X_train.mean(axis=0)
-    std = X_train.std(axis=0)
-    X_train = (X_train - mean) / (std + 1e-8)
-    X_val = (X_val - mean) / (std + 1e-8)
-    X_test = (X_test - mean) / (std + 1e-8)
+    options = loader_options(args.num_workers, device)
     
-    # Create datasets
-    train_dataset = EmotionDataset(X_train, y_train)
-    val_dataset = EmotionDataset(X_val, y_val)
-    test_dataset = EmotionDataset(X_test, y_test)
+    # Only rank 0 converts new JSON files; the others wait and then map the shards
+    if args.cache and is_main:
+        build_cache(args.data, args.cache, workers=args.ingest_workers)
+    barrier()
     
-    # Create dataloaders
-    train_loader = DataLoader(train_dataset, batch_size=args.batch_size, shuffle=True)
-    val_loader = DataLoader(val_dataset, batch_size=args.batch_size)
-    test_loader = DataLoader(test_dataset, batch_size=args.batch_size)
+    if args.temporal:
+        # Windows of consecutive frames, split by sequence so no recording spans two splits
+        log("Loading sequences...")
+        features, labels, sequence_ids, frames = load_sequences(args.data, args.ingest_workers)
+        order, starts, window_sequences = sequence_windows(sequence_ids, frames, args.window, args.window_stride)
+        if len(starts) == 0:
+            raise ValueError(f"No sequences with at least {args.window} frames in {args.data}")
+        
+        unique_sequences = sorted(set(window_sequences))
+        split_of = dict(zip(unique_sequences, hash_split(unique_sequences)))
+        window_split = np.array([split_of[sequence_id] for sequence_id in window_sequences])
+        train_starts, val_starts, test_starts = (starts[window_split == split] for split in (TRAIN, VAL, TEST))
+        log(f"Windows of {args.window} frames from {len(unique_sequences)} sequences - "
+            f"Train: {len(train_starts)}, Val: {len(val_starts)}, Test: {len(test_starts)}")
+        
+        train_rows = np.unique(order[train_starts[:, None] + np.arange(args.window)])
+        mean, std = feature_stats(features, train_rows)
+        
+        train_dataset = WindowDataset(features, labels, order, train_starts, args.window, mean, std)
+        val_dataset = WindowDataset(
+            features, labels, order, np.array_split(val_starts, world_size)[rank], args.window, mean, std
+        )
+        test_dataset = WindowDataset(features, labels, order, test_starts, args.window, mean, std)
+        
+        train_sampler = None
+        if distributed:
+            train_sampler = DistributedSampler(train_dataset, num_replicas=world_size, rank=rank, shuffle=True)
+        train_loader = make_loader(train_dataset, args.batch_size, shuffle=True, sampler=train_sampler, **options)
+        val_loader = make_loader(val_dataset, args.batch_size, **options)
+        test_loader = make_loader(test_dataset, args.batch_size, **options)
+    elif args.stream:
+        # Stream shards from the cache; only labels and split assignments live in memory
+        log("Streaming data from cache...")
+        train_loader, val_loader, test_loader, mean, std = make_stream_loaders(
+            args.cache, args.batch_size, rank, world_size, **options
+        )
+        labels = np.concatenate([shard['labels'] for shard in open_shards(args.cache)])
+        log(f"Train: {train_loader.dataset.num_samples()}, Val: {val_loader.dataset.num_samples()}, "
+            f"Test: {test_loader.dataset.num_samples()}")
+        train_sampler = None
+    else:
+        # Load data
+        log("Loading data...")
+        if args.cache:
+            features, labels, _ = load_cache(args.cache)
+        else:
+            features, labels = load_data(args.data, args.ingest_workers)
+        log(f"Loaded {len(labels)} samples")
+        
+        # Split data
+        train_idx, val_idx, test_idx = split_indices(labels)
+        
+        log(f"Train: {len(train_idx)}, Val: {len(val_idx)}, Test: {len(test_idx)}")
+        
+        # Normalization statistics (applied per batch by EmotionDataset)
+        mean, std = feature_stats(features, train_idx)
+        
+        # Create datasets (each rank validates its own slice of the val split)
+        train_dataset = EmotionDataset(features, labels, train_idx, mean, std)
+        val_dataset = EmotionDataset(features, labels, np.array_split(val_idx, world_size)[rank], mean, std)
+        test_dataset = EmotionDataset(features, labels, test_idx, mean, std)
+        
+        # Create dataloaders
+        train_sampler = None
+        if distributed:
+            train_sampler = DistributedSampler(train_dataset, num_replicas=world_size, rank=rank, shuffle=True)
+        train_loader = make_loader(train_dataset, args.batch_size, shuffle=True, sampler=train_sampler, **options)
+        val_loader = make_loader(val_dataset, args.batch_size, **options)
+        test_loader = make_loader(test_dataset, args.batch_size, **options)
     
     # Create model
-    input_size = features.shape[1]
+    input_size = len(mean)
     num_emotions = len(np.unique(labels))
-    model = EmotionModel(input_size=input_size, num_emotions=num_emotions).to(device)
+    if args.temporal:
+        config = {'architecture': 'temporal', 'hidden_size': args.gru_hidden, 'frame_sizes': list(args.hidden_sizes),
+                  'dropout': args.dropout, 'window': args.window}
+        model = TemporalEmotionModel(
+            input_size=input_size, num_emotions=num_emotions, hidden_size=args.gru_hidden,
+            frame_sizes=args.hidden_sizes, dropout=args.dropout
+        ).to(device)
+    else:
+        config = {'architecture': 'mlp', 'hidden_sizes': list(args.hidden_sizes), 'dropout': args.dropout}
+        model = EmotionModel(
+            input_size=input_size, num_emotions=num_emotions, dropout=args.dropout, hidden_sizes=args.hidden_sizes
+        ).to(device)
+    config.update(lr=args.lr, batch_size=args.batch_size, split=split_config(args))
+    
+    log(f"Model: {sum(p.numel() for p in model.parameters())} parameters")
     
-    print(f"Model: {sum(p.numel() for p in model.parameters())} parameters")
+    if distributed:
+        model = DistributedDataParallel(model)
     
     # Loss and optimizer
     criterion = nn.CrossEntropyLoss()
@@ -189,52 +620,91 @@ def main(args):
     best_val_acc = 0
     patience_counter = 0
     
-    print("\nTraining...")
+    log("\nTraining...")
     for epoch in range(args.epochs):
-        train_loss, train_acc = train_epoch(model, train_loader, criterion, optimizer, device)
-        val_loss, val_acc, _, _ = validate(model, val_loader, criterion, device)
+        epoch_start = time.perf_counter()
+        if args.stream:
+            train_loader.dataset.set_epoch(epoch)
+        if train_sampler is not None:
+            train_sampler.set_epoch(epoch)
+        
+        timer = None
+        with join(model):
+            if args.profile:
+                # torch.profiler trace covers the first epoch (of rank 0) only
+                trace_path = args.profile_trace if epoch == 0 and is_main else None
+                with trace_profiler(trace_path, device, args.profile_steps) as prof:
+                    timer = StepTimer(device, prof if trace_path else None)
+                    train_loss, train_acc, train_count = train_epoch(
+                        model, train_loader, criterion, optimizer, device, timer
+                    )
+            else:
+                train_loss, train_acc, train_count = train_epoch(model, train_loader, criterion, optimizer, device)
+        # Unwrapped: DDP forwards broadcast buffers, which would deadlock on uneven val shards
+        val_loss, val_acc, val_preds, _ = validate(unwrap(model), val_loader, criterion, device)
+        
+        # Identical on every rank from here on; ranks with empty shards carry no weight
+        train_loss, train_acc = all_reduce_metrics(train_loss, train_acc, train_count)
+        val_loss, val_acc = all_reduce_metrics(val_loss, val_acc, len(val_preds))
         
         scheduler.step(val_acc)
         
-        print(f"Epoch {epoch+1}/{args.epochs}:")
-        print(f"  Train Loss: {train_loss:.4f}, Train Acc: {train_acc:.2f}%")
-        print(f"  Val Loss: {val_loss:.4f}, Val Acc: {val_acc:.2f}%")
+        log(f"Epoch {epoch+1}/{args.epochs}:")
+        log(f"  Train Loss: {train_loss:.4f}, Train Acc: {train_acc:.2f}%")
+        log(f"  Val Loss: {val_loss:.4f}, Val Acc: {val_acc:.2f}%")
+        if timer:
+            log(f"  Profile: {timer.report()} | epoch {time.perf_counter() - epoch_start:.2f}s")
         
         # Save best model
         if val_acc > best_val_acc:
             best_val_acc = val_acc
-            torch.save({
-                'epoch': epoch,
-                'model_state_dict': model.state_dict(),
-                'optimizer_state_dict': optimizer.state_dict(),
-                'val_acc': val_acc,
-                'mean': mean,
-                'std': std,
-            }, args.output)
-            print(f"  ✓ Saved best model (val_acc: {val_acc:.2f}%)")
+            if is_main:
+                torch.save({
+                    'epoch': epoch,
+                    'model_state_dict': unwrap(model).state_dict(),
+                    'optimizer_state_dict': optimizer.state_dict(),
+                    'val_acc': val_acc,
+                    'mean': mean,
+                    'std': std,
+                    'config': config,
+                }, args.output)
+            log(f"  ✓ Saved best model (val_acc: {val_acc:.2f}%)")
             patience_counter = 0
         else:
             patience_counter += 1
         
         # Early stopping
         if patience_counter >= args.patience:
-            print(f"Early stopping after {epoch+1} epochs")
+            log(f"Early stopping after {epoch+1} epochs")
             break
     
+    if not is_main:
+        return
+    
     # Test evaluation
     print("\nEvaluating on test set...")
+    model = unwrap(model)
     checkpoint = torch.load(args.output)
     model.load_state_dict(checkpoint['model_state_dict'])
     _, test_acc, test_preds, test_labels = validate(model, test_loader, criterion, device)
     
     print(f"Test Accuracy: {test_acc:.2f}%")
     print("\nClassification Report:")
-    emotion_names = ['happy', 'sad', 'neutral', 'angry', 'surprised', 'fearful', 'disgusted']
-    print(classification_report(test_labels, test_preds, target_names=emotion_names[:num_emotions]))
+    print(classification_report(
+        test_labels, test_preds, labels=list(range(num_emotions)),
+        target_names=EMOTION_NAMES[:num_emotions], zero_division=0
+    ))
     
     print(f"\nModel saved to: {args.output}")
 
 
+def main(args):
+    if args.workers > 1:
+        launch(train, args.workers, (args,), threads=args.threads_per_worker)
+    else:
+        train(0, 1, args)
+
+
 if __name__ == '__main__':
     parser = argparse.ArgumentParser(description='Train emotion classification model')
     parser.add_argument('--data', type=str, required=True, help='Path to landmarks dataset')
@@ -242,8 +712,36 @@ if __name__ == '__main__':
     parser.add_argument('--batch-size', type=int, default=64, help='Batch size')
     parser.add_argument('--lr', type=float, default=0.001, help='Learning rate')
     parser.add_argument('--patience', type=int, default=10, help='Early stopping patience')
+    parser.add_argument('--dropout', type=float, default=0.3, help='Dropout after each hidden layer')
+    parser.add_argument('--hidden-sizes', type=int, nargs='+', default=[512, 256, 128],
+                        help='Hidden layer widths (per-frame encoder widths with --temporal)')
+    parser.add_argument('--temporal', action='store_true',
+                        help='Train the GRU sequence model on windows of consecutive frames')
+    parser.add_argument('--window', type=int, default=16, help='Frames per training window (--temporal)')
+    parser.add_argument('--window-stride', type=int, default=8, help='Frames between window starts (--temporal)')
+    parser.add_argument('--gru-hidden', type=int, default=128, help='GRU hidden state size (--temporal)')
     parser.add_argument('--output', type=str, default='../emotion_model.pth', help='Output model path')
+    parser.add_argument('--cache', type=str, default=None,
+                        help='Memory-mapped dataset cache dir (built/updated from --data)')
+    parser.add_argument('--ingest-workers', type=int, default=None,
+                        help='Processes parsing JSON samples (default: all cores)')
+    parser.add_argument('--stream', action='store_true',
+                        help='Stream shards from --cache instead of indexing them (hash-based split)')
+    parser.add_argument('--num-workers', type=int, default=0, help='DataLoader worker processes')
+    parser.add_argument('--workers', type=int, default=1,
+                        help='Data-parallel training processes (gloo); --batch-size is per worker')
+    parser.add_argument('--threads-per-worker', type=int, default=None,
+                        help='Intra-op threads per training process (default: cores / workers)')
+    parser.add_argument('--profile', action='store_true',
+                        help='Report samples/s, data vs compute time and peak RSS per epoch')
+    parser.add_argument('--profile-trace', type=str, default=None,
+                        help='With --profile, write a torch.profiler Chrome trace of the first epoch here')
+    parser.add_argument('--profile-steps', type=int, default=20, help='Training steps captured in the trace')
     
     args = parser.parse_args()
+    if args.stream and not args.cache:
+        parser.error('--stream requires --cache')
+    if args.temporal and (args.stream or args.cache):
+        parser.error('--temporal reads sequence metadata from the JSON samples; drop --cache/--stream')
     main(args)
 